@@ -1,43 +1,541 @@
+import time
+inicio_script = time.perf_counter()
 import json
-import pandas_ta as ta
-import numpy as np
-import MetaTrader5 as mt5
-import pandas as pd
+import importlib
 from datetime import datetime, timedelta
-import pytz
-from apscheduler.schedulers.blocking import BlockingScheduler
-import time
 import logging
 import traceback
 import os
-from functools import lru_cache
 import sys
+import math
+import operator
+import random
+import heapq
+import bisect
+import threading
+import queue
+import atexit
+import functools
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, TimeoutError as FuturesTimeoutError
+from collections import deque, OrderedDict, namedtuple
+from abc import ABC, abstractmethod
 
-# Configuración de logging
-log_directory = "logs"
-os.makedirs(log_directory, exist_ok=True)
-log_file = os.path.join(log_directory, f"trading_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file),
-        logging.StreamHandler()
-    ]
-)
+class _FicheroEnLotes(logging.FileHandler):
+    # FileHandler que, en modo asíncrono, deja el flush al escritor en segundo plano (uno por lote)
+    en_lotes = False
+
+    def flush(self):
+        if not self.en_lotes:
+            super().flush()
+
+    def vaciar(self):
+        super().flush()
+
+class ModuloPerezoso:
+    # Importa el módulo en el primer acceso a un atributo. NumPy, pandas y pandas_ta son casi todo el
+    # tiempo de arranque y ni la importación del script ni --check los necesitan. Cada atributo se
+    # guarda en la instancia la primera vez: los siguientes accesos no pasan por __getattr__.
+    def __init__(self, nombre):
+        self._nombre = nombre
+        self._modulo = None
+
+    def __getattr__(self, atributo):
+        if self._modulo is None:
+            self._modulo = importlib.import_module(self._nombre)
+        valor = getattr(self._modulo, atributo)
+        setattr(self, atributo, valor)
+        return valor
+
+np = ModuloPerezoso('numpy')
+pd = ModuloPerezoso('pandas')
+ta = ModuloPerezoso('pandas_ta')
+pytz = ModuloPerezoso('pytz')
+
+class Perezoso:
+    # Difiere el cálculo de un argumento de log hasta que el mensaje se formatea de verdad
+    def __init__(self, funcion):
+        self.funcion = funcion
+
+    def __str__(self):
+        return str(self.funcion())
+
+class _HandlerCola(logging.Handler):
+    # Encola el registro sin formatearlo; el formateo y la escritura ocurren en el hilo escritor
+    def __init__(self, escritor, destinos):
+        super().__init__()
+        self.escritor = escritor
+        self.destinos = destinos
+
+    def emit(self, record):
+        self.escritor.cola.put(('log', record, self.destinos))
+
+class EscritorSegundoPlano:
+    # Hilo único que vacía en lotes una cola con registros de logging y escrituras de ficheros de
+    # auditoría. Mantiene los ficheros abiertos y hace un solo flush por lote. Mientras no se inicia,
+    # las escrituras se hacen de forma síncrona como antes.
+    def __init__(self, max_lote=1000):
+        self.cola = queue.SimpleQueue()
+        self.max_lote = max_lote
+        self.archivos = {}
+        self.cierres = []
+        self.hilo = None
+
+    def iniciar(self):
+        if self.hilo is None:
+            self.hilo = threading.Thread(target=self._bucle, name="escritor-logs", daemon=True)
+            self.hilo.start()
+            atexit.register(self.detener)
+
+    def escribir(self, ruta, partes):
+        if self.hilo is None:
+            with open(ruta, "a") as f:
+                f.write(self._texto(partes))
+        else:
+            self.cola.put(('fichero', ruta, partes))
+
+    def lote(self, consumidor, fila):
+        # Las filas encoladas para un mismo consumidor se le entregan juntas, una llamada por lote
+        if self.hilo is None:
+            consumidor([fila])
+        else:
+            self.cola.put(('lote', consumidor, fila))
+
+    def al_cerrar(self, funcion):
+        # Recursos propios de los consumidores (conexiones, etc.) que se liberan junto a los ficheros
+        self.cierres.append(funcion)
+
+    def vaciar(self, cerrar_archivos=False, timeout=10):
+        # Espera a que se haya escrito todo lo encolado hasta ahora
+        if self.hilo is not None:
+            evento = threading.Event()
+            self.cola.put(('marca', evento, cerrar_archivos))
+            evento.wait(timeout)
+
+    def detener(self):
+        if self.hilo is not None:
+            self.cola.put(('fin', None, None))
+            self.hilo.join(timeout=10)
+            self.hilo = None
+
+    @staticmethod
+    def _texto(partes):
+        return ''.join(str(parte()) if callable(parte) else str(parte) for parte in partes)
+
+    def _cerrar_archivos(self):
+        for f in self.archivos.values():
+            f.close()
+        self.archivos.clear()
+        for funcion in self.cierres:
+            try:
+                funcion()
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
 
+    def _bucle(self):
+        while True:
+            lote = [self.cola.get()]
+            while len(lote) < self.max_lote:
+                try:
+                    lote.append(self.cola.get_nowait())
+                except queue.Empty:
+                    break
+            tocados = set()
+            lotes = {}
+            marcas = []
+            fin = False
+            for tipo, a, b in lote:
+                try:
+                    if tipo == 'log':
+                        for handler in b:
+                            if a.levelno >= handler.level:
+                                handler.handle(a)
+                                tocados.add(handler)
+                    elif tipo == 'fichero':
+                        f = self.archivos.get(a)
+                        if f is None:
+                            f = self.archivos[a] = open(a, "a")
+                        f.write(self._texto(b))
+                        tocados.add(f)
+                    elif tipo == 'lote':
+                        lotes.setdefault(a, []).append(b)
+                    elif tipo == 'marca':
+                        marcas.append((a, b))
+                    else:
+                        fin = True
+                except Exception:
+                    traceback.print_exc(file=sys.stderr)
+            for consumidor, filas in lotes.items():
+                try:
+                    consumidor(filas)
+                except Exception:
+                    traceback.print_exc(file=sys.stderr)
+            for destino in tocados:
+                try:
+                    destino.vaciar() if isinstance(destino, _FicheroEnLotes) else destino.flush()
+                except Exception:
+                    traceback.print_exc(file=sys.stderr)
+            for evento, cerrar_archivos in marcas:
+                if cerrar_archivos:
+                    self._cerrar_archivos()
+                evento.set()
+            if fin:
+                self._cerrar_archivos()
+                return
+
+escritor = EscritorSegundoPlano()
+
+log_directory = "logs"
 # Agregar un nuevo logger para registros detallados
 detailed_logger = logging.getLogger('detailed_logger')
-detailed_log_file = os.path.join(log_directory, f"detailed_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
-detailed_handler = logging.FileHandler(detailed_log_file)
-detailed_handler.setLevel(logging.DEBUG)
-detailed_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-detailed_handler.setFormatter(detailed_formatter)
-detailed_logger.addHandler(detailed_handler)
-
-def cargar_configuracion():
+
+def preparar_logging(sufijo=""):
+    # Configuración de logging, desde inicializar(): un fichero general y otro detallado por proceso
+    # (los shards añaden su índice al nombre). Los ficheros se crean con la primera línea escrita.
+    if detailed_logger.handlers:
+        return
+    os.makedirs(log_directory, exist_ok=True)
+    log_file = os.path.join(log_directory, f"trading_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}{sufijo}.log")
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            _FicheroEnLotes(log_file, delay=True),
+            logging.StreamHandler()
+        ]
+    )
+
+    detailed_log_file = os.path.join(log_directory, f"detailed_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}{sufijo}.log")
+    detailed_handler = _FicheroEnLotes(detailed_log_file, delay=True)
+    detailed_handler.setLevel(logging.DEBUG)
+    detailed_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    detailed_handler.setFormatter(detailed_formatter)
+    detailed_logger.addHandler(detailed_handler)
+
+def configurar_logging(nivel, asincrono=True):
+    # Nivel configurable y, en modo asíncrono, los handlers pasan al escritor en segundo plano: el
+    # hilo que registra solo encola el LogRecord y no espera a disco
+    logging.getLogger().setLevel(nivel)
+    if not asincrono:
+        return
+    for logger in (logging.getLogger(), detailed_logger):
+        destinos = [h for h in logger.handlers if not isinstance(h, _HandlerCola)]
+        for handler in destinos:
+            logger.removeHandler(handler)
+            if isinstance(handler, _FicheroEnLotes):
+                handler.en_lotes = True
+        logger.addHandler(_HandlerCola(escritor, destinos))
+    escritor.iniciar()
+
+def auditar(ruta, *partes):
+    # Ficheros de auditoría en texto (registro_dataframe_*, size_log_*, registro_dataframe.txt), solo con
+    # audit_format "text". Las partes pueden ser funciones, que solo se evalúan en el hilo escritor.
+    if audit_logging and audit_format == "text":
+        escritor.escribir(ruta, partes)
+
+def _valor_sql(valor):
+    # sqlite3 no acepta tipos de NumPy ni Timestamps; los tiempos se guardan en segundos epoch UTC
+    if isinstance(valor, np.generic):
+        valor = valor.item()
+    if isinstance(valor, (pd.Timestamp, datetime)):
+        return valor.timestamp() if valor.tzinfo is not None else (valor - datetime(1970, 1, 1)).total_seconds()
+    if isinstance(valor, float) and math.isnan(valor):
+        return None
+    return valor
+
+class Journal:
+    # Diario estructurado de solo-anexado en SQLite, un fichero por día UTC (journal_YYYYMMDD.sqlite).
+    # Cada tabla lleva ts (segundos epoch del registro) y symbol, con índice (symbol, ts) para consultar
+    # rangos. Las filas se insertan con executemany desde el hilo escritor, una transacción por lote.
+    TABLAS = {
+        "barras": ["ts", "symbol", "time", "open", "high", "low", "close", "tick_volume", "spread", "real_volume"],
+        "senales": ["ts", "symbol", "time", "strategy", "close", "rsi", "atr", "vwap", "bb_lower", "bb_middle",
+                    "bb_upper", "senal", "slatr", "pip_value", "equity", "size"],
+        "spreads": ["ts", "symbol", "spread", "max_spread"],
+        "riesgo": ["ts", "symbol", "senal", "size", "limitado", "motivo"],
+        "ordenes": ["ts", "symbol", "tipo", "intento", "accion", "tipo_orden", "volume", "price", "sl", "tp",
+                    "position", "retcode", "comment", "error"],
+    }
+
+    def __init__(self, directorio="journal"):
+        self.directorio = directorio
+        self.conexiones = {}
+        self.lock = threading.Lock()
+
+    def registrar(self, tabla, valores):
+        # valores puede ser un dict o una función que lo devuelve (se evalúa en el hilo escritor)
+        escritor.lote(self._insertar, (time.time(), tabla, valores))
+
+    def ruta(self, dia):
+        return os.path.join(self.directorio, f"journal_{dia}.sqlite")
+
+    def _conexion(self, dia):
+        conexion = self.conexiones.get(dia)
+        if conexion is None:
+            import sqlite3
+            os.makedirs(self.directorio, exist_ok=True)
+            conexion = sqlite3.connect(self.ruta(dia), check_same_thread=False)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            for tabla, columnas in self.TABLAS.items():
+                conexion.execute(f"CREATE TABLE IF NOT EXISTS {tabla} ({', '.join(columnas)})")
+                conexion.execute(f"CREATE INDEX IF NOT EXISTS idx_{tabla}_symbol_ts ON {tabla} (symbol, ts)")
+            # Solo queda abierto el fichero del día en curso
+            for anterior in list(self.conexiones):
+                self.conexiones.pop(anterior).close()
+            self.conexiones[dia] = conexion
+        return conexion
+
+    def _insertar(self, filas):
+        por_dia = {}
+        for ts, tabla, valores in filas:
+            if callable(valores):
+                valores = valores()
+            valores = dict(valores, ts=valores.get("ts", ts))
+            columnas = self.TABLAS[tabla]
+            dia = datetime.fromtimestamp(valores["ts"], tz=pytz.utc).strftime("%Y%m%d")
+            por_dia.setdefault(dia, {}).setdefault(tabla, []).append(
+                tuple(_valor_sql(valores.get(columna)) for columna in columnas))
+        with self.lock:
+            for dia, tablas in sorted(por_dia.items()):
+                conexion = self._conexion(dia)
+                with conexion:
+                    for tabla, valores in tablas.items():
+                        columnas = self.TABLAS[tabla]
+                        conexion.executemany(
+                            f"INSERT INTO {tabla} ({', '.join(columnas)}) VALUES ({', '.join('?' * len(columnas))})",
+                            valores)
+
+    def cerrar(self):
+        with self.lock:
+            for conexion in self.conexiones.values():
+                conexion.close()
+            self.conexiones.clear()
+
+    def consultar(self, tabla, symbol=None, desde=None, hasta=None):
+        # Devuelve un DataFrame con las filas de la tabla entre desde y hasta (datetime o Timestamp,
+        # ambos incluidos) para el símbolo indicado. Solo abre los ficheros de los días del rango.
+        if tabla not in self.TABLAS:
+            raise ValueError(f"Tabla desconocida en el journal: {tabla}")
+        inicio = _valor_sql(pd.Timestamp(desde)) if desde is not None else None
+        fin = _valor_sql(pd.Timestamp(hasta)) if hasta is not None else None
+        condiciones, parametros = [], []
+        if symbol is not None:
+            condiciones.append("symbol = ?")
+            parametros.append(symbol)
+        if inicio is not None:
+            condiciones.append("ts >= ?")
+            parametros.append(inicio)
+        if fin is not None:
+            condiciones.append("ts <= ?")
+            parametros.append(fin)
+        consulta = f"SELECT * FROM {tabla}"
+        if condiciones:
+            consulta += " WHERE " + " AND ".join(condiciones)
+        consulta += " ORDER BY ts"
+
+        dia_inicio = datetime.fromtimestamp(inicio, tz=pytz.utc).strftime("%Y%m%d") if inicio is not None else None
+        dia_fin = datetime.fromtimestamp(fin, tz=pytz.utc).strftime("%Y%m%d") if fin is not None else None
+        import sqlite3
+        partes = []
+        if os.path.isdir(self.directorio):
+            for nombre in sorted(os.listdir(self.directorio)):
+                if not (nombre.startswith("journal_") and nombre.endswith(".sqlite")):
+                    continue
+                dia = nombre[len("journal_"):-len(".sqlite")]
+                if (dia_inicio and dia < dia_inicio) or (dia_fin and dia > dia_fin):
+                    continue
+                with sqlite3.connect(f"file:{os.path.join(self.directorio, nombre)}?mode=ro", uri=True) as conexion:
+                    partes.append(pd.read_sql_query(consulta, conexion, params=parametros))
+        partes = [parte for parte in partes if len(parte)]
+        if not partes:
+            return pd.DataFrame(columns=self.TABLAS[tabla])
+        resultado = pd.concat(partes, ignore_index=True)
+        resultado["ts"] = pd.to_datetime(resultado["ts"], unit="s")
+        if "time" in resultado:
+            resultado["time"] = pd.to_datetime(resultado["time"], unit="s")
+        return resultado
+
+def registrar_journal(tabla, valores):
+    # Sustituto estructurado de los ficheros de texto de auditoría (audit_format "journal")
+    if audit_logging and audit_format == "journal":
+        journal.registrar(tabla, valores)
+
+ultima_barra_registrada = {}
+
+def registrar_barras(symbol, barras):
+    # Solo velas cerradas, en el formato de _barras_desde_rates: (time, open, high, low, close,
+    # tick_volume, spread, real_volume). Las ya registradas para el símbolo se descartan, para que
+    # el ciclo completo, que vuelve a ver la misma última vela cerrada, no duplique filas.
+    for barra in barras:
+        if barra[0] <= ultima_barra_registrada.get(symbol, -1):
+            continue
+        ultima_barra_registrada[symbol] = barra[0]
+        registrar_journal("barras", dict(zip(["time"] + COLUMNAS_OHLC, barra), symbol=symbol))
+
+def registrar_error_operacion(texto):
+    escritor.escribir("errores_operaciones.txt", (texto,))
+
+class PasarelaBroker(ABC):
+    # Interfaz con el bróker que usa todo el script a través del global mt5: las mismas funciones y
+    # constantes que el módulo MetaTrader5 (velas, ticks, libro, cuenta, posiciones y order_send).
+    # Implementaciones: PasarelaMT5 (terminal real) y, en simulador.py, MT5Grabado/MT5TicksGrabados
+    # (datos grabados) y SimuladorMercado (mercado en memoria). Una implementación a la que le falte alguna función
+    # no se puede instanciar.
+    TIMEFRAME_M1, TIMEFRAME_M2, TIMEFRAME_M3, TIMEFRAME_M4, TIMEFRAME_M5, TIMEFRAME_M6 = 1, 2, 3, 4, 5, 6
+    TIMEFRAME_M10, TIMEFRAME_M12, TIMEFRAME_M15, TIMEFRAME_M20, TIMEFRAME_M30 = 10, 12, 15, 20, 30
+    TIMEFRAME_H1, TIMEFRAME_H2, TIMEFRAME_H3, TIMEFRAME_H4, TIMEFRAME_H6 = 0x4001, 0x4002, 0x4003, 0x4004, 0x4006
+    TIMEFRAME_H8, TIMEFRAME_H12, TIMEFRAME_D1, TIMEFRAME_W1, TIMEFRAME_MN1 = 0x4008, 0x400C, 0x4018, 0x8001, 0xC001
+    TRADE_ACTION_DEAL = 1
+    TRADE_ACTION_CLOSE_BY = 10
+    ACCOUNT_MARGIN_MODE_RETAIL_NETTING = 0
+    ACCOUNT_MARGIN_MODE_RETAIL_HEDGING = 2
+    ORDER_TYPE_BUY = 0
+    ORDER_TYPE_SELL = 1
+    ORDER_TIME_GTC = 0
+    ORDER_FILLING_FOK = 0
+    ORDER_FILLING_IOC = 1
+    POSITION_TYPE_BUY = 0
+    POSITION_TYPE_SELL = 1
+    BOOK_TYPE_SELL = 1
+    BOOK_TYPE_BUY = 2
+    COPY_TICKS_ALL = -1
+    TRADE_RETCODE_REQUOTE = 10004
+    TRADE_RETCODE_REJECT = 10006
+    TRADE_RETCODE_DONE = 10009
+    TRADE_RETCODE_DONE_PARTIAL = 10010
+    TRADE_RETCODE_INVALID_VOLUME = 10014
+    TRADE_RETCODE_INVALID_STOPS = 10016
+    TRADE_RETCODE_MARKET_CLOSED = 10018
+    TRADE_RETCODE_NO_MONEY = 10019
+    TRADE_RETCODE_PRICE_OFF = 10021
+
+    @abstractmethod
+    def initialize(self, **kwargs):
+        pass
+
+    @abstractmethod
+    def shutdown(self):
+        pass
+
+    @abstractmethod
+    def last_error(self):
+        pass
+
+    @abstractmethod
+    def terminal_info(self):
+        pass
+
+    @abstractmethod
+    def account_info(self):
+        pass
+
+    @abstractmethod
+    def copy_rates_range(self, symbol, timeframe, desde, hasta):
+        pass
+
+    @abstractmethod
+    def copy_ticks_from(self, symbol, desde, cantidad, flags):
+        pass
+
+    @abstractmethod
+    def symbol_info(self, symbol):
+        pass
+
+    @abstractmethod
+    def symbol_info_tick(self, symbol):
+        pass
+
+    @abstractmethod
+    def market_book_add(self, symbol):
+        pass
+
+    @abstractmethod
+    def market_book_get(self, symbol):
+        pass
+
+    @abstractmethod
+    def market_book_release(self, symbol):
+        pass
+
+    @abstractmethod
+    def positions_get(self, symbol=None):
+        pass
+
+    @abstractmethod
+    def order_send(self, request):
+        pass
+
+class PasarelaMT5(PasarelaBroker):
+    # Terminal MetaTrader 5 real. El módulo (solo Windows) se importa en la primera llamada, así que
+    # el script se puede importar y probar en máquinas sin terminal.
+    def __init__(self):
+        self._modulo = None
+
+    @property
+    def modulo(self):
+        if self._modulo is None:
+            import MetaTrader5
+            self._modulo = MetaTrader5
+        return self._modulo
+
+    def __getattr__(self, nombre):
+        # Constantes y funciones del módulo que la interfaz no declara
+        if nombre.startswith('_'):
+            raise AttributeError(nombre)
+        return getattr(self.modulo, nombre)
+
+    def initialize(self, **kwargs):
+        return self.modulo.initialize(**kwargs)
+
+    def shutdown(self):
+        if self._modulo is not None:
+            self._modulo.shutdown()
+
+    def last_error(self):
+        return self.modulo.last_error()
+
+    def terminal_info(self):
+        return self.modulo.terminal_info()
+
+    def account_info(self):
+        return self.modulo.account_info()
+
+    def copy_rates_range(self, symbol, timeframe, desde, hasta):
+        return self.modulo.copy_rates_range(symbol, timeframe, desde, hasta)
+
+    def copy_ticks_from(self, symbol, desde, cantidad, flags):
+        return self.modulo.copy_ticks_from(symbol, desde, cantidad, flags)
+
+    def symbol_info(self, symbol):
+        return self.modulo.symbol_info(symbol)
+
+    def symbol_info_tick(self, symbol):
+        return self.modulo.symbol_info_tick(symbol)
+
+    def market_book_add(self, symbol):
+        return self.modulo.market_book_add(symbol)
+
+    def market_book_get(self, symbol):
+        return self.modulo.market_book_get(symbol)
+
+    def market_book_release(self, symbol):
+        return self.modulo.market_book_release(symbol)
+
+    def positions_get(self, symbol=None):
+        if symbol is None:
+            return self.modulo.positions_get()
+        return self.modulo.positions_get(symbol=symbol)
+
+    def order_send(self, request):
+        return self.modulo.order_send(request)
+
+mt5 = PasarelaMT5()
+
+def cargar_configuracion(ruta="configmt5.json"):
     try:
-        with open("configmt5.json", "r") as f:
+        with open(ruta, "r") as f:
             config = json.load(f)
         logging.info("Configuración cargada exitosamente.")
         detailed_logger.debug(f"Configuración cargada: {config}")
@@ -52,28 +550,437 @@ def cargar_configuracion():
         logging.critical(f"Error inesperado al cargar la configuración: {str(e)}")
         sys.exit(1)
 
-# Cargar configuración
-try:
-    config = cargar_configuracion()
-    symbol_config = config['symbol_config']
-    timeframe = eval(config['timeframe'])
-    creds = config['creds']
-    max_daily_loss = config.get('max_daily_loss', 10)  # Pérdida diaria máxima permitida en porcentaje
-    logging.info("Configuraciones específicas extraídas correctamente.")
-    detailed_logger.debug(f"Configuraciones específicas: symbol_config={symbol_config}, timeframe={timeframe}, max_daily_loss={max_daily_loss}")
-except Exception as e:
-    logging.critical(f"Error al extraer configuraciones específicas: {str(e)}")
-    sys.exit(1)
+def parsear_timeframe(valor):
+    # "M5", "TIMEFRAME_M5", "mt5.TIMEFRAME_M5" o el valor numérico de la constante
+    if isinstance(valor, int) and not isinstance(valor, bool):
+        return valor
+    nombre = str(valor).strip().split('.')[-1].upper()
+    if not nombre.startswith('TIMEFRAME_'):
+        nombre = 'TIMEFRAME_' + nombre
+    if not hasattr(PasarelaBroker, nombre):
+        raise ValueError(f"Timeframe desconocido: {valor}")
+    return getattr(PasarelaBroker, nombre)
+
+def nombre_timeframe(tf):
+    # Inverso de parsear_timeframe para los logs y las columnas: 0x4001 -> "H1"
+    return next((nombre[len('TIMEFRAME_'):] for nombre in dir(PasarelaBroker)
+                 if nombre.startswith('TIMEFRAME_') and getattr(PasarelaBroker, nombre) == tf), str(tf))
+
+def extraer_configuracion(datos):
+    # Valores globales de configmt5.json (datos es el JSON ya leído), con sus valores por defecto
+    global config, symbol_config, timeframe, creds, max_daily_loss, incremental_mode, incremental_buffer
+    global concurrent_mode, max_workers, symbol_deadline, indicator_cache_size, indicator_engine, log_level
+    global async_logging, audit_logging, streaming_mode, stream_poll_min, stream_poll_max, stream_max_ticks
+    global market_data_cache, market_data_directory, metrics_port, metrics_window, snapshot_max_age, broker
+    global retry_delay, depth_child_orders, depth_max_impact, flatten_deadline, flatten_workers
+    global flatten_close_by, shards, accounts, shard_restart_max_delay, audit_format, journal_directory
+    global risk_sizing, risk_state_file, max_currency_exposure, max_correlated_risk, correlation_window
+    global config_hot_reload
+    try:
+        config = datos
+        symbol_config = config['symbol_config']
+        timeframe = parsear_timeframe(config['timeframe'])
+        creds = config['creds']
+        max_daily_loss = config.get('max_daily_loss', 10)  # Pérdida diaria máxima permitida en porcentaje
+        incremental_mode = config.get('incremental_mode', False)  # Actualizar indicadores solo con las velas nuevas
+        incremental_buffer = config.get('incremental_buffer', 150)  # Velas que se conservan por símbolo en modo incremental
+        concurrent_mode = config.get('concurrent_mode', False)  # Descargar y calcular señales de todos los símbolos en paralelo
+        max_workers = config.get('max_workers', min(8, len(symbol_config)))  # Hilos para el modo concurrente
+        symbol_deadline = config.get('symbol_deadline', 240)  # Segundos máximos por símbolo dentro de un ciclo
+        indicator_cache_size = config.get('indicator_cache_size', 256)  # Entradas de la caché LRU de indicadores
+        indicator_engine = config.get('indicator_engine', 'nativo')  # "nativo" (kernels NumPy) o "pandas_ta"
+        log_level = config.get('log_level', 'DEBUG')  # Nivel de los logs (DEBUG, INFO, WARNING...)
+        async_logging = config.get('async_logging', True)  # Escribir logs y auditoría desde un hilo en segundo plano
+        audit_logging = config.get('audit_logging', True)  # Registrar velas, señales, tamaños y órdenes de cada ciclo
+        streaming_mode = config.get('streaming_mode', False)  # Sondear ticks y evaluar cada vela en cuanto cierra, en vez del cron
+        stream_poll_min = config.get('stream_poll_min', 0.005)  # Pausa mínima entre sondeos de ticks (segundos)
+        stream_poll_max = config.get('stream_poll_max', 0.25)  # Pausa máxima cuando no llegan ticks nuevos (segundos)
+        stream_max_ticks = config.get('stream_max_ticks', 100000)  # Ticks máximos por llamada a copy_ticks_from
+        market_data_cache = config.get('market_data_cache', False)  # Guardar las velas cerradas en un histórico local y pedir solo lo que falta
+        market_data_directory = config.get('market_data_directory', 'market_data')  # Carpeta del histórico local de velas
+        metrics_port = config.get('metrics_port', None)  # Puerto local del endpoint /metrics (None lo desactiva)
+        metrics_window = config.get('metrics_window', 1000)  # Muestras recientes por etapa y símbolo para los percentiles
+        snapshot_max_age = config.get('snapshot_max_age', {})  # Edad máxima (s) por tipo de dato de la instantánea de mercado
+        broker = config.get('broker', 'mt5')  # "mt5" (terminal real) o "simulador" (mercado en memoria)
+        retry_delay = config.get('retry_delay', 5)  # Segundos entre reintentos de descarga y de envío de órdenes
+        depth_child_orders = config.get('depth_child_orders', 1)  # Órdenes hijas máximas por entrada, una por nivel del libro (1: sin dividir)
+        depth_max_impact = config.get('depth_max_impact', None)  # Puntos máximos entre el mejor precio y el peor nivel que se toma (None: sin límite)
+        flatten_deadline = config.get('flatten_deadline', 30)  # Segundos máximos para cerrar todas las posiciones
+        flatten_workers = config.get('flatten_workers', 8)  # Símbolos que se cierran a la vez en el cierre total
+        flatten_close_by = config.get('flatten_close_by', True)  # Cerrar compras contra ventas del mismo símbolo (cuentas de cobertura)
+        shards = config.get('shards', 1)  # Procesos entre los que el supervisor reparte symbol_config (1: un solo proceso)
+        accounts = config.get('accounts', [])  # Bloques creds adicionales; los shards se reparten las cuentas por turnos
+        shard_restart_max_delay = config.get('shard_restart_max_delay', 300)  # Espera máxima (s) antes de relanzar un shard caído
+        audit_format = config.get('audit_format', 'journal')  # "journal" (SQLite diario consultable) o "text" (ficheros registro_*)
+        journal_directory = config.get('journal_directory', 'journal')  # Carpeta de los ficheros diarios del journal
+        risk_sizing = config.get('risk_sizing', 'contrato')  # "contrato" (trade_tick_value de symbol_info) o "pip" (valor_pip aproximado)
+        risk_state_file = config.get('risk_state_file', 'estado_riesgo.json')  # Equity al inicio del día por cuenta
+        max_currency_exposure = config.get('max_currency_exposure', None)  # Exposición neta máxima por divisa, en veces el equity (None: sin límite)
+        max_correlated_risk = config.get('max_correlated_risk', None)  # Riesgo correlado máximo de la cartera, fracción del equity (None: sin límite)
+        correlation_window = config.get('correlation_window', 100)  # Rendimientos por símbolo de la matriz de correlación
+        config_hot_reload = config.get('config_hot_reload', True)  # Aplicar los cambios de configmt5.json entre ciclos, sin reiniciar
+        logging.info("Configuraciones específicas extraídas correctamente.")
+        detailed_logger.debug(f"Configuraciones específicas: symbol_config={symbol_config}, timeframe={timeframe}, max_daily_loss={max_daily_loss}")
+    except Exception as e:
+        logging.critical(f"Error al extraer configuraciones específicas: {str(e)}")
+        sys.exit(1)
+
+# ---------------------------------------------------------------------------
+# Métricas de latencia por etapa y símbolo
+# ---------------------------------------------------------------------------
+
+class MetricasLatencia:
+    # Histograma acumulado (buckets fijos, formato Prometheus) y ventana de las últimas muestras para
+    # p50/p95/p99 por (etapa, símbolo). observar() cuesta un lock y dos sumas.
+    LIMITES = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, ventana=1000):
+        self.ventana = ventana
+        self.series = {}
+        self.contadores = {}
+        self.lock = threading.Lock()
+
+    def contar(self, nombre, n=1):
+        with self.lock:
+            self.contadores[nombre] = self.contadores.get(nombre, 0) + n
+
+    def observar(self, etapa, symbol, segundos):
+        clave = (etapa, symbol or "")
+        with self.lock:
+            serie = self.series.get(clave)
+            if serie is None:
+                serie = self.series[clave] = {'buckets': [0] * (len(self.LIMITES) + 1), 'suma': 0.0,
+                                              'cuenta': 0, 'recientes': deque(maxlen=self.ventana)}
+            serie['buckets'][bisect.bisect_left(self.LIMITES, segundos)] += 1
+            serie['suma'] += segundos
+            serie['cuenta'] += 1
+            serie['recientes'].append(segundos)
+
+    def percentiles(self, etapa, symbol=None):
+        # Sobre la ventana reciente; symbol None junta todos los símbolos de la etapa
+        with self.lock:
+            muestras = [x for (e, s), serie in self.series.items()
+                        if e == etapa and (symbol is None or s == symbol) for x in serie['recientes']]
+        if not muestras:
+            return None
+        return tuple(np.percentile(muestras, (50, 95, 99)))
+
+    def resumen(self):
+        with self.lock:
+            etapas = sorted({etapa for etapa, _ in self.series})
+        partes = []
+        for etapa in etapas:
+            p50, p95, p99 = self.percentiles(etapa)
+            partes.append(f"{etapa} {p50 * 1000:.1f}/{p95 * 1000:.1f}/{p99 * 1000:.1f}")
+        return "Latencias p50/p95/p99 (ms): " + ", ".join(partes)
+
+    def prometheus(self):
+        lineas = ["# HELP bot_etapa_segundos Duración de cada etapa del ciclo de trading",
+                  "# TYPE bot_etapa_segundos histogram"]
+        percentiles = []
+        with self.lock:
+            series = {clave: (list(serie['buckets']), serie['suma'], serie['cuenta'], list(serie['recientes']))
+                      for clave, serie in self.series.items()}
+            contadores = dict(self.contadores)
+        for (etapa, symbol), (buckets, suma, cuenta, recientes) in sorted(series.items()):
+            etiquetas = f'etapa="{etapa}",symbol="{symbol}"'
+            acumulado = 0
+            for limite, n in zip(self.LIMITES + (float('inf'),), buckets):
+                acumulado += n
+                le = "+Inf" if limite == float('inf') else repr(limite)
+                lineas.append(f'bot_etapa_segundos_bucket{{{etiquetas},le="{le}"}} {acumulado}')
+            lineas.append(f"bot_etapa_segundos_sum{{{etiquetas}}} {suma}")
+            lineas.append(f"bot_etapa_segundos_count{{{etiquetas}}} {cuenta}")
+            for q, valor in zip(("0.5", "0.95", "0.99"), np.percentile(recientes, (50, 95, 99))):
+                percentiles.append(f'bot_etapa_percentil_segundos{{{etiquetas},quantile="{q}"}} {valor}')
+        lineas += ["# HELP bot_etapa_percentil_segundos Percentiles sobre las últimas muestras",
+                   "# TYPE bot_etapa_percentil_segundos gauge"] + percentiles
+        lineas += ["# TYPE bot_cache_indicadores_aciertos_total counter",
+                   f"bot_cache_indicadores_aciertos_total {cache_indicadores.aciertos}",
+                   "# TYPE bot_cache_indicadores_fallos_total counter",
+                   f"bot_cache_indicadores_fallos_total {cache_indicadores.fallos}"]
+        for nombre, valor in sorted(contadores.items()):
+            lineas += [f"# TYPE {nombre} counter", f"{nombre} {valor}"]
+        return "\n".join(lineas) + "\n"
+
+perfil_solicitado = threading.Event()
+
+def cronometrado(etapa, posicion_symbol=None):
+    # Registra en metricas la duración de cada llamada, por símbolo si se indica su posición en los argumentos
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                if posicion_symbol is not None and len(args) > posicion_symbol:
+                    symbol = args[posicion_symbol]
+                else:
+                    symbol = kwargs.get('symbol')
+                metricas.observar(etapa, symbol, time.perf_counter() - inicio)
+        return envoltura
+    return decorador
+
+def esperar_reintento(segundos, etapa, symbol=None):
+    # Las esperas entre reintentos se miden aparte para no confundirlas con la latencia del terminal
+    inicio = time.perf_counter()
+    time.sleep(segundos)
+    metricas.observar(f"espera_{etapa}", symbol, time.perf_counter() - inicio)
+
+def perfilar(funcion, *args, **kwargs):
+    # Ejecuta una llamada bajo cProfile; guarda el perfil en logs/ y registra las funciones más costosas
+    import cProfile
+    import pstats
+    perfil = cProfile.Profile()
+    try:
+        return perfil.runcall(funcion, *args, **kwargs)
+    finally:
+        ruta = os.path.join(log_directory, f"perfil_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof")
+        perfil.dump_stats(ruta)
+        salida = io.StringIO()
+        pstats.Stats(perfil, stream=salida).sort_stats("cumulative").print_stats(30)
+        logging.info(f"Perfil de {funcion.__name__} guardado en {ruta}\n{salida.getvalue()}")
+
+def iniciar_servidor_metricas(puerto):
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class HandlerMetricas(BaseHTTPRequestHandler):
+        # GET /metrics: métricas en formato Prometheus. GET /profile: perfila el siguiente ciclo de trading.
+        def do_GET(self):
+            if self.path == "/metrics":
+                cuerpo = metricas.prometheus().encode()
+                tipo = "text/plain; version=0.0.4"
+            elif self.path == "/profile":
+                perfil_solicitado.set()
+                cuerpo = b"El siguiente ciclo se ejecutara con cProfile\n"
+                tipo = "text/plain"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, formato, *args):
+            detailed_logger.debug("Endpoint de métricas: " + formato, *args)
+
+    # Solo escucha en localhost
+    servidor = ThreadingHTTPServer(("127.0.0.1", int(puerto)), HandlerMetricas)
+    threading.Thread(target=servidor.serve_forever, name="metricas", daemon=True).start()
+    logging.info(f"Métricas disponibles en http://127.0.0.1:{puerto}/metrics")
+    return servidor
+
+# Serializa todas las llamadas al terminal cuando hay varios hilos trabajando: el paquete MetaTrader5
+# no es seguro entre hilos. En paralelo solo corre el trabajo de pandas y de indicadores.
+terminal_lock = threading.RLock()
+
+# Lo toman trading_job y cada pasada de modo_streaming durante todo el ciclo, y RecargaConfiguracion
+# para instalar la configuración nueva: ningún ciclo la ve cambiar a medias
+ciclo_lock = threading.RLock()
+
+# Edad máxima en segundos de cada dato de la instantánea antes de volver a pedirlo al terminal
+EDADES_INSTANTANEA = {'terminal': 5.0, 'cuenta': 5.0, 'posiciones': 5.0, 'simbolo': 1.0, 'tick': 1.0, 'libro': 1.0}
+
+class InstantaneaMercado:
+    # Estado del terminal compartido por todas las etapas de un ciclo: terminal, cuenta, posiciones
+    # (un solo positions_get() para todos los símbolos), símbolos, ticks y libros. Cada dato se vuelve
+    # a pedir cuando supera su edad máxima y las órdenes ejecutadas invalidan cuenta y posiciones.
+    # Lleva la cuenta de las llamadas hechas y de las evitadas.
+    def __init__(self, edades=None):
+        self.edades = dict(EDADES_INSTANTANEA, **(edades or {}))
+        self.datos = {}
+        self.llamadas = 0
+        self.evitadas = 0
+        self.lock = threading.Lock()
+
+    def _obtener(self, tipo, clave, pedir, cachear_nulo=False):
+        with self.lock:
+            entrada = self.datos.get((tipo, clave))
+            if entrada is not None and time.monotonic() - entrada[0] <= self.edades[tipo]:
+                self.evitadas += 1
+                return entrada[1]
+        with terminal_lock:
+            valor = pedir()
+        with self.lock:
+            self.llamadas += 1
+            # Los fallos (None) no se guardan, salvo el libro: muchos símbolos no tienen profundidad
+            if valor is not None or cachear_nulo:
+                self.datos[(tipo, clave)] = (time.monotonic(), valor)
+        return valor
+
+    def terminal(self):
+        return self._obtener('terminal', None, mt5.terminal_info)
+
+    def cuenta(self):
+        return self._obtener('cuenta', None, mt5.account_info)
+
+    def posiciones(self, symbol=None):
+        todas = self._obtener('posiciones', None, mt5.positions_get)
+        if todas is None or symbol is None:
+            return todas
+        return tuple(position for position in todas if position.symbol == symbol)
+
+    def simbolo(self, symbol):
+        return self._obtener('simbolo', symbol, lambda: mt5.symbol_info(symbol))
+
+    def tick(self, symbol):
+        return self._obtener('tick', symbol, lambda: mt5.symbol_info_tick(symbol))
+
+    def libro(self, symbol):
+        return self._obtener('libro', symbol, lambda: mt5.market_book_get(symbol), cachear_nulo=True)
+
+    def invalidar(self, *tipos):
+        # Sin tipos se descarta todo
+        with self.lock:
+            for clave in [clave for clave in self.datos if not tipos or clave[0] in tipos]:
+                del self.datos[clave]
+
+    def resumen(self):
+        return f"Instantánea de mercado: {self.llamadas} llamadas al terminal, {self.evitadas} evitadas"
+
+def renovar_instantanea():
+    # Al empezar cada ciclo: los datos del ciclo anterior no se reutilizan
+    global instantanea
+    anterior = instantanea
+    metricas.contar("bot_terminal_llamadas_total", anterior.llamadas)
+    metricas.contar("bot_terminal_llamadas_evitadas_total", anterior.evitadas)
+    instantanea = InstantaneaMercado(snapshot_max_age)
+    riesgo.nuevo_ciclo()
+    return anterior
+
+class ProfundidadMercado:
+    # Análisis del libro de órdenes por símbolo. Se suscribe una vez a cada símbolo (market_book_add)
+    # y guarda, por lado, precios del mejor al peor con volúmenes e importes acumulados. MetaTrader 5
+    # entrega el libro completo en cada market_book_get, así que solo se reconstruye cuando cambia; las
+    # consultas (liquidez, precio medio esperado, volumen hasta un precio) son búsquedas binarias.
+    def __init__(self):
+        self.suscritos = {}
+        self.libros = {}
+        self.reconstrucciones = 0
+
+    def suscribir(self, symbol):
+        if symbol not in self.suscritos:
+            try:
+                with terminal_lock:
+                    self.suscritos[symbol] = bool(mt5.market_book_add(symbol))
+            except Exception as e:
+                logging.warning(f"No se pudo suscribir al libro de {symbol}: {str(e)}")
+                self.suscritos[symbol] = False
+            if not self.suscritos[symbol]:
+                logging.info(f"{symbol} sin profundidad de mercado; se usará el tick")
+        return self.suscritos[symbol]
+
+    def liberar(self):
+        for symbol in [symbol for symbol, suscrito in self.suscritos.items() if suscrito]:
+            try:
+                with terminal_lock:
+                    mt5.market_book_release(symbol)
+            except Exception as e:
+                logging.warning(f"No se pudo liberar el libro de {symbol}: {str(e)}")
+        self.suscritos.clear()
+        self.libros.clear()
+
+    @staticmethod
+    def construir(libro):
+        # {lado: (precios, volumen acumulado, importe acumulado, niveles [(precio, volumen)])}; BOOK_TYPE_SELL son los asks (para
+        # comprar, de menor a mayor) y BOOK_TYPE_BUY los bids (para vender, de mayor a menor)
+        lados = {}
+        for tipo, descendente in ((mt5.BOOK_TYPE_SELL, False), (mt5.BOOK_TYPE_BUY, True)):
+            niveles = sorted(((item.price, getattr(item, 'volume_dbl', item.volume)) for item in libro
+                              if item.type == tipo and item.price > 0), reverse=descendente)
+            if niveles:
+                precios = np.array([precio for precio, _ in niveles], dtype=float)
+                volumenes = np.array([volumen for _, volumen in niveles], dtype=float)
+                lados[tipo] = (precios, np.cumsum(volumenes), np.cumsum(precios * volumenes), niveles)
+        return lados
+
+    def lado(self, symbol, lado, libro=None):
+        # Datos de un lado del libro actual (el de la instantánea si no se pasa); None si está vacío
+        if libro is None:
+            if not self.suscribir(symbol):
+                return None
+            libro = instantanea.libro(symbol)
+        if not libro:
+            return None
+        entrada = self.libros.get(symbol)
+        if entrada is None or (entrada[0] is not libro and entrada[0] != libro):
+            entrada = (libro, self.construir(libro))
+            self.libros[symbol] = entrada
+            self.reconstrucciones += 1
+        return entrada[1].get(lado)
+
+    def mejor_precio(self, symbol, lado, libro=None):
+        datos = self.lado(symbol, lado, libro)
+        return None if datos is None else float(datos[0][0])
+
+    def liquidez(self, symbol, lado, libro=None):
+        datos = self.lado(symbol, lado, libro)
+        return None if datos is None else float(datos[1][-1])
+
+    def precio_esperado(self, symbol, lado, volumen, libro=None):
+        # Precio medio ponderado por volumen de ejecutar `volumen` recorriendo el libro, y el volumen
+        # que cabe en él. (None, 0.0) si el lado está vacío.
+        datos = self.lado(symbol, lado, libro)
+        if datos is None:
+            return None, 0.0
+        precios, acumulado, importe, _ = datos
+        ejecutable = min(float(volumen), float(acumulado[-1]))
+        if ejecutable <= 0:
+            return float(precios[0]), 0.0
+        i = min(int(np.searchsorted(acumulado, ejecutable, side='left')), len(precios) - 1)
+        previo_volumen = acumulado[i - 1] if i else 0.0
+        previo_importe = importe[i - 1] if i else 0.0
+        return float((previo_importe + (ejecutable - previo_volumen) * precios[i]) / ejecutable), ejecutable
+
+    def volumen_hasta(self, symbol, lado, precio_limite, libro=None):
+        # Volumen disponible sin pasar de precio_limite (por encima en compras, por debajo en ventas)
+        datos = self.lado(symbol, lado, libro)
+        if datos is None:
+            return 0.0
+        precios, acumulado, _, _ = datos
+        if lado == mt5.BOOK_TYPE_SELL:
+            n = int(np.searchsorted(precios, precio_limite, side='right'))
+        else:
+            n = int(np.searchsorted(-precios, -precio_limite, side='right'))
+        return float(acumulado[n - 1]) if n else 0.0
+
+    def dividir(self, symbol, lado, volumen, max_partes=1, paso=0.01, libro=None):
+        # Reparte `volumen` en órdenes hijas, una por nivel y con el precio de ese nivel; la última
+        # parte se lleva lo que quede. Sin libro, una sola parte sin precio.
+        datos = self.lado(symbol, lado, libro)
+        if datos is None:
+            return [(volumen, None)]
+        niveles = datos[3]
+        partes = []
+        pendiente = float(volumen)
+        for i, (precio, disponible) in enumerate(niveles):
+            if len(partes) == max(1, max_partes) - 1 or i == len(niveles) - 1:
+                parte = pendiente
+            else:
+                parte = math.floor(min(pendiente, disponible) / paso + 1e-9) * paso
+            parte = round(parte, 8)
+            if parte > 0:
+                partes.append((parte, float(precio)))
+                pendiente = round(pendiente - parte, 8)
+            if pendiente < paso / 2:
+                break
+        return partes
+
+profundidad = ProfundidadMercado()
 
 # Función para inicializar MetaTrader 5
 def initialize_mt5(max_attempts=3, retry_delay=5):
     for attempt in range(max_attempts):
         try:
-            if not mt5.initialize(**creds):
-                raise ConnectionError(f"Error al inicializar MetaTrader 5: {mt5.last_error()}")
-            
-            if not mt5.terminal_info() or not mt5.account_info():
-                raise ConnectionError("No se pudo obtener información del terminal o de la cuenta.")
+            with terminal_lock:
+                if not mt5.initialize(**creds):
+                    raise ConnectionError(f"Error al inicializar MetaTrader 5: {mt5.last_error()}")
+                
+                if not mt5.terminal_info() or not mt5.account_info():
+                    raise ConnectionError("No se pudo obtener información del terminal o de la cuenta.")
             
             logging.info("Plataforma inicializada y lista para operar.")
             detailed_logger.debug(f"Intento {attempt + 1}: Inicialización exitosa")
@@ -89,21 +996,31 @@ def initialize_mt5(max_attempts=3, retry_delay=5):
                 print("Verifique la configuración y el estado de MetaTrader 5.")
                 return False
 
-# Inicializar MetaTrader 5 al inicio del script
-if not initialize_mt5():
-    logging.critical("No se pudo inicializar MetaTrader 5. Saliendo del script.")
-    sys.exit(1)
+def conectar_broker():
+    # Solo los modos que operan o descargan datos se conectan; importar el script no toca el terminal.
+    # Con broker "simulador" se opera contra un mercado en memoria que avanza en tiempo real y que se
+    # construye aquí, no al importar.
+    global mt5
+    if broker == "simulador":
+        import simulador
+        if not isinstance(mt5, simulador.SimuladorMercado):
+            mt5 = simulador.crear_simulador(list(symbol_config), n_barras=20000, velocidad=1.0)
+    if not initialize_mt5():
+        logging.critical("No se pudo inicializar MetaTrader 5. Saliendo del script.")
+        sys.exit(1)
 
 def get_now():
     return datetime.now(pytz.timezone("Etc/GMT-4"))
 
 def verificar_conexion_mt5():
-    if not mt5.terminal_info():
+    if not instantanea.terminal():
         logging.warning("Conexión con MetaTrader 5 perdida. Intentando reconectar...")
         detailed_logger.warning("Conexión con MetaTrader 5 perdida. Intentando reconectar...")
+        instantanea.invalidar()
         return initialize_mt5()
     return True
 
+@cronometrado("obtener_datos_ohlc", 0)
 def obtener_datos_ohlc(symbol, max_intentos=3):
     for intento in range(max_intentos):
         try:
@@ -112,7 +1029,7 @@ def obtener_datos_ohlc(symbol, max_intentos=3):
             
             ahora = get_now() + timedelta(hours=3)
             desde = ahora - timedelta(minutes=150*5)
-            raw_ohlc_data = mt5.copy_rates_range(symbol, timeframe, desde, ahora)
+            raw_ohlc_data = descargar_velas(symbol, timeframe, desde, ahora)
             if raw_ohlc_data is None or len(raw_ohlc_data) == 0:
                 raise ValueError(f"Datos OHLC vacíos o nulos para {symbol}")
             df = pd.DataFrame(raw_ohlc_data)
@@ -120,9 +1037,10 @@ def obtener_datos_ohlc(symbol, max_intentos=3):
             df.set_index('time', inplace=True)
             
             # Registrar la última fila en un archivo de texto
-            with open(f"registro_dataframe_{symbol}.txt", "a") as f:
-                f.write(f"Última actualización del DataFrame para {symbol}: {ahora}\n")
-                f.write(str(df.iloc[-1]) + "\n\n")
+            auditar(f"registro_dataframe_{symbol}.txt",
+                    f"Última actualización del DataFrame para {symbol}: {ahora}\n",
+                    lambda: str(df.iloc[-1]) + "\n\n")
+            registrar_barras(symbol, _barras_desde_dataframe(df.iloc[-2:-1]))
             
             logging.info(f"Datos OHLC obtenidos exitosamente para {symbol}. Filas: {len(df)}")
             
@@ -133,23 +1051,230 @@ def obtener_datos_ohlc(symbol, max_intentos=3):
         
         if intento < max_intentos - 1:
             logging.info(f"Reintentando obtener datos OHLC para {symbol}...")
-            time.sleep(5)
+            esperar_reintento(retry_delay, "obtener_datos_ohlc", symbol)
         else:
             logging.critical(f"No se pudieron obtener los datos OHLC para {symbol} después de {max_intentos} intentos.")
     return None
 
-def analyze_rsi_bollinger(df, config):
+def parametros_bollinger(config):
+    # Longitud y desviación de las bandas; rsi_bollinger usaba 15/1.5 fijos
+    return int(config.get('bb_length', 15)), float(config.get('bb_std', 1.5))
+
+def columnas_bollinger(config):
+    # Nombres de columnas que genera ta.bbands (BBL_<length>_<std>, BBM_..., BBU_...)
+    length, std = parametros_bollinger(config)
+    sufijo = f"_{length}_{std}"
+    return f"BBL{sufijo}", f"BBM{sufijo}", f"BBU{sufijo}"
+
+class CacheIndicadores:
+    # Caché LRU acotada para los resultados de los indicadores, por contenido de las velas (huella_velas)
+    # e indicador con sus parámetros. Evita recalcular cuando se vuelven a evaluar las mismas velas:
+    # reintentos, backtests y optimizaciones sobre el mismo histórico, o dos análisis que piden el
+    # mismo indicador. No es una caché para el ciclo en vivo: la vela en formación cambia con cada tick
+    # y cada ciclo trae una vela nueva, así que ahí no acierta; para no recalcular en vivo está
+    # incremental_mode.
+    def __init__(self, capacidad=256):
+        self.capacidad = capacidad
+        self.entradas = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+        self.lock = threading.Lock()
+
+    def obtener(self, clave, calcular):
+        with self.lock:
+            if clave in self.entradas:
+                self.entradas.move_to_end(clave)
+                self.aciertos += 1
+                return self.entradas[clave]
+            self.fallos += 1
+        valor = calcular()
+        with self.lock:
+            self.entradas[clave] = valor
+            self.entradas.move_to_end(clave)
+            while len(self.entradas) > self.capacidad:
+                self.entradas.popitem(last=False)
+        return valor
+
+    def resumen(self):
+        total = self.aciertos + self.fallos
+        tasa = self.aciertos / total if total else 0.0
+        return (f"Caché de indicadores: {self.aciertos} aciertos, {self.fallos} fallos ({tasa:.1%}), "
+                f"{len(self.entradas)}/{self.capacidad} entradas")
+
+# ---------------------------------------------------------------------------
+# Indicadores nativos: RSI, Bollinger, ATR y VWAP con NumPy, mismas fórmulas que pandas_ta
+# ---------------------------------------------------------------------------
+
+def ewm_nativa(x, length):
+    # Series.ewm(alpha=1/length, min_periods=length).mean() (adjust=True), el rma() de pandas_ta, para
+    # una serie sin NaN salvo un prefijo. La recurrencia num_t = x_t + b*num_{t-1} se resuelve por
+    # bloques de K velas: dentro de cada bloque es un cumsum de x*b^-j (con b^-K acotado a ~1e12 para
+    # no perder precisión) y entre bloques se arrastra el acumulado con un bucle de n/K pasos.
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    salida = np.full(len(x), np.nan)
+    validos = ~np.isnan(x)
+    if not validos.any():
+        return salida
+    inicio = int(np.argmax(validos))
+    y = x[inicio:]
+    m = len(y)
+    if length <= 1:
+        salida[inicio:] = y
+        return salida
+    b = 1.0 - 1.0 / length
+    K = max(1, min(m, int(27.6 / -math.log(b))))
+    bloques = -(-m // K)
+    matriz = np.zeros(bloques * K)
+    matriz[:m] = y
+    matriz = matriz.reshape(bloques, K)
+    potencias = b ** np.arange(K)
+    local = np.cumsum(matriz / potencias, axis=1)
+    local *= potencias
+    bK = b ** K
+    acumulado = 0.0
+    arrastre = np.empty(bloques)
+    for k, final in enumerate(local[:, -1].tolist()):
+        arrastre[k] = acumulado
+        acumulado = final + bK * acumulado
+    local += arrastre[:, None] * (potencias * b)
+    numerador = local.ravel()[:m]
+    # Suma de pesos (1 - b^(t+1)) / (1 - b); a partir de ~40/-ln(b) velas b^(t+1) ya no cambia el resultado
+    transitorio = min(m, int(40 / -math.log(b)) + 2)
+    resultado = salida[inicio:]
+    np.multiply(numerador, 1.0 - b, out=resultado)
+    resultado[:transitorio] /= 1.0 - b ** np.arange(1, transitorio + 1)
+    resultado[:length - 1] = np.nan
+    return salida
+
+def rsi_nativo(close, length=14):
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    delta = np.empty_like(close)
+    delta[:1] = np.nan
+    np.subtract(close[1:], close[:-1], out=delta[1:])
+    positivo = np.where(delta < 0, 0.0, delta)
+    negativo = np.where(delta > 0, 0.0, delta)
+    media_positiva = ewm_nativa(positivo, length)
+    media_negativa = ewm_nativa(negativo, length)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 100 * media_positiva / (media_positiva + np.abs(media_negativa))
+
+def _sin_ceros(d):
+    # non_zero_range() de pandas_ta: si alguna diferencia es 0 suma epsilon a toda la serie
+    return d + sys.float_info.epsilon if (d == 0).any() else d
+
+def bbands_nativo(close, length=5, std=2.0, bloque=8192):
+    # Media y desviación típica (ddof=0) móviles con sumas acumuladas desplazadas respecto a una
+    # referencia, como _VentanaMovil: por bloques de velas, cada uno con su primera vela como
+    # referencia para que las sumas se queden pequeñas y no se pierda precisión con varianzas
+    # pequeñas. Devuelve BBL, BBM, BBU, BBB y BBP.
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    n = len(close)
+    media = np.full(n, np.nan)
+    desviacion = np.full(n, np.nan)
+    for inicio in range(0, n - length + 1, bloque):
+        tramo = close[inicio:inicio + bloque + length - 1]
+        d = tramo - tramo[0]
+        suma = np.cumsum(d)
+        suma_cuadrados = np.cumsum(d * d)
+        suma[length:] -= suma[:-length].copy()
+        suma_cuadrados[length:] -= suma_cuadrados[:-length].copy()
+        media_d = suma[length - 1:] / length
+        destino = slice(inicio + length - 1, inicio + len(tramo))
+        media[destino] = tramo[0] + media_d
+        desviacion[destino] = np.sqrt(np.maximum(suma_cuadrados[length - 1:] / length - media_d * media_d, 0.0))
+    banda = std * desviacion
+    lower = media - banda
+    upper = media + banda
+    rango = _sin_ceros(upper - lower)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return lower, media, upper, 100 * rango / media, _sin_ceros(close - lower) / rango
+
+def atr_nativo(high, low, close, length=14):
+    high, low, close = (np.ascontiguousarray(a, dtype=np.float64) for a in (high, low, close))
+    previo = np.empty_like(close)
+    previo[:1] = np.nan
+    previo[1:] = close[:-1]
+    tr = np.maximum(np.abs(_sin_ceros(high - low)), np.maximum(np.abs(high - previo), np.abs(previo - low)))
+    tr[:1] = np.nan
+    return ewm_nativa(tr, length)
+
+def vwap_nativo(high, low, close, volume, dias):
+    # VWAP anclado al día (dias: número de día de cada vela, en orden). Cada día ocupa una fila de
+    # una matriz (días x velas del día más largo) y se acumula por filas: mismas sumas secuenciales
+    # que el groupby().cumsum() de pandas_ta, sin restar acumulados globales grandes.
+    high, low, close, volume = (np.ascontiguousarray(a, dtype=np.float64) for a in (high, low, close, volume))
+    if not len(close):
+        return close.copy()
+    precio_volumen = (high + low + close) / 3.0 * volume
+    inicios = np.flatnonzero(np.diff(dias, prepend=dias[:1] - 1) != 0)
+    longitudes = np.diff(np.append(inicios, len(dias)))
+    fila = np.repeat(np.arange(len(inicios)), longitudes)
+    columna = np.arange(len(dias)) - np.repeat(inicios, longitudes)
+    matriz = np.zeros((len(inicios), int(longitudes.max())))
+    matriz[fila, columna] = precio_volumen
+    acumulado_pv = np.cumsum(matriz, axis=1)[fila, columna]
+    matriz[fila, columna] = volume
+    acumulado_v = np.cumsum(matriz, axis=1)[fila, columna]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return acumulado_pv / acumulado_v
+
+class IndicadoresNativos:
+    # Misma interfaz y mismos nombres que pandas_ta para los cuatro indicadores del script
+    @staticmethod
+    def rsi(close, length=14):
+        return pd.Series(rsi_nativo(close.to_numpy(dtype=np.float64), length), index=close.index, name=f"RSI_{length}")
+
+    @staticmethod
+    def bbands(close, length=5, std=2.0):
+        length, std = int(length), float(std)
+        sufijo = f"_{length}_{std}"
+        columnas = bbands_nativo(close.to_numpy(dtype=np.float64), length, std)
+        return pd.DataFrame(dict(zip((f"BBL{sufijo}", f"BBM{sufijo}", f"BBU{sufijo}", f"BBB{sufijo}", f"BBP{sufijo}"),
+                                     columnas)), index=close.index)
+
+    @staticmethod
+    def atr(high, low, close, length=14):
+        return pd.Series(atr_nativo(high.to_numpy(), low.to_numpy(), close.to_numpy(), length),
+                         index=close.index, name=f"ATRr_{length}")
+
+    @staticmethod
+    def vwap(high, low, close, volume):
+        dias = close.index.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]').astype(np.int64)
+        return pd.Series(vwap_nativo(high.to_numpy(), low.to_numpy(), close.to_numpy(), volume.to_numpy(), dias),
+                         index=close.index, name="VWAP_D")
+
+def huella_velas(df):
+    # Identifica las velas por su contenido: marcas de tiempo y high, low, close y tick_volume de todas,
+    # incluida la vela en formación. No lleva el símbolo: dos símbolos (o un backtest y el optimizador)
+    # con las mismas velas y los mismos parámetros comparten el resultado. RSI y ATR son recursivos
+    # sobre toda la ventana, así que no se puede reutilizar la parte cerrada y calcular solo la fila
+    # en formación sin guardar su estado (eso es EstadoIndicadores).
+    huella = hashlib.blake2b(digest_size=16)
+    huella.update(np.ascontiguousarray(df.index.asi8).tobytes())
+    for columna in ('high', 'low', 'close', 'tick_volume'):
+        huella.update(np.ascontiguousarray(df[columna].to_numpy(dtype=np.float64)).tobytes())
+    return len(df), huella.digest()
+
+def indicador_cacheado(huella, nombre, parametros, calcular):
+    return cache_indicadores.obtener((nombre, parametros, huella), calcular)
+
+def analyze_rsi_bollinger(df, config, symbol=None):
     if df is None or df.empty:
         logging.error("DataFrame vacío o nulo en analyze_rsi_bollinger")
         return None
     try:
         df = df[df.high != df.low].copy()
+        huella = huella_velas(df)
         
-        df['RSI'] = ta.rsi(df.close, length=config['rsi_length'])
-        df = df.join(ta.bbands(df.close, length=15, std=1.5))
-        df['ATR'] = ta.atr(df.high, df.low, df.close, length=7)
+        df['RSI'] = indicador_cacheado(huella, 'rsi', (config['rsi_length'],),
+                               lambda: motor_indicadores.rsi(df.close, length=config['rsi_length']))
+        bb_length, bb_std = parametros_bollinger(config)
+        df = df.join(indicador_cacheado(huella, 'bbands', (bb_length, bb_std),
+                                lambda: motor_indicadores.bbands(df.close, length=bb_length, std=bb_std)))
+        df['ATR'] = indicador_cacheado(huella, 'atr', (7,),
+                               lambda: motor_indicadores.atr(df.high, df.low, df.close, length=7))
         
-        logging.debug(f"Análisis RSI y Bollinger completado. Filas resultantes: {len(df)}")
+        logging.debug("Análisis RSI y Bollinger completado. Filas resultantes: %d", len(df))
         
         return df.dropna()
     except Exception as e:
@@ -157,19 +1282,25 @@ def analyze_rsi_bollinger(df, config):
         detailed_logger.error(f"Error en analyze_rsi_bollinger: {str(e)}\nTraceback: {traceback.format_exc()}")
         return None
 
-def analyze_vwap_bollinger(df, config):
+def analyze_vwap_bollinger(df, config, symbol=None):
     if df is None or df.empty:
         logging.error("DataFrame vacío o nulo en analyze_vwap_bollinger")
         return None
     try:
         df = df[df.high != df.low].copy()
+        huella = huella_velas(df)
         
-        df["VWAP"] = ta.vwap(df.high, df.low, df.close, df.tick_volume)
-        df['RSI'] = ta.rsi(df.close, length=config['rsi_length'])
-        df = df.join(ta.bbands(df.close, length=config['bb_length'], std=config['bb_std']))
-        df['ATR'] = ta.atr(df.high, df.low, df.close, length=7)
+        df["VWAP"] = indicador_cacheado(huella, 'vwap', (),
+                                lambda: motor_indicadores.vwap(df.high, df.low, df.close, df.tick_volume))
+        df['RSI'] = indicador_cacheado(huella, 'rsi', (config['rsi_length'],),
+                               lambda: motor_indicadores.rsi(df.close, length=config['rsi_length']))
+        bb_length, bb_std = parametros_bollinger(config)
+        df = df.join(indicador_cacheado(huella, 'bbands', (bb_length, bb_std),
+                                lambda: motor_indicadores.bbands(df.close, length=bb_length, std=bb_std)))
+        df['ATR'] = indicador_cacheado(huella, 'atr', (7,),
+                               lambda: motor_indicadores.atr(df.high, df.low, df.close, length=7))
         
-        logging.debug(f"Análisis VWAP y Bollinger completado. Filas resultantes: {len(df)}")
+        logging.debug("Análisis VWAP y Bollinger completado. Filas resultantes: %d", len(df))
         
         return df.dropna()
     except Exception as e:
@@ -177,19 +1308,21 @@ def analyze_vwap_bollinger(df, config):
         detailed_logger.error(f"Error en analyze_vwap_bollinger: {str(e)}\nTraceback: {traceback.format_exc()}")
         return None
 
-def bollinger_signal(df):
+def bollinger_signal(df, config=None):
     if df is None or df.empty:
         logging.error("DataFrame vacío o nulo en bollinger_signal")
         return None
     try:
-        condition_buy = df['close'] <= df['BBL_15_1.5']
-        condition_sell = df['close'] >= df['BBU_15_1.5']
+        bbl, _, bbu = columnas_bollinger(config or {})
+        condition_buy = df['close'] <= df[bbl]
+        condition_sell = df['close'] >= df[bbu]
 
         df['bollinger_Signal'] = 0  # Default no signal
         df.loc[condition_buy, 'bollinger_Signal'] = 2
         df.loc[condition_sell, 'bollinger_Signal'] = 1
         
-        logging.debug(f"Señales Bollinger calculadas. Compras: {sum(condition_buy)}, Ventas: {sum(condition_sell)}")
+        logging.debug("Señales Bollinger calculadas. Compras: %s, Ventas: %s",
+                      Perezoso(condition_buy.sum), Perezoso(condition_sell.sum))
        
         return df
     except Exception as e:
@@ -197,31 +1330,43 @@ def bollinger_signal(df):
         detailed_logger.error(f"Error en bollinger_signal: {str(e)}\nTraceback: {traceback.format_exc()}")
         return None
 
+def vwap_signal_engine(open_, close, vwap, backcandles):
+    # Versión vectorizada del bucle original: una vela "rompe" la tendencia alcista si
+    # min(open, close) <= VWAP y la bajista si max(open, close) >= VWAP. Se cuentan las
+    # velas válidas con sumas acumuladas, así cada ventana de backcandles+1 velas es O(1).
+    open_ = np.asarray(open_, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    vwap = np.asarray(vwap, dtype=np.float64)
+    n = len(close)
+    signal = np.zeros(n, dtype=np.int64)
+    if n <= backcandles:
+        return signal
+
+    # Mismo criterio que max()/min() de Python para que el resultado sea idéntico
+    cuerpo_max = np.where(close > open_, close, open_)
+    cuerpo_min = np.where(close < open_, close, open_)
+    arriba = ~(cuerpo_min <= vwap)
+    abajo = ~(cuerpo_max >= vwap)
+
+    ventana = backcandles + 1
+    acum_arriba = np.concatenate(([0], np.cumsum(arriba, dtype=np.int64)))
+    acum_abajo = np.concatenate(([0], np.cumsum(abajo, dtype=np.int64)))
+    upt = (acum_arriba[ventana:] - acum_arriba[:-ventana]) == ventana
+    dnt = (acum_abajo[ventana:] - acum_abajo[:-ventana]) == ventana
+
+    signal[backcandles:] = np.select([upt & dnt, upt, dnt], [3, 2, 1], default=0)
+    return signal
+
 def vwap_signal(df, config):
     if df is None or df.empty:
         logging.error("DataFrame vacío o nulo en vwap_signal")
         return None
     try:
-        VWAPsignal = [0] * len(df)
         backcandles = config['backcandles']
-
-        for row in range(backcandles, len(df)):
-            upt = 1
-            dnt = 1
-            for i in range(row-backcandles, row+1):
-                if max(df.open.iloc[i], df.close.iloc[i]) >= df.VWAP.iloc[i]:
-                    dnt = 0
-                if min(df.open.iloc[i], df.close.iloc[i]) <= df.VWAP.iloc[i]:
-                    upt = 0
-            if upt == 1 and dnt == 1:
-                VWAPsignal[row] = 3
-            elif upt == 1:
-                VWAPsignal[row] = 2
-            elif dnt == 1:
-                VWAPsignal[row] = 1
+        VWAPsignal = vwap_signal_engine(df.open.to_numpy(), df.close.to_numpy(), df.VWAP.to_numpy(), backcandles)
 
         df['VWAPSignal'] = VWAPsignal
-        logging.debug(f"Señales VWAP calculadas. Distribución: {pd.Series(VWAPsignal).value_counts()}")
+        logging.debug("Señales VWAP calculadas. Distribución: %s", Perezoso(lambda: pd.Series(VWAPsignal).value_counts()))
         
         return df
     except Exception as e:
@@ -229,18 +1374,35 @@ def vwap_signal(df, config):
         detailed_logger.error(f"Error en vwap_signal: {str(e)}\nTraceback: {traceback.format_exc()}")
         return None
 
+def _ventana_todas(condicion, ventana):
+    # True en i si condicion se cumple en todas las velas de [i-ventana+1, i]; al inicio de la
+    # serie la ventana es más corta (calentamiento), igual que el slicing original.
+    n = len(condicion)
+    acumulado = np.concatenate(([0], np.cumsum(condicion, dtype=np.int64)))
+    fin = np.arange(1, n + 1)
+    inicio = np.maximum(0, fin - ventana)
+    return (acumulado[fin] - acumulado[inicio]) == (fin - inicio)
+
+def rsi_signal_engine(rsi, ventana=6, superior=50.1, inferior=49.9):
+    rsi = np.asarray(rsi, dtype=np.float64)
+    rsi_signal = np.zeros(len(rsi))
+    if len(rsi) == 0:
+        return rsi_signal
+    alcista = _ventana_todas(rsi > superior, ventana)
+    bajista = _ventana_todas(rsi < inferior, ventana)
+    rsi_signal[alcista] = 2
+    rsi_signal[bajista & ~alcista] = 1
+    return rsi_signal
+
 def calculate_rsi_signal_windowed(rsi_series, config):
     try:
-        rsi_signal = np.zeros(len(rsi_series))
-        for i in range(len(rsi_series)):
-            window_start = max(0, i - 5)
-            window = rsi_series[window_start:i+1]
-            if not window.empty and window.gt(50.1).all():
-                rsi_signal[i] = 2
-            elif not window.empty and window.lt(49.9).all():
-                rsi_signal[i] = 1
+        # Ventana y umbrales configurables por símbolo; por defecto los valores originales
+        ventana = config.get('rsi_signal_window', 6)
+        superior = config.get('rsi_signal_upper', 50.1)
+        inferior = config.get('rsi_signal_lower', 49.9)
+        rsi_signal = rsi_signal_engine(rsi_series.to_numpy(), ventana, superior, inferior)
         
-        logging.debug(f"Señales RSI calculadas. Distribución: {pd.Series(rsi_signal).value_counts()}")
+        logging.debug("Señales RSI calculadas. Distribución: %s", Perezoso(lambda: pd.Series(rsi_signal).value_counts()))
         
         return rsi_signal
     except Exception as e:
@@ -248,37 +1410,134 @@ def calculate_rsi_signal_windowed(rsi_series, config):
         detailed_logger.error(f"Error en calculate_rsi_signal_windowed: {str(e)}\nTraceback: {traceback.format_exc()}")
         return None
 
-def process(df, symbol):
+# Reglas declarativas para combinar señales en TotalSignal. Cada regla es (código, condiciones)
+# y se aplica la primera cuyas condiciones se cumplen todas; si ninguna se cumple la señal es 0.
+# Una condición es (columna, operador, valor) y el valor puede ser un número o otra columna.
+OPERADORES_SENAL = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+def combinar_senales(df, reglas):
+    condiciones = []
+    codigos = []
+    for codigo, requisitos in reglas:
+        cumple = np.ones(len(df), dtype=bool)
+        for columna, operador, valor in requisitos:
+            if isinstance(valor, str):
+                valor = df[valor].to_numpy()
+            cumple &= OPERADORES_SENAL[operador](df[columna].to_numpy(), valor)
+        condiciones.append(cumple)
+        codigos.append(codigo)
+    return np.select(condiciones, codigos, default=0)
+
+# ---------------------------------------------------------------------------
+# Registro de estrategias: el valor de "strategy" en symbol_config elige la clase
+# ---------------------------------------------------------------------------
+
+ESTRATEGIAS = {}
+
+def registrar_estrategia(clase):
+    # Decorador: una subclase de Estrategia queda disponible en symbol_config con su `nombre`. Se
+    # instancia aquí, así que una subclase sin analizar o reglas falla al registrarla (TypeError).
+    ESTRATEGIAS[clase.nombre] = clase()
+    return clase
+
+class Estrategia(ABC):
+    # parametros: claves obligatorias en symbol_config (validar_configuracion).
+    # indicadores: los que necesita de 'rsi', 'bbands', 'atr' y 'vwap'; con ellos se decide qué calculan
+    # EstadoIndicadores y la caché de la optimización.
+    nombre = None
+    parametros = ('slatrcoef', 'TPSLRatio_coef', 'risk_perc', 'max_spread', 'rsi_length', 'rsi_overbought', 'rsi_oversold')
+    indicadores = ('rsi', 'bbands', 'atr')
+
+    @abstractmethod
+    def analizar(self, df, config, symbol=None):
+        # Velas -> velas con indicadores (o None)
+        pass
+
+    def senales(self, df, config):
+        # Columnas de señal intermedias que usan las reglas (o None)
+        return df
+
+    @abstractmethod
+    def reglas(self, config):
+        # Reglas de combinar_senales para TotalSignal
+        pass
+
+@registrar_estrategia
+class RsiBollinger(Estrategia):
+    nombre = 'rsi_bollinger'
+
+    def analizar(self, df, config, symbol=None):
+        return analyze_rsi_bollinger(df, config, symbol)
+
+    def senales(self, df, config):
+        df = bollinger_signal(df, config)
+        if df is None:
+            return None
+        df['RSI_signal'] = calculate_rsi_signal_windowed(df['RSI'], config)
+        if 'RSI_signal' not in df or df['RSI_signal'].isnull().all():
+            return None
+        return df
+
+    def reglas(self, config):
+        # Bollinger y RSI tienen que coincidir
+        return [
+            (2, [('bollinger_Signal', '==', 2), ('RSI_signal', '==', 2)]),
+            (1, [('bollinger_Signal', '==', 1), ('RSI_signal', '==', 1)]),
+        ]
+
+@registrar_estrategia
+class VwapBollinger(Estrategia):
+    nombre = 'vwap_bollinger'
+    parametros = Estrategia.parametros + ('backcandles',)
+    indicadores = ('vwap', 'rsi', 'bbands', 'atr')
+
+    def analizar(self, df, config, symbol=None):
+        return analyze_vwap_bollinger(df, config, symbol)
+
+    def senales(self, df, config):
+        return vwap_signal(df, config)
+
+    def reglas(self, config):
+        # Tendencia VWAP + toque de banda + filtro RSI
+        bbl, _, bbu = columnas_bollinger(config)
+        return [
+            (2, [('VWAPSignal', '==', 2), ('close', '<=', bbl), ('RSI', '<', 45)]),
+            (1, [('VWAPSignal', '==', 1), ('close', '>=', bbu), ('RSI', '>', 55)]),
+        ]
+
+def usa_indicador(config, indicador):
+    return indicador in ESTRATEGIAS[config['strategy']].indicadores
+
+@cronometrado("process", 1)
+def process(df, symbol, indicadores_calculados=False, config=None, marcos=None):
     if df is None or df.empty:
         logging.error(f"DataFrame vacío o nulo en process para {symbol}")
         return None
     try:
-        config = symbol_config[symbol]
-        if config['strategy'] == 'rsi_bollinger':
-            df = analyze_rsi_bollinger(df, config)
-            if df is None:
-                return None
-            df = bollinger_signal(df)
-            if df is None:
-                return None
-            df['RSI_signal'] = calculate_rsi_signal_windowed(df['RSI'], config)
-            if 'RSI_signal' not in df or df['RSI_signal'].isnull().all():
-                return None
-            df['TotalSignal'] = df.apply(lambda row: row['bollinger_Signal'] if row['bollinger_Signal'] == row['RSI_signal'] else 0, axis=1)
-        elif config['strategy'] == 'vwap_bollinger':
-            df = analyze_vwap_bollinger(df, config)
-            if df is None:
-                return None
-            df = vwap_signal(df, config)
-            if df is None:
-                return None
-            df['TotalSignal'] = df.apply(lambda row: 2 if row['VWAPSignal'] == 2 and row['close'] <= row['BBL_14_2.0'] and row['RSI'] < 45 else
-                                                     1 if row['VWAPSignal'] == 1 and row['close'] >= row['BBU_14_2.0'] and row['RSI'] > 55 else 0, axis=1)
-        else:
+        config = config or symbol_config[symbol]
+        estrategia = ESTRATEGIAS.get(config['strategy'])
+        if estrategia is None:
             logging.error(f"Estrategia no reconocida para {symbol}")
             return None
+        if not indicadores_calculados:
+            df = estrategia.analizar(df, config, symbol)
+        if df is None:
+            return None
+        df = estrategia.senales(df, config)
+        if df is None:
+            return None
+        df['TotalSignal'] = combinar_senales(df, estrategia.reglas(config))
+        if marcos:
+            aplicar_filtros_htf(df, marcos, config, symbol)
         
-        logging.info(f"Procesamiento completado para {symbol}. Señales totales: {df['TotalSignal'].value_counts()}")
+        logging.info("Procesamiento completado para %s. Señales totales: %s", symbol, Perezoso(df['TotalSignal'].value_counts))
         
         return df
     except Exception as e:
@@ -286,6 +1545,771 @@ def process(df, symbol):
         detailed_logger.error(f"Error en process para {symbol}: {str(e)}\nTraceback: {traceback.format_exc()}")
         return None
 
+# ---------------------------------------------------------------------------
+# Modo incremental: estado de indicadores por símbolo que se actualiza vela a vela
+# ---------------------------------------------------------------------------
+
+COLUMNAS_OHLC = ['open', 'high', 'low', 'close', 'tick_volume', 'spread', 'real_volume']
+
+class _EWMIncremental:
+    # Media exponencial equivalente a Series.ewm(alpha=alpha, min_periods=min_periods).mean()
+    # (adjust=True, ignore_na=False). Replica paso a paso el algoritmo de pandas, que es el que
+    # usa pandas_ta en rma() para RSI y ATR, por lo que el resultado es el mismo bit a bit.
+    def __init__(self, length):
+        self.alpha = 1.0 / length
+        self.min_periods = length
+        self.ponderado = math.nan
+        self.peso = 1.0
+        self.nobs = 0
+        self.iniciado = False
+
+    def _siguiente(self, x):
+        observado = x == x
+        if not self.iniciado:
+            return x, 1.0, int(observado)
+        ponderado, peso, nobs = self.ponderado, self.peso, self.nobs + int(observado)
+        if ponderado == ponderado:
+            peso *= 1.0 - self.alpha
+            if observado:
+                if ponderado != x:
+                    ponderado = (peso * ponderado + x) / (peso + 1.0)
+                peso += 1.0
+        elif observado:
+            ponderado = x
+        return ponderado, peso, nobs
+
+    def actualizar(self, x, confirmar=True):
+        ponderado, peso, nobs = self._siguiente(x)
+        if confirmar:
+            self.ponderado, self.peso, self.nobs, self.iniciado = ponderado, peso, nobs, True
+        return ponderado if nobs >= self.min_periods else math.nan
+
+class _VentanaMovil:
+    # Media y desviación típica (ddof=0) de las últimas `length` velas con sumas desplazadas
+    # respecto a una referencia para no perder precisión con varianzas pequeñas.
+    def __init__(self, length, resincronizar_cada=1000):
+        self.length = length
+        self.valores = deque()
+        self.referencia = None
+        self.suma = 0.0
+        self.suma_cuadrados = 0.0
+        self.resincronizar_cada = resincronizar_cada
+        self.actualizaciones = 0
+
+    def actualizar(self, x, confirmar=True):
+        if self.referencia is None:
+            referencia = x
+        else:
+            referencia = self.referencia
+        d = x - referencia
+        suma = self.suma + d
+        suma_cuadrados = self.suma_cuadrados + d * d
+        n = len(self.valores) + 1
+        if n > self.length:
+            salida = self.valores[0] - referencia
+            suma -= salida
+            suma_cuadrados -= salida * salida
+            n = self.length
+        if confirmar:
+            self.referencia = referencia
+            self.valores.append(x)
+            if len(self.valores) > self.length:
+                self.valores.popleft()
+            self.suma, self.suma_cuadrados = suma, suma_cuadrados
+            self.actualizaciones += 1
+            if self.actualizaciones % self.resincronizar_cada == 0:
+                # Evita que los errores de redondeo se acumulen en ejecuciones largas
+                self.referencia = x
+                desvios = [v - x for v in self.valores]
+                self.suma = sum(desvios)
+                self.suma_cuadrados = sum(v * v for v in desvios)
+        if n < self.length:
+            return math.nan, math.nan
+        media = suma / n
+        varianza = max(suma_cuadrados / n - media * media, 0.0)
+        return referencia + media, math.sqrt(varianza)
+
+class EstadoIndicadores:
+    # Buffer circular de velas cerradas con RSI, Bollinger, ATR y VWAP en streaming, O(1) por vela.
+    # Produce las mismas columnas que analyze_rsi_bollinger/analyze_vwap_bollinger.
+    def __init__(self, symbol, config, tamano_buffer=150):
+        self.symbol = symbol
+        self.config = dict(config)
+        self.con_vwap = usa_indicador(config, 'vwap')
+        self.rsi_positivo = _EWMIncremental(config['rsi_length'])
+        self.rsi_negativo = _EWMIncremental(config['rsi_length'])
+        self.bb_length, self.bb_std = parametros_bollinger(config)
+        self.bollinger = _VentanaMovil(self.bb_length)
+        self.atr = _EWMIncremental(7)
+        self.cierre_anterior = math.nan
+        self.vwap_dia = None
+        self.vwap_precio_volumen = 0.0
+        self.vwap_volumen = 0.0
+        self.ultimo_tiempo = None
+        self.filas = deque(maxlen=tamano_buffer)
+
+        bbl, bbm, bbu = columnas_bollinger(config)
+        sufijo = bbl[3:]
+        indicadores = ['RSI', bbl, bbm, bbu, f"BBB{sufijo}", f"BBP{sufijo}", 'ATR']
+        if self.con_vwap:
+            indicadores = ['VWAP'] + indicadores
+        self.columnas = COLUMNAS_OHLC + indicadores
+
+    def _calcular(self, barra, confirmar):
+        tiempo, open_, high, low, close, tick_volume, spread, real_volume = barra
+
+        diferencia = close - self.cierre_anterior
+        positivo = diferencia if not diferencia < 0 else 0.0
+        negativo = diferencia if not diferencia > 0 else 0.0
+        media_positiva = self.rsi_positivo.actualizar(positivo, confirmar)
+        media_negativa = self.rsi_negativo.actualizar(negativo, confirmar)
+        suma = media_positiva + abs(media_negativa)
+        # Cierres planos: 0/0 da NaN, como rsi_nativo
+        rsi = 100.0 * media_positiva / suma if suma else math.nan
+
+        media, desviacion = self.bollinger.actualizar(close, confirmar)
+        desvios = self.bb_std * desviacion
+        lower = media - desvios
+        upper = media + desvios
+        # Rango nulo (cierres planos): epsilon, como _sin_ceros / non_zero_range de pandas_ta.
+        # %B respecto a la media: igual que (close - lower) / rango, pero vale 0.5 con bandas
+        # colapsadas, que es lo que da el cálculo completo con el ruido del std móvil
+        rango = upper - lower or sys.float_info.epsilon
+        bandwidth = 100 * rango / media
+        percent = 0.5 + (close - media) / rango
+
+        if self.cierre_anterior == self.cierre_anterior:
+            rango = max(abs(high - low), abs(high - self.cierre_anterior), abs(self.cierre_anterior - low))
+        else:
+            rango = math.nan
+        atr = self.atr.actualizar(rango, confirmar)
+
+        fila = [tiempo, open_, high, low, close, tick_volume, spread, real_volume]
+        if self.con_vwap:
+            dia = tiempo // 86400
+            precio_volumen = (high + low + close) / 3.0 * tick_volume
+            if dia == self.vwap_dia:
+                acumulado_pv = self.vwap_precio_volumen + precio_volumen
+                acumulado_v = self.vwap_volumen + tick_volume
+            else:
+                acumulado_pv, acumulado_v = precio_volumen, float(tick_volume)
+            if confirmar:
+                self.vwap_dia, self.vwap_precio_volumen, self.vwap_volumen = dia, acumulado_pv, acumulado_v
+            fila.append(acumulado_pv / acumulado_v if acumulado_v else math.nan)
+
+        fila += [rsi, lower, media, upper, bandwidth, percent, atr]
+        if confirmar:
+            self.cierre_anterior = close
+            self.ultimo_tiempo = tiempo
+        return fila
+
+    def agregar_barra(self, barra):
+        # Las velas con high == low se descartan igual que en analyze_*
+        if barra[2] == barra[3]:
+            self.ultimo_tiempo = barra[0]
+            return
+        self.filas.append(self._calcular(barra, confirmar=True))
+
+    def dataframe(self, barra_en_curso=None):
+        filas = list(self.filas)
+        if barra_en_curso is not None and barra_en_curso[2] != barra_en_curso[3]:
+            filas.append(self._calcular(barra_en_curso, confirmar=False))
+        df = pd.DataFrame(filas, columns=['time'] + self.columnas)
+        df['time'] = pd.to_datetime(df['time'], unit='s')
+        df.set_index('time', inplace=True)
+        return df.dropna()
+
+def _barras_desde_rates(raw):
+    return [(int(b['time']), float(b['open']), float(b['high']), float(b['low']), float(b['close']),
+             int(b['tick_volume']), int(b['spread']), int(b['real_volume'])) for b in raw]
+
+def _barras_desde_dataframe(df):
+    tiempos = (df.index - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+    return [(int(t), float(o), float(h), float(l), float(c), int(v), int(s), int(r))
+            for t, o, h, l, c, v, s, r in zip(tiempos, *(df[col].to_numpy() for col in COLUMNAS_OHLC))]
+
+estados_incrementales = {}
+
+def _sembrar_estado(symbol, config):
+    df = obtener_datos_ohlc(symbol)
+    if df is None:
+        return None, None
+    estado = EstadoIndicadores(symbol, config, incremental_buffer)
+    barras = _barras_desde_dataframe(df)
+    for barra in barras[:-1]:
+        estado.agregar_barra(barra)
+    estados_incrementales[symbol] = estado
+    logging.info(f"Estado incremental inicializado para {symbol} con {len(barras) - 1} velas cerradas")
+    return estado, barras[-1]
+
+@cronometrado("obtener_datos_incremental", 0)
+def obtener_datos_incremental(symbol):
+    # Descarga solo las velas posteriores a la última cerrada y actualiza el estado. La última
+    # vela recibida puede estar en formación, así que se evalúa sin confirmarla en el estado.
+    config = symbol_config[symbol]
+    estado = estados_incrementales.get(symbol)
+    try:
+        if estado is None or estado.config != config:
+            estado, en_curso = _sembrar_estado(symbol, config)
+            if estado is None:
+                return None
+            return estado.dataframe(en_curso)
+
+        if not verificar_conexion_mt5():
+            raise ConnectionError("No se pudo reconectar a MetaTrader 5")
+        ahora = get_now() + timedelta(hours=3)
+        desde = datetime.fromtimestamp(estado.ultimo_tiempo, tz=pytz.utc)
+        raw = descargar_velas(symbol, timeframe, desde, ahora)
+        if raw is None or len(raw) == 0:
+            raise ValueError(f"Sin velas nuevas desde {desde} para {symbol}")
+        barras = _barras_desde_rates(raw)
+        if barras[0][0] > estado.ultimo_tiempo:
+            raise ValueError(f"Hueco en el histórico de {symbol}: la última vela cerrada no está en la respuesta")
+        nuevas = [barra for barra in barras if barra[0] > estado.ultimo_tiempo]
+        registrar_barras(symbol, nuevas[:-1])
+        for barra in nuevas[:-1]:
+            estado.agregar_barra(barra)
+        logging.info(f"Estado incremental actualizado para {symbol}: {len(nuevas)} velas nuevas")
+        return estado.dataframe(nuevas[-1] if nuevas else None)
+    except Exception as e:
+        logging.error(f"Error en obtener_datos_incremental para {symbol}, se reconstruye el estado: {str(e)}")
+        detailed_logger.error(f"Error en obtener_datos_incremental para {symbol}: {str(e)}\nTraceback: {traceback.format_exc()}")
+        estados_incrementales.pop(symbol, None)
+        estado, en_curso = _sembrar_estado(symbol, config)
+        if estado is None:
+            return None
+        return estado.dataframe(en_curso)
+
+# ---------------------------------------------------------------------------
+# Multi-timeframe: velas de timeframes superiores agregadas desde el timeframe base
+# ---------------------------------------------------------------------------
+
+def timeframe_estrategia(config):
+    # "timeframe" en symbol_config; sin él la estrategia usa el timeframe global (el flujo base)
+    return parsear_timeframe(config.get('timeframe', timeframe))
+
+def filtros_htf(config):
+    # "htf_filter": {"timeframe": "H1", "indicator": "vwap"} o una lista de filtros
+    filtros = config.get('htf_filter') or []
+    if isinstance(filtros, dict):
+        filtros = [filtros]
+    return [dict(filtro, timeframe=parsear_timeframe(filtro['timeframe']), indicator=filtro.get('indicator', 'vwap'))
+            for filtro in filtros]
+
+def usa_multitimeframe(config):
+    return timeframe_estrategia(config) != timeframe or bool(config.get('htf_filter'))
+
+class RemuestreadorVelas:
+    # Agrega las velas cerradas del timeframe base en las de otros timeframes, vela a vela: open de
+    # la primera, high/low extremos, close de la última, volúmenes sumados y spread mínimo. Solo se
+    # guardan las últimas tamano_buffer velas cerradas de cada timeframe.
+    def __init__(self, base, timeframes, tamano_buffer=150):
+        self.periodo_base = segundos_timeframe(base)
+        self.periodos = {}
+        for tf in timeframes:
+            periodo = segundos_timeframe(tf)
+            if periodo % self.periodo_base:
+                raise ValueError(f"{nombre_timeframe(tf)} no es múltiplo del timeframe base {nombre_timeframe(base)}")
+            self.periodos[tf] = periodo
+        self.cerradas = {tf: deque(maxlen=tamano_buffer) for tf in self.periodos}
+        self.en_curso = dict.fromkeys(self.periodos)
+        self.primera = None
+
+    @staticmethod
+    def _acumular(vela, inicio, barra):
+        if vela is None:
+            return [inicio, *barra[1:]]
+        vela[2] = max(vela[2], barra[2])
+        vela[3] = min(vela[3], barra[3])
+        vela[4] = barra[4]
+        vela[5] += barra[5]
+        vela[6] = min(vela[6], barra[6])
+        vela[7] += barra[7]
+        return vela
+
+    def _cerrar(self, tf, vela, cerradas):
+        # La primera vela puede empezar antes que el histórico recibido: se descarta por incompleta
+        if vela[0] < self.primera:
+            return
+        vela = tuple(vela)
+        self.cerradas[tf].append(vela)
+        cerradas.append((tf, vela))
+
+    def agregar(self, barra):
+        # Barra cerrada del timeframe base; devuelve [(tf, vela)] con las velas que quedan cerradas.
+        # Una vela se cierra con su última barra base o, si hay huecos, con la primera de la siguiente.
+        if self.primera is None:
+            self.primera = barra[0]
+        cerradas = []
+        for tf, periodo in self.periodos.items():
+            inicio = barra[0] - barra[0] % periodo
+            vela = self.en_curso[tf]
+            if vela is not None and vela[0] != inicio:
+                self._cerrar(tf, vela, cerradas)
+                vela = None
+            vela = self._acumular(vela, inicio, barra)
+            if barra[0] + self.periodo_base >= inicio + periodo:
+                self._cerrar(tf, vela, cerradas)
+                vela = None
+            self.en_curso[tf] = vela
+        return cerradas
+
+    def cerrar_anteriores(self, tiempo):
+        # Las velas pendientes de otro periodo que el de la barra base en curso ya no recibirán más barras
+        cerradas = []
+        for tf, periodo in self.periodos.items():
+            vela = self.en_curso[tf]
+            if vela is not None and vela[0] != tiempo - tiempo % periodo:
+                self._cerrar(tf, vela, cerradas)
+                self.en_curso[tf] = None
+        return cerradas
+
+    def vela_en_curso(self, tf, barra_en_curso=None):
+        # Vela en formación incluyendo la barra base en curso, sin modificar el estado
+        vela = self.en_curso[tf]
+        if barra_en_curso is not None:
+            inicio = barra_en_curso[0] - barra_en_curso[0] % self.periodos[tf]
+            vela = self._acumular(list(vela) if vela is not None else None, inicio, barra_en_curso)
+        if vela is None or self.primera is None or vela[0] < self.primera:
+            return None
+        return tuple(vela)
+
+    def dataframe(self, tf, barra_en_curso=None):
+        filas = list(self.cerradas[tf])
+        vela = self.vela_en_curso(tf, barra_en_curso)
+        if vela is not None:
+            filas.append(vela)
+        df = pd.DataFrame(filas, columns=['time'] + COLUMNAS_OHLC)
+        df['time'] = pd.to_datetime(df['time'], unit='s')
+        return df.set_index('time')
+
+def remuestrear_dataframe(df, tf):
+    # Versión vectorizada de RemuestreadorVelas para el backtest: mismas velas a partir de todo el histórico
+    periodo = segundos_timeframe(tf)
+    tiempos = ((df.index - pd.Timestamp(0)) // pd.Timedelta(seconds=1)).to_numpy()
+    inicios = tiempos - tiempos % periodo
+    cortes = np.flatnonzero(np.diff(inicios)) + 1
+    primeras = np.concatenate(([0], cortes))
+    ultimas = np.concatenate((cortes - 1, [len(df) - 1]))
+    columnas = {
+        'open': df.open.to_numpy()[primeras],
+        'high': np.maximum.reduceat(df.high.to_numpy(), primeras),
+        'low': np.minimum.reduceat(df.low.to_numpy(), primeras),
+        'close': df.close.to_numpy()[ultimas],
+        'tick_volume': np.add.reduceat(df.tick_volume.to_numpy(), primeras),
+        'spread': np.minimum.reduceat(df.spread.to_numpy(), primeras),
+        'real_volume': np.add.reduceat(df.real_volume.to_numpy(), primeras),
+    }
+    resultado = pd.DataFrame(columnas, index=pd.to_datetime(inicios[primeras], unit='s').rename('time'))
+    if len(df) and inicios[0] < tiempos[0]:
+        resultado = resultado.iloc[1:]
+    return resultado
+
+def tendencia_htf(marco, filtro, symbol=None):
+    # +1 alcista, -1 bajista y 0 sin datos por vela del timeframe superior. "vwap": close frente al
+    # VWAP diario; "rsi": RSI(rsi_length) frente a 50.
+    marco = marco[marco.high != marco.low]
+    if marco.empty:
+        return marco.index, np.zeros(0, dtype=np.int64)
+    huella = huella_velas(marco)
+    if filtro['indicator'] == 'vwap':
+        referencia = indicador_cacheado(huella, 'vwap', (filtro['timeframe'],),
+                                lambda: motor_indicadores.vwap(marco.high, marco.low, marco.close, marco.tick_volume))
+        valor, referencia = marco.close.to_numpy(), referencia.to_numpy()
+    elif filtro['indicator'] == 'rsi':
+        length = filtro.get('rsi_length', 14)
+        valor = indicador_cacheado(huella, 'rsi', (length, filtro['timeframe']),
+                           lambda: motor_indicadores.rsi(marco.close, length=length)).to_numpy()
+        referencia = 50.0
+    else:
+        raise ValueError(f"Indicador de filtro desconocido: {filtro['indicator']}")
+    return marco.index, np.where(valor > referencia, 1, np.where(valor < referencia, -1, 0))
+
+def aplicar_filtros_htf(df, marcos, config, symbol=None):
+    # Anula las compras (2) sin tendencia alcista y las ventas (1) sin tendencia bajista en cada
+    # filtro. Cada vela de la estrategia ve la última vela del timeframe superior que termina
+    # antes o a la vez que ella, así el backtest no mira al futuro y coincide con lo que se ve en vivo.
+    periodo = segundos_timeframe(timeframe_estrategia(config))
+    fin = ((df.index - pd.Timestamp(0)) // pd.Timedelta(seconds=1)).to_numpy() + periodo
+    senal = df['TotalSignal'].to_numpy().copy()
+    for filtro in filtros_htf(config):
+        tf = filtro['timeframe']
+        indice, tendencia = tendencia_htf(marcos[tf], filtro, symbol)
+        fin_htf = ((indice - pd.Timestamp(0)) // pd.Timedelta(seconds=1)).to_numpy() + segundos_timeframe(tf)
+        posicion = np.searchsorted(fin_htf, fin, side='right') - 1
+        tendencia = np.where(posicion >= 0, tendencia[np.maximum(posicion, 0)], 0) if len(tendencia) else np.zeros(len(df), dtype=np.int64)
+        df[f"HTF_{filtro['indicator'].upper()}_{nombre_timeframe(tf)}"] = tendencia
+        senal[((senal == 2) & (tendencia != 1)) | ((senal == 1) & (tendencia != -1))] = 0
+    df['TotalSignal'] = senal
+    return df
+
+class EstadoMultiTimeframe:
+    # Estado de un símbolo cuya estrategia o filtros usan otros timeframes: un remuestreador
+    # alimentado con el timeframe base y los indicadores de la estrategia actualizados vela a vela
+    def __init__(self, symbol, config, tamano_buffer=150):
+        self.symbol = symbol
+        self.config = dict(config)
+        self.timeframe = timeframe_estrategia(config)
+        self.filtros = filtros_htf(config)
+        timeframes = {self.timeframe} | {filtro['timeframe'] for filtro in self.filtros}
+        self.remuestreador = RemuestreadorVelas(timeframe, timeframes, tamano_buffer)
+        self.indicadores = EstadoIndicadores(symbol, config, tamano_buffer)
+        self.ultimo_tiempo = None
+
+    def _confirmar(self, cerradas):
+        nueva = False
+        for tf, vela in cerradas:
+            if tf == self.timeframe:
+                self.indicadores.agregar_barra(vela)
+                nueva = True
+        return nueva
+
+    def agregar_barra(self, barra):
+        # Barra cerrada del timeframe base; True si cierra una vela del timeframe de la estrategia
+        self.ultimo_tiempo = barra[0]
+        return self._confirmar(self.remuestreador.agregar(barra))
+
+    def dataframe(self, barra_en_curso=None):
+        if barra_en_curso is not None:
+            self._confirmar(self.remuestreador.cerrar_anteriores(barra_en_curso[0]))
+        return self.indicadores.dataframe(self.remuestreador.vela_en_curso(self.timeframe, barra_en_curso))
+
+    def marcos(self, barra_en_curso=None):
+        return {filtro['timeframe']: self.remuestreador.dataframe(filtro['timeframe'], barra_en_curso)
+                for filtro in self.filtros}
+
+estados_multitimeframe = {}
+
+def _sembrar_multitimeframe(symbol, config):
+    # Una descarga del timeframe base que cubre incremental_buffer velas del mayor timeframe
+    try:
+        if not verificar_conexion_mt5():
+            raise ConnectionError("No se pudo reconectar a MetaTrader 5")
+        estado = EstadoMultiTimeframe(symbol, config, incremental_buffer)
+        mayor = max(estado.remuestreador.periodos.values())
+        ahora = get_now() + timedelta(hours=3)
+        raw = descargar_velas(symbol, timeframe, ahora - timedelta(seconds=(incremental_buffer + 1) * mayor), ahora)
+        if raw is None or len(raw) < 2:
+            raise ValueError(f"Datos OHLC vacíos o insuficientes para {symbol}")
+        barras = _barras_desde_rates(raw)
+        registrar_barras(symbol, barras[-2:-1])
+        for barra in barras[:-1]:
+            estado.agregar_barra(barra)
+        estados_multitimeframe[symbol] = estado
+        logging.info(f"Estado multi-timeframe inicializado para {symbol} con {len(barras) - 1} velas base cerradas "
+                     f"({', '.join(nombre_timeframe(tf) for tf in estado.remuestreador.periodos)})")
+        return estado, barras[-1]
+    except Exception as e:
+        logging.error(f"Error al inicializar el estado multi-timeframe de {symbol}: {str(e)}")
+        detailed_logger.error(f"Error al inicializar el estado multi-timeframe de {symbol}: {str(e)}\nTraceback: {traceback.format_exc()}")
+        estados_multitimeframe.pop(symbol, None)
+        return None, None
+
+@cronometrado("obtener_datos_multitimeframe", 0)
+def obtener_datos_multitimeframe(symbol):
+    # Como obtener_datos_incremental, una sola petición del timeframe base por ciclo. Devuelve el
+    # DataFrame de la estrategia con sus indicadores y {timeframe: velas} de los filtros.
+    config = symbol_config[symbol]
+    estado = estados_multitimeframe.get(symbol)
+    try:
+        if estado is None or estado.config != config:
+            estado, en_curso = _sembrar_multitimeframe(symbol, config)
+        else:
+            if not verificar_conexion_mt5():
+                raise ConnectionError("No se pudo reconectar a MetaTrader 5")
+            ahora = get_now() + timedelta(hours=3)
+            desde = datetime.fromtimestamp(estado.ultimo_tiempo, tz=pytz.utc)
+            raw = descargar_velas(symbol, timeframe, desde, ahora)
+            if raw is None or len(raw) == 0:
+                raise ValueError(f"Sin velas nuevas desde {desde} para {symbol}")
+            barras = _barras_desde_rates(raw)
+            if barras[0][0] > estado.ultimo_tiempo:
+                raise ValueError(f"Hueco en el histórico de {symbol}: la última vela cerrada no está en la respuesta")
+            nuevas = [barra for barra in barras if barra[0] > estado.ultimo_tiempo]
+            registrar_barras(symbol, nuevas[:-1])
+            for barra in nuevas[:-1]:
+                estado.agregar_barra(barra)
+            en_curso = nuevas[-1] if nuevas else None
+    except Exception as e:
+        logging.error(f"Error en obtener_datos_multitimeframe para {symbol}, se reconstruye el estado: {str(e)}")
+        detailed_logger.error(f"Error en obtener_datos_multitimeframe para {symbol}: {str(e)}\nTraceback: {traceback.format_exc()}")
+        estados_multitimeframe.pop(symbol, None)
+        estado, en_curso = _sembrar_multitimeframe(symbol, config)
+    if estado is None:
+        return None
+    return estado.dataframe(en_curso), estado.marcos(en_curso)
+
+def valor_pip(close):
+    return (1e-4 / close) * 1e5
+
+def calcular_tamano(config, equity, slatr, pip_value):
+    return round((config['risk_perc'] * equity / (slatr * pip_value)) / 100000.0, 2)
+
+def calcular_sl_tp(signal, entry_price, slatr, spread, config):
+    # SL a una distancia de slatr y TP a slatr * TPSLRatio_coef, ambos ampliados con el spread
+    if signal == 2:
+        return entry_price - slatr - spread, entry_price + slatr * config['TPSLRatio_coef'] + spread
+    return entry_price + slatr + spread, entry_price - slatr * config['TPSLRatio_coef'] - spread
+
+def slippage_simulado(symbol, rng=None):
+    # Slippage aleatorio para símbolos sin market book
+    rng = rng or np.random
+    if symbol == 'AUDNZD':
+        return rng.uniform(-0.0002, 0.0002)  # Simulación de slippage para AUDNZD (2 pips)
+    elif symbol == 'USDCAD':
+        return rng.uniform(-0.0003, 0.0003)  # Simulación de slippage para USDCAD (3 pips)
+    elif symbol == 'EURUSD':
+        return rng.uniform(-0.0001, 0.00015)  # Simulación de slippage para EURUSD (1-1.5 pips)
+    return rng.uniform(-0.0003, 0.0003)
+
+# ---------------------------------------------------------------------------
+# Riesgo de cartera: equity al inicio del día, valor real del punto, exposición por divisa y correlación
+# ---------------------------------------------------------------------------
+
+# valor_punto: lo que vale en la divisa de la cuenta un movimiento de 1.0 del precio con 1 lote
+# (trade_tick_value / trade_tick_size); base y cotizada son currency_base y currency_profit
+ContratoSimbolo = namedtuple('ContratoSimbolo', ['valor_punto', 'minimo', 'maximo', 'paso', 'base', 'cotizada'])
+
+def contrato_simbolo(info, symbol):
+    tick_value = getattr(info, 'trade_tick_value', None) or 0.0
+    tick_size = getattr(info, 'trade_tick_size', None) or 0.0
+    if not (tick_value > 0 and tick_size > 0):
+        return None
+    return ContratoSimbolo(tick_value / tick_size, getattr(info, 'volume_min', None) or 0.01,
+                           getattr(info, 'volume_max', None) or math.inf, getattr(info, 'volume_step', None) or 0.01,
+                           getattr(info, 'currency_base', None) or symbol[:3],
+                           getattr(info, 'currency_profit', None) or symbol[3:6])
+
+def tamano_por_riesgo(config, equity, distancia_sl, valor_punto, minimo=0.01, maximo=math.inf, paso=0.01):
+    # Lotes con los que saltar el SL cuesta risk_perc del equity, redondeados hacia abajo al paso de
+    # volumen. Por debajo del mínimo no se opera (0) en vez de arriesgar más de lo configurado.
+    lotes = config['risk_perc'] * equity / (distancia_sl * valor_punto)
+    return ajustar_volumen(min(lotes, maximo), minimo, paso)
+
+def ajustar_volumen(lotes, minimo=0.01, paso=0.01):
+    lotes = math.floor(lotes / paso + 1e-9) * paso
+    return round(lotes, 8) if lotes >= minimo else 0.0
+
+def correlacion_por_pares(X, M, min_solape=30):
+    # Correlación de Pearson de cada par de filas de X usando solo las columnas en las que ambas
+    # tienen dato (M = 1). Tres productos de matrices en vez de S² correlaciones sueltas; los pares
+    # con menos de min_solape observaciones comunes quedan a 0.
+    X = X * M
+    n = M @ M.T
+    suma = X @ M.T                  # suma[i, j]: suma de x_i donde también hay x_j
+    cuadrados = (X * X) @ M.T
+    cruzados = X @ X.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        media_i = suma / n
+        media_j = media_i.T
+        covarianza = cruzados / n - media_i * media_j
+        varianza_i = cuadrados / n - media_i ** 2
+        correlacion = covarianza / np.sqrt(varianza_i * varianza_i.T)
+    correlacion[~np.isfinite(correlacion) | (n < min_solape)] = 0.0
+    np.clip(correlacion, -1.0, 1.0, out=correlacion)
+    np.fill_diagonal(correlacion, 1.0)
+    return correlacion
+
+class RiesgoCartera:
+    # Estado de riesgo de la cuenta compartido por todos los símbolos:
+    # - equity al inicio del día por cuenta, persistido en risk_state_file para que un reinicio a
+    #   mitad de día no mueva la referencia de max_daily_loss;
+    # - tamaño con el valor real del punto de symbol_info (risk_sizing "contrato");
+    # - exposición neta por divisa de todas las posiciones abiertas (max_currency_exposure);
+    # - riesgo correlado sqrt(rᵀ C r) con la matriz de correlación de los últimos `ventana`
+    #   rendimientos de cada símbolo (max_correlated_risk). La matriz se recalcula una vez por ciclo.
+    def __init__(self, ruta="estado_riesgo.json", ventana=100, min_solape=30):
+        self.ruta = ruta
+        self.ventana = ventana
+        self.min_solape = min_solape
+        self.lock = threading.Lock()
+        self.inicios = None
+        self.cierres = {}
+        self.correlacion = None
+        self.indices = {}
+        self._posiciones = None
+
+    def _cargar(self):
+        try:
+            with open(self.ruta) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (json.JSONDecodeError, OSError) as e:
+            logging.error(f"No se pudo leer {self.ruta}, se toma el equity actual como inicio del día: {str(e)}")
+            return {}
+
+    def _guardar(self):
+        # Escritura atómica: un corte a mitad no deja el fichero a medias
+        temporal = f"{self.ruta}.tmp"
+        with open(temporal, "w") as f:
+            json.dump(self.inicios, f)
+        os.replace(temporal, self.ruta)
+
+    def equity_inicio_dia(self, clave, equity, dia=None):
+        dia = str(dia or get_now().date())
+        with self.lock:
+            if self.inicios is None:
+                self.inicios = self._cargar()
+            registro = self.inicios.get(clave)
+            if registro is None or registro.get('dia') != dia:
+                registro = self.inicios[clave] = {'dia': dia, 'equity': float(equity)}
+                try:
+                    self._guardar()
+                except OSError as e:
+                    logging.error(f"No se pudo guardar el equity al inicio del día en {self.ruta}: {str(e)}")
+                logging.info(f"Equity al inicio del día {dia} para {clave}: {equity:.2f}")
+            return registro['equity']
+
+    def contrato(self, symbol):
+        return contrato_simbolo(instantanea.simbolo(symbol), symbol)
+
+    def tamano(self, symbol, config, equity, distancia_sl, pip_value):
+        if risk_sizing == 'contrato':
+            contrato = self.contrato(symbol)
+            if contrato is not None:
+                return tamano_por_riesgo(config, equity, distancia_sl, contrato.valor_punto,
+                                         contrato.minimo, contrato.maximo, contrato.paso)
+            logging.debug(f"{symbol} sin trade_tick_value/trade_tick_size: tamaño con valor_pip")
+        return calcular_tamano(config, equity, distancia_sl, pip_value)
+
+    def observar(self, symbol, df):
+        # Cierres de las últimas velas cerradas (la última fila puede estar en formación)
+        cerradas = df.iloc[-(self.ventana + 2):-1]
+        tiempos = ((cerradas.index - pd.Timestamp(0)) // pd.Timedelta(seconds=1)).to_numpy()
+        with self.lock:
+            self.cierres[symbol] = (tiempos, cerradas.close.to_numpy(dtype=np.float64))
+
+    def nuevo_ciclo(self):
+        with self.lock:
+            self.correlacion = None
+
+    def matriz_correlacion(self):
+        with self.lock:
+            if self.correlacion is not None:
+                return self.indices, self.correlacion
+            series = {symbol: (tiempos[1:], np.diff(np.log(cierres)))
+                      for symbol, (tiempos, cierres) in self.cierres.items() if len(cierres) > 1}
+            simbolos = sorted(series)
+            rejilla = np.unique(np.concatenate([t for t, _ in series.values()])) if series else np.zeros(0, dtype=np.int64)
+            X = np.zeros((len(simbolos), len(rejilla)))
+            M = np.zeros_like(X)
+            for i, symbol in enumerate(simbolos):
+                tiempos, rendimientos = series[symbol]
+                columnas = np.searchsorted(rejilla, tiempos)
+                X[i, columnas] = rendimientos
+                M[i, columnas] = 1.0
+            self.indices = {symbol: i for i, symbol in enumerate(simbolos)}
+            self.correlacion = correlacion_por_pares(X, M, self.min_solape)
+            return self.indices, self.correlacion
+
+    def exposicion(self, posiciones):
+        # Exposición neta por divisa en la divisa de la cuenta: una compra de EURUSD suma su nominal
+        # en EUR y lo resta en USD. Devuelve (divisas, importes).
+        contratos, divisas, filas, signos, nominales = {}, {}, [], [], []
+        for posicion in posiciones:
+            if posicion.symbol not in contratos:
+                contratos[posicion.symbol] = self.contrato(posicion.symbol)
+            contrato = contratos[posicion.symbol]
+            if contrato is None or contrato.base == contrato.cotizada:
+                continue
+            direccion = 1.0 if posicion.type == mt5.POSITION_TYPE_BUY else -1.0
+            nominal = posicion.volume * posicion.price_open * contrato.valor_punto
+            for divisa, signo in ((contrato.base, direccion), (contrato.cotizada, -direccion)):
+                filas.append(divisas.setdefault(divisa, len(divisas)))
+                signos.append(signo)
+                nominales.append(nominal)
+        importes = np.zeros(len(divisas))
+        np.add.at(importes, np.asarray(filas, dtype=np.int64), np.asarray(signos) * np.asarray(nominales))
+        return list(divisas), importes
+
+    def riesgo_posiciones(self, posiciones, equity, indices):
+        # Vector r (fracción del equity que se pierde en el SL, con signo por dirección) por símbolo de
+        # la matriz, y suma de cuadrados de los símbolos sin rendimientos, que cuentan como independientes
+        r = np.zeros(len(indices))
+        sueltos = {}
+        for posicion in posiciones:
+            contrato = self.contrato(posicion.symbol)
+            if contrato is None or not posicion.sl:
+                continue  # Sin SL no hay pérdida acotada; la posición sigue contando en la exposición por divisa
+            direccion = 1.0 if posicion.type == mt5.POSITION_TYPE_BUY else -1.0
+            valor = direccion * abs(posicion.price_open - posicion.sl) * posicion.volume * contrato.valor_punto / equity
+            if posicion.symbol in indices:
+                r[indices[posicion.symbol]] += valor
+            else:
+                sueltos[posicion.symbol] = sueltos.get(posicion.symbol, 0.0) + valor
+        return r, sueltos
+
+    def _estado_posiciones(self, posiciones, equity, indices, correlacion):
+        # Exposición por divisa, vector de riesgo y varianza rᵀ C r de las posiciones abiertas. Se
+        # reutiliza mientras la instantánea devuelva las mismas posiciones (cambian al enviar órdenes),
+        # así cada símbolo del ciclo solo paga O(S) por su fila de la matriz.
+        cache = self._posiciones
+        if cache is not None and cache[0] is posiciones and cache[1] == equity and cache[2] is indices:
+            return cache[3]
+        divisas, importes = self.exposicion(posiciones)
+        r, sueltos = self.riesgo_posiciones(posiciones, equity, indices)
+        varianza = max(0.0, float(r @ correlacion @ r)) + sum(v * v for v in sueltos.values())
+        estado = (divisas, importes, r, sueltos, varianza)
+        self._posiciones = (posiciones, equity, indices, estado)
+        return estado
+
+    def limitar(self, symbol, signal, size, slatr):
+        # Reduce size para que la nueva posición respete max_currency_exposure y max_correlated_risk
+        # junto con todas las posiciones abiertas de la cuenta
+        if signal not in (1, 2) or not size > 0 or (max_currency_exposure is None and max_correlated_risk is None):
+            return size
+        try:
+            contrato = self.contrato(symbol)
+            cuenta = instantanea.cuenta()
+            if contrato is None or cuenta is None:
+                logging.warning(f"Sin valor del punto o sin cuenta para {symbol}: no se aplican los límites de cartera")
+                return size
+            equity = cuenta.equity
+            posiciones = instantanea.posiciones() or ()
+            direccion = 1.0 if signal == 2 else -1.0
+            info = instantanea.simbolo(symbol)
+            precio = info.ask if signal == 2 else info.bid
+            limite, motivos = size, []
+            indices, correlacion = self.matriz_correlacion()
+            divisas, importes, r, sueltos, varianza = self._estado_posiciones(posiciones, equity, indices, correlacion)
+
+            if max_currency_exposure is not None and contrato.base != contrato.cotizada:
+                maximo = max_currency_exposure * equity
+                nominal_lote = precio * contrato.valor_punto
+                for divisa, signo in ((contrato.base, direccion), (contrato.cotizada, -direccion)):
+                    actual = importes[divisas.index(divisa)] if divisa in divisas else 0.0
+                    disponible = max(0.0, maximo - signo * actual) / nominal_lote
+                    if disponible < limite:
+                        limite = disponible
+                        motivos.append(f"exposición en {divisa} {actual:.0f}")
+
+            if max_correlated_risk is not None:
+                if symbol in indices:
+                    b = float(correlacion[indices[symbol]] @ r)
+                else:
+                    b = sueltos.get(symbol, 0.0)
+                # (r + x)ᵀ C (r + x) <= cap² con x = direccion * u en la fila del símbolo
+                discriminante = b * b + max_correlated_risk ** 2 - varianza
+                u = -direccion * b + math.sqrt(discriminante) if discriminante > 0 else 0.0
+                disponible = max(0.0, u) * equity / (slatr * contrato.valor_punto)
+                if disponible < limite:
+                    limite = disponible
+                    motivos.append(f"riesgo correlado {math.sqrt(varianza):.2%} del equity")
+
+            if limite < size:
+                nuevo = ajustar_volumen(limite, contrato.minimo, contrato.paso)
+                logging.warning(f"Tamaño de {symbol} reducido de {size} a {nuevo} por los límites de cartera ({', '.join(motivos)})")
+                registrar_journal("riesgo", {"symbol": symbol, "senal": signal, "size": size, "limitado": nuevo,
+                                             "motivo": ", ".join(motivos)})
+                return nuevo
+            return size
+        except Exception as e:
+            logging.error(f"Error al aplicar los límites de cartera para {symbol}: {str(e)}")
+            detailed_logger.error(f"Error al aplicar los límites de cartera para {symbol}: {str(e)}\nTraceback: {traceback.format_exc()}")
+            return size
+
+@cronometrado("calcular_parametros_trading", 0)
 def calcular_parametros_trading(symbol, df):
     if df is None or df.empty:
         logging.error(f"DataFrame vacío o nulo en calcular_parametros_trading para {symbol}")
@@ -298,47 +2322,58 @@ def calcular_parametros_trading(symbol, df):
         slatr = 1.0 * df["ATR"].iloc[-1] * config['slatrcoef']
         
         # Obtener el valor actual de la cuenta
-        account_info = mt5.account_info()
+        account_info = instantanea.cuenta()
         if account_info is None:
             raise ValueError("No se pudo obtener la información de la cuenta")
         equity = account_info.equity
         
-        pip_value = (1e-4 / close) * 1e5
+        pip_value = valor_pip(close)
         
         if np.isnan(slatr) or np.isnan(pip_value):
             logging.error(f"Valores no válidos encontrados en el cálculo del tamaño para {symbol}. SLATR: {slatr}, Pip Value: {pip_value}")
             return None, None, None
         
-        # Obtener datos de profundidad de mercado
-        market_book = mt5.market_book_get(symbol)
-        if market_book is None:
-            size = round((config['risk_perc'] * equity / (slatr * pip_value)) / 100000.0, 2)
-        else:
-            # Calcular el tamaño de la orden basado en la liquidez disponible
-            available_volume = sum([item.volume for item in market_book])
-            size = min(round((config['risk_perc'] * equity / (slatr * pip_value)) / 100000.0, 2), available_volume)
+        # Limitar el tamaño a la liquidez del lado del libro contra el que se ejecuta (asks para
+        # comprar, bids para vender) y, con depth_max_impact, a la que hay cerca del mejor precio
+        size = riesgo.tamano(symbol, config, equity, slatr, pip_value)
+        lado = mt5.BOOK_TYPE_SELL if signal == 2 else mt5.BOOK_TYPE_BUY
+        available_volume = profundidad.liquidez(symbol, lado) if signal in (1, 2) else None
+        if available_volume is not None:
+            size = min(size, available_volume)
+            if depth_max_impact is not None:
+                mejor = profundidad.mejor_precio(symbol, lado)
+                punto = getattr(instantanea.simbolo(symbol), 'point', 0.00001)
+                limite = mejor + depth_max_impact * punto if signal == 2 else mejor - depth_max_impact * punto
+                size = min(size, profundidad.volumen_hasta(symbol, lado, limite))
         
         ahora = get_now() 
         
         logging.info(f"Parámetros de trading calculados para {symbol}: Tamaño del lote: {size}, SLATR: {slatr}, TPSLRatio: {config['TPSLRatio_coef']}, Señal: {signal}, Pip Value: {pip_value}")
-        detailed_logger.debug(f"Parámetros de trading para {symbol}:\n"
-                              f"Tamaño del lote: {size}\n"
-                              f"SLATR: {slatr}\n"
-                              f"TPSLRatio: {config['TPSLRatio_coef']}\n"
-                              f"Señal: {signal}\n"
-                              f"Pip Value: {pip_value}\n"
-                              f"Equity: {equity}\n"
-                              f"close: {close}")
-        
-        with open(f"registro_dataframe_{symbol}.txt", "a") as f:
-            f.write(f"Tamaño del lote calculado: {size} : {ahora}\n")
-            f.write(str(df.iloc[-1]) + "\n\n")
-            f.write(f"SLATR: {slatr}\n")
-            f.write(f"PIP Value: {pip_value}\n")
+        detailed_logger.debug("Parámetros de trading para %s:\n"
+                              "Tamaño del lote: %s\n"
+                              "SLATR: %s\n"
+                              "TPSLRatio: %s\n"
+                              "Señal: %s\n"
+                              "Pip Value: %s\n"
+                              "Equity: %s\n"
+                              "close: %s",
+                              symbol, size, slatr, config['TPSLRatio_coef'], signal, pip_value, equity, close)
+        
+        auditar(f"registro_dataframe_{symbol}.txt",
+                f"Tamaño del lote calculado: {size} : {ahora}\n",
+                lambda: str(df.iloc[-1]) + "\n\n",
+                f"SLATR: {slatr}\n",
+                f"PIP Value: {pip_value}\n")
         
         # Guardar el valor de size en un archivo
-        with open(f"size_log_{symbol}.txt", "a") as f:
-            f.write(f"{ahora},{size}\n")
+        auditar(f"size_log_{symbol}.txt", f"{ahora},{size}\n")
+        bbl, bbm, bbu = columnas_bollinger(config)
+        fila = df.iloc[-1]
+        registrar_journal("senales", {
+            "symbol": symbol, "time": df.index[-1], "strategy": config.get('strategy'), "close": close,
+            "rsi": fila.get("RSI"), "atr": fila.get("ATR"), "vwap": fila.get("VWAP"),
+            "bb_lower": fila.get(bbl), "bb_middle": fila.get(bbm), "bb_upper": fila.get(bbu),
+            "senal": signal, "slatr": slatr, "pip_value": pip_value, "equity": equity, "size": size})
         
         return slatr, signal, size
     except Exception as e:
@@ -346,10 +2381,11 @@ def calcular_parametros_trading(symbol, df):
         detailed_logger.error(f"Error en calcular_parametros_trading para {symbol}: {str(e)}\nTraceback: {traceback.format_exc()}")
         return None, None, None
 
+@cronometrado("open_orders", 0)
 def open_orders(symbol, signal, size, slatr):
     logging.info(f"Iniciando apertura de órdenes para {symbol}")
     try:
-        symbol_info = mt5.symbol_info(symbol)
+        symbol_info = instantanea.simbolo(symbol)
         if symbol_info is None:
             raise ValueError(f"No se pudo obtener información del símbolo {symbol}")
         
@@ -357,75 +2393,53 @@ def open_orders(symbol, signal, size, slatr):
         spread = symbol_info.ask - symbol_info.bid
         
         maxspread = config['max_spread']
-        with open(f"size_log_{symbol}.txt", "a") as f:
-            f.write(f"El spread máximo permitido: {maxspread}\n")
-            f.write(f"El spread actual es: {spread}\n")
+        auditar(f"size_log_{symbol}.txt",
+                f"El spread máximo permitido: {maxspread}\n",
+                f"El spread actual es: {spread}\n")
+        registrar_journal("spreads", {"symbol": symbol, "spread": spread, "max_spread": maxspread})
+        if signal in (1, 2) and not size > 0:
+            logging.info(f"No se abrió orden para {symbol}: tamaño {size} por debajo del volumen mínimo")
+            return
         
-        # Obtener datos de profundidad de mercado
-        market_book = mt5.market_book_get(symbol)
+        # Optimizar el precio de entrada con la profundidad de mercado: el lado de los asks para
+        # comprar y el de los bids para vender. Si ese lado está vacío se usa el tick con slippage.
+        lado = mt5.BOOK_TYPE_SELL if signal == 2 else mt5.BOOK_TYPE_BUY
+        mejor_precio = profundidad.mejor_precio(symbol, lado)
         
-        # Optimizar el precio de entrada utilizando el market book
-        if market_book is not None:
-            if signal == 2 and spread < maxspread:  # Señal de compra
-                best_ask = min([item.price for item in market_book if item.type == mt5.BOOK_TYPE_SELL])
-                
-                entry_price = best_ask
-                SLBuy = entry_price - slatr - spread
-                TPBuy = entry_price + slatr * config['TPSLRatio_coef'] + spread
-                request = {
-                    "action": mt5.TRADE_ACTION_DEAL,
-                    "symbol": symbol,
-                    "volume": size,
-                    "type": mt5.ORDER_TYPE_BUY,
-                    "price": entry_price,
-                    "sl": SLBuy,
-                    "tp": TPBuy,
-                    "magic": 234000,
-                    "comment": "python script open",
-                    "type_time": mt5.ORDER_TIME_GTC,
-                    "type_filling": mt5.ORDER_FILLING_IOC,
-                }
-                logging.info(f"Intentando abrir orden de compra para {symbol}")
-                detailed_logger.debug(f"Detalles de la orden de compra para {symbol}:\n{request}")
-                ejecutar_orden(request, "compra", symbol)
-                
-            elif signal == 1 and spread < maxspread:  # Señal de venta
-                best_bid = max([item.price for item in market_book if item.type == mt5.BOOK_TYPE_BUY])
-                entry_price = best_bid
-                SLSell = entry_price + slatr + spread
-                TPSell = entry_price - slatr * config['TPSLRatio_coef'] - spread
-                request = {
-                    "action": mt5.TRADE_ACTION_DEAL,
-                    "symbol": symbol,
-                    "volume": size,
-                    "type": mt5.ORDER_TYPE_SELL,
-                    "price": entry_price,
-                    "sl": SLSell,
-                    "tp": TPSell,
-                    "magic": 234000,
-                    "comment": "python script open",
-                    "type_time": mt5.ORDER_TIME_GTC,
-                    "type_filling": mt5.ORDER_FILLING_IOC,
-                }
-                logging.info(f"Intentando abrir orden de venta para {symbol}")
-                detailed_logger.debug(f"Detalles de la orden de venta para {symbol}:\n{request}")
-                ejecutar_orden(request, "venta", symbol)
+        if mejor_precio is not None:
+            if signal in (1, 2) and spread < maxspread:
+                tipo = "compra" if signal == 2 else "venta"
+                # SL y TP desde el precio medio esperado de todo el tamaño, no desde el mejor nivel
+                precio_medio, _ = profundidad.precio_esperado(symbol, lado, size)
+                sl, tp = calcular_sl_tp(signal, precio_medio, slatr, spread, config)
+                partes = profundidad.dividir(symbol, lado, size, depth_child_orders,
+                                             getattr(symbol_info, 'volume_step', 0.01))
+                for volumen, entry_price in partes:
+                    request = {
+                        "action": mt5.TRADE_ACTION_DEAL,
+                        "symbol": symbol,
+                        "volume": volumen,
+                        "type": mt5.ORDER_TYPE_BUY if signal == 2 else mt5.ORDER_TYPE_SELL,
+                        "price": entry_price,
+                        "sl": sl,
+                        "tp": tp,
+                        "magic": 234000,
+                        "comment": "python script open",
+                        "type_time": mt5.ORDER_TIME_GTC,
+                        "type_filling": mt5.ORDER_FILLING_IOC,
+                    }
+                    logging.info(f"Intentando abrir orden de {tipo} para {symbol}: {volumen} lotes a {entry_price} "
+                                 f"(precio medio esperado {precio_medio})")
+                    detailed_logger.debug("Detalles de la orden de %s para %s:\n%s", tipo, symbol, request)
+                    ejecutar_orden(request, tipo, symbol)
             else:
                 logging.info(f"No se abrió orden para {symbol}. Señal: {signal}, Spread: {spread}, Max Spread: {maxspread}")
         else:
             # Utilizar slippage en caso de que el símbolo no tenga market book
-            if symbol == 'AUDNZD':
-                slippage = np.random.uniform(-0.0002, 0.0002)  # Simulación de slippage para AUDNZD (2 pips)
-            elif symbol == 'USDCAD':
-                slippage = np.random.uniform(-0.0003, 0.0003)  # Simulación de slippage para USDCAD (3 pips)
-            elif symbol == 'EURUSD':
-                slippage = np.random.uniform(-0.0001, 0.00015)  # Simulación de slippage para EURUSD (1-1.5 pips)
-            else:
-                slippage = np.random.uniform(-0.0003, 0.0003) 
+            slippage = slippage_simulado(symbol)
             if signal == 2 and spread < maxspread:  # Señal de compra
                 entry_price = symbol_info.ask + slippage
-                SLBuy = entry_price - slatr - spread
-                TPBuy = entry_price + slatr * config['TPSLRatio_coef'] + spread
+                SLBuy, TPBuy = calcular_sl_tp(signal, entry_price, slatr, spread, config)
                 request = {
                     "action": mt5.TRADE_ACTION_DEAL,
                     "symbol": symbol,
@@ -440,13 +2454,12 @@ def open_orders(symbol, signal, size, slatr):
                     "type_filling": mt5.ORDER_FILLING_IOC,
                 }
                 logging.info(f"Intentando abrir orden de compra para {symbol} con slippage")
-                detailed_logger.debug(f"Detalles de la orden de compra para {symbol} con slippage:\n{request}")
+                detailed_logger.debug("Detalles de la orden de compra para %s con slippage:\n%s", symbol, request)
                 ejecutar_orden(request, "compra", symbol)
                 
             elif signal == 1 and spread < maxspread:  # Señal de venta
                 entry_price = symbol_info.bid - slippage
-                SLSell = entry_price + slatr + spread
-                TPSell = entry_price - slatr * config['TPSLRatio_coef'] - spread
+                SLSell, TPSell = calcular_sl_tp(signal, entry_price, slatr, spread, config)
                 request = {
                     "action": mt5.TRADE_ACTION_DEAL,
                     "symbol": symbol,
@@ -461,7 +2474,7 @@ def open_orders(symbol, signal, size, slatr):
                     "type_filling": mt5.ORDER_FILLING_IOC,
                 }
                 logging.info(f"Intentando abrir orden de venta para {symbol} con slippage")
-                detailed_logger.debug(f"Detalles de la orden de venta para {symbol} con slippage:\n{request}")
+                detailed_logger.debug("Detalles de la orden de venta para %s con slippage:\n%s", symbol, request)
                 ejecutar_orden(request, "venta", symbol)
             else:
                 logging.info(f"No se abrió orden para {symbol}. Señal: {signal}, Spread: {spread}, Max Spread: {maxspread}")
@@ -469,49 +2482,64 @@ def open_orders(symbol, signal, size, slatr):
         logging.error(f"Error en open_orders para {symbol}: {str(e)}")
         detailed_logger.error(f"Error en open_orders para {symbol}: {str(e)}\nTraceback: {traceback.format_exc()}")
         ahora = get_now() 
-        with open("errores_operaciones.txt", "a") as f:
-            f.write(f"{ahora}: Error al abrir operación para {symbol}: {str(e)}\n")
+        registrar_error_operacion(f"{ahora}: Error al abrir operación para {symbol}: {str(e)}\n")
+
+def _fila_orden(request, tipo, symbol, intento, result=None, error=None):
+    return {"symbol": symbol, "tipo": tipo, "intento": intento + 1, "accion": request.get("action"),
+            "tipo_orden": request.get("type"), "volume": request.get("volume"), "price": request.get("price"),
+            "sl": request.get("sl"), "tp": request.get("tp"), "position": request.get("position"),
+            "retcode": getattr(result, "retcode", None), "comment": getattr(result, "comment", None),
+            "error": error}
 
+@cronometrado("ejecutar_orden", 2)
 def ejecutar_orden(request, tipo, symbol, max_intentos=3):
     for intento in range(max_intentos):
+        result = None
         try:
             if not verificar_conexion_mt5():
                 raise ConnectionError("No se pudo reconectar a MetaTrader 5")
             
-            result = mt5.order_send(request)
+            with terminal_lock:
+                result = mt5.order_send(request)
             if result is None:
                 raise ValueError(f"Error al enviar orden de {tipo} para {symbol}: resultado nulo")
-            elif result.retcode != mt5.TRADE_RETCODE_DONE:
+            elif result.retcode not in (mt5.TRADE_RETCODE_DONE, mt5.TRADE_RETCODE_DONE_PARTIAL):
                 raise ValueError(f"Error al abrir orden de {tipo} para {symbol}: {result.comment}")
             else:
+                instantanea.invalidar('cuenta', 'posiciones')
+                if result.retcode == mt5.TRADE_RETCODE_DONE_PARTIAL:
+                    # Con ORDER_FILLING_IOC el resto se cancela; reintentar duplicaría la parte ejecutada
+                    logging.warning(f"Orden de {tipo} para {symbol} ejecutada parcialmente: {result.volume} de {request['volume']}")
                 logging.info(f"Orden de {tipo} abierta exitosamente para {symbol}")
                 detailed_logger.info(f"Orden de {tipo} abierta exitosamente para {symbol}. Detalles: {result}")
                 # Registrar la ejecución de la orden en un archivo de texto
                 ahora = get_now() 
-                with open("registro_dataframe.txt", "a") as f:
-                    f.write(f"Orden ejecutada: {ahora}\n")
-                    f.write(f"Tipo: {tipo}, Símbolo: {symbol}\n")
-                    f.write(f"Detalles: {str(request)}\n\n")
+                auditar("registro_dataframe.txt",
+                        f"Orden ejecutada: {ahora}\n",
+                        f"Tipo: {tipo}, Símbolo: {symbol}\n",
+                        f"Detalles: {str(request)}\n\n")
+                registrar_journal("ordenes", _fila_orden(request, tipo, symbol, intento, result))
                 return
         except Exception as e:
+            registrar_journal("ordenes", _fila_orden(request, tipo, symbol, intento, result, str(e)))
             logging.error(f"Error al ejecutar orden de {tipo} para {symbol} (intento {intento + 1}): {str(e)}")
             detailed_logger.error(f"Error al ejecutar orden de {tipo} para {symbol} (intento {intento + 1}): {str(e)}\nTraceback: {traceback.format_exc()}")
             if intento < max_intentos - 1:
                 logging.info(f"Reintentando ejecutar orden de {tipo} para {symbol}...")
-                time.sleep(5)
+                esperar_reintento(retry_delay, "ejecutar_orden", symbol)
             else:
                 logging.error(f"No se pudo ejecutar la orden de {tipo} para {symbol} después de {max_intentos} intentos.")
                 ahora = get_now() 
-                with open("errores_operaciones.txt", "a") as f:
-                    f.write(f"{ahora}: Error al ejecutar orden de {tipo} para {symbol} después de {max_intentos} intentos: {str(e)}\n")
+                registrar_error_operacion(f"{ahora}: Error al ejecutar orden de {tipo} para {symbol} después de {max_intentos} intentos: {str(e)}\n")
 
+@cronometrado("close_orders", 1)
 def close_orders(df, symbol):
     logging.info(f"Iniciando cierre de órdenes para {symbol}")
     try:
         if not verificar_conexion_mt5():
             raise ConnectionError("No se pudo reconectar a MetaTrader 5")
         
-        positions = mt5.positions_get(symbol=symbol)
+        positions = instantanea.posiciones(symbol)
         if positions is None:
             logging.info(f"No hay posiciones abiertas para cerrar en {symbol}")
             return
@@ -529,7 +2557,7 @@ def close_orders(df, symbol):
                     "volume": position.volume,
                     "type": mt5.ORDER_TYPE_SELL if position.type == mt5.POSITION_TYPE_BUY else mt5.ORDER_TYPE_BUY,
                     "position": position.ticket,
-                    "price": mt5.symbol_info_tick(symbol).bid if position.type == mt5.POSITION_TYPE_BUY else mt5.symbol_info_tick(symbol).ask,
+                    "price": instantanea.tick(symbol).bid if position.type == mt5.POSITION_TYPE_BUY else instantanea.tick(symbol).ask,
                     "magic": 234000,
                     "comment": "python script close",
                     "type_time": mt5.ORDER_TIME_GTC,
@@ -543,19 +2571,28 @@ def close_orders(df, symbol):
         logging.error(f"Error en close_orders para {symbol}: {str(e)}")
         logging.debug(f"Traceback completo:\n{traceback.format_exc()}")
         ahora = get_now() 
-        with open("errores_operaciones.txt", "a") as f:
-            f.write(f"{ahora}: Error al cerrar operaciones para {symbol}: {str(e)}\n")
+        registrar_error_operacion(f"{ahora}: Error al cerrar operaciones para {symbol}: {str(e)}\n")
 
 def verificar_perdida_diaria():
     try:
-        account_info = mt5.account_info()
+        account_info = instantanea.cuenta()
         if account_info is None:
             raise ValueError("No se pudo obtener la información de la cuenta")
         
-        balance_inicial = account_info.balance
+        # La referencia es el equity al empezar el día (persistido), no el balance actual: el balance
+        # ya incluye las pérdidas cerradas hoy y no cuenta las posiciones que venían de ayer
         equity_actual = account_info.equity
+        equity_inicial = riesgo.equity_inicio_dia(clave_cuenta(creds), equity_actual)
         
-        perdida_porcentual = (balance_inicial - equity_actual) / balance_inicial * 100
+        perdida_porcentual = (equity_inicial - equity_actual) / equity_inicial * 100
+        
+        # En un shard, el supervisor suma las cuentas de todos los procesos y marca el límite global
+        if _shard is not None:
+            indice, cola, limite_global = _shard
+            cola.put((indice, clave_cuenta(creds), equity_inicial, equity_actual))
+            if limite_global.is_set():
+                logging.warning(f"El supervisor ha detectado la pérdida diaria del {max_daily_loss}% en el conjunto de cuentas")
+                return True
         
         if perdida_porcentual >= max_daily_loss:
             logging.warning(f"Se ha alcanzado o superado la pérdida diaria del {max_daily_loss}%. Pérdida actual: {perdida_porcentual:.2f}%")
@@ -565,100 +2602,1057 @@ def verificar_perdida_diaria():
         logging.error(f"Error al verificar la pérdida diaria: {str(e)}")
         return False
 
-def cerrar_todas_las_posiciones():
-    try:
-        positions = mt5.positions_get()
-        if positions is None:
-            logging.info("No hay posiciones abiertas para cerrar")
-            return
-        
-        for position in positions:
-            close_request = {
-                "action": mt5.TRADE_ACTION_DEAL,
-                "symbol": position.symbol,
-                "volume": position.volume,
-                "type": mt5.ORDER_TYPE_SELL if position.type == mt5.POSITION_TYPE_BUY else mt5.ORDER_TYPE_BUY,
-                "position": position.ticket,
-                "price": mt5.symbol_info_tick(position.symbol).bid if position.type == mt5.POSITION_TYPE_BUY else mt5.symbol_info_tick(position.symbol).ask,
+def _cerrar_simbolo(symbol, posiciones, cerrar_por, ronda):
+    # Una ronda del cierre total para un símbolo: en cuentas de cobertura, cada compra se cierra
+    # contra una venta (TRADE_ACTION_CLOSE_BY, sin pagar el spread dos veces); el resto, a mercado.
+    # Sin reintentos: lo que falle se vuelve a intentar en la ronda siguiente. Devuelve los errores.
+    compras = sorted((p for p in posiciones if p.type == mt5.POSITION_TYPE_BUY), key=lambda p: -p.volume)
+    ventas = sorted((p for p in posiciones if p.type == mt5.POSITION_TYPE_SELL), key=lambda p: -p.volume)
+    solicitudes = []
+    if cerrar_por:
+        while compras and ventas:
+            compra, venta = compras.pop(0), ventas.pop(0)
+            solicitudes.append({
+                "action": mt5.TRADE_ACTION_CLOSE_BY,
+                "symbol": symbol,
+                "position": compra.ticket,
+                "position_by": venta.ticket,
                 "magic": 234000,
-                "comment": "python script close all",
-                "type_time": mt5.ORDER_TIME_GTC,
-                "type_filling": mt5.ORDER_FILLING_IOC,
-            }
-            logging.info(f"Intentando cerrar posición para {position.symbol}")
-            ejecutar_orden(close_request, "cierre", position.symbol)
-        
-        logging.info("Todas las posiciones han sido cerradas")
+                "comment": "python script close by",
+            })
+    with terminal_lock:
+        tick = mt5.symbol_info_tick(symbol) if compras or ventas else None
+    for position in compras + ventas:
+        solicitudes.append({
+            "action": mt5.TRADE_ACTION_DEAL,
+            "symbol": symbol,
+            "volume": position.volume,
+            "type": mt5.ORDER_TYPE_SELL if position.type == mt5.POSITION_TYPE_BUY else mt5.ORDER_TYPE_BUY,
+            "position": position.ticket,
+            "price": tick.bid if position.type == mt5.POSITION_TYPE_BUY else tick.ask,
+            "magic": 234000,
+            "comment": "python script close all",
+            "type_time": mt5.ORDER_TIME_GTC,
+            "type_filling": mt5.ORDER_FILLING_IOC,
+        })
+    errores = []
+    for request in solicitudes:
+        result, error = None, None
+        try:
+            with terminal_lock:
+                result = mt5.order_send(request)
+                ultimo_error = mt5.last_error() if result is None else None
+            if result is None:
+                error = f"resultado nulo ({ultimo_error})"
+            elif result.retcode not in (mt5.TRADE_RETCODE_DONE, mt5.TRADE_RETCODE_DONE_PARTIAL):
+                error = f"{result.retcode} {result.comment}"
+        except Exception as e:
+            error = str(e)
+        registrar_journal("ordenes", _fila_orden(request, "cierre_total", symbol, ronda, result, error))
+        if error is not None:
+            errores.append(f"posición {request['position']}: {error}")
+    return errores
+
+_pool_cierre = None
+
+def obtener_pool_cierre():
+    # Un solo pool para todos los cierres totales, en vez de uno nuevo en cada llamada. Se vuelve a
+    # crear si la recarga en caliente cambia flatten_workers; el anterior termina lo que tenga en curso.
+    global _pool_cierre
+    hilos = max(1, flatten_workers)
+    if _pool_cierre is None or _pool_cierre._max_workers != hilos:
+        if _pool_cierre is not None:
+            _pool_cierre.shutdown(wait=False)
+        _pool_cierre = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="cierre")
+    return _pool_cierre
+
+def cerrar_todas_las_posiciones(plazo=None):
+    # Cierre total (viernes y pérdida diaria máxima) por rondas hasta agotar el plazo: en cada ronda
+    # se piden las posiciones abiertas al terminal, se cierran agrupadas por símbolo con varios
+    # símbolos a la vez y, si algo queda abierto, se espera un poco (con jitter, creciendo desde
+    # 50 ms hasta 1 s) antes de la siguiente. Al final se informa de lo que sigue abierto.
+    plazo = flatten_deadline if plazo is None else plazo
+    inicio = time.monotonic()
+    limite = inicio + plazo
+    ronda = 0
+    errores = {}
+    positions = None
+    pool = obtener_pool_cierre()
+    futuros, pendientes = {}, set()
+    try:
+        with terminal_lock:
+            cuenta = mt5.account_info()
+        cerrar_por = flatten_close_by and getattr(cuenta, 'margin_mode', None) == mt5.ACCOUNT_MARGIN_MODE_RETAIL_HEDGING
+        while True:
+            with terminal_lock:
+                positions = mt5.positions_get()
+            if positions is not None and len(positions) == 0:
+                break
+            if time.monotonic() >= limite:
+                break
+            if positions is None:
+                errores["*"] = [f"positions_get falló: {mt5.last_error()}"]
+            else:
+                por_simbolo = {}
+                for position in positions:
+                    por_simbolo.setdefault(position.symbol, []).append(position)
+                futuros = {pool.submit(_cerrar_simbolo, symbol, posiciones, cerrar_por, ronda): symbol
+                           for symbol, posiciones in por_simbolo.items()}
+                terminados, pendientes = wait(futuros, timeout=max(0.0, limite - time.monotonic()))
+                for futuro in terminados:
+                    try:
+                        errores[futuros[futuro]] = futuro.result()
+                    except Exception as e:
+                        errores[futuros[futuro]] = [str(e)]
+                for futuro in pendientes:
+                    errores[futuros[futuro]] = ["sin respuesta del terminal antes del plazo"]
+            ronda += 1
+            espera = min(0.05 * 2 ** ronda, 1.0) * random.uniform(0.5, 1.5)
+            esperar_reintento(max(0.0, min(espera, limite - time.monotonic())), "cierre_total")
     except Exception as e:
         logging.error(f"Error al cerrar todas las posiciones: {str(e)}")
         logging.debug(f"Traceback completo:\n{traceback.format_exc()}")
-
-def trading_job():
-    ahora = get_now() 
-    logging.info(f"Iniciando ciclo de trading a las {ahora}")
+    finally:
+        # Con el plazo agotado, los cierres que no han empezado se cancelan y los que están en curso
+        # terminan antes del informe; después se vuelve a pedir positions_get para informar del estado real
+        if pendientes:
+            for futuro in pendientes:
+                futuro.cancel()
+            wait(pendientes)
+            for futuro in pendientes:
+                if not futuro.cancelled():
+                    try:
+                        errores[futuros[futuro]] = futuro.result()
+                    except Exception as e:
+                        errores[futuros[futuro]] = [str(e)]
+            with terminal_lock:
+                positions = mt5.positions_get()
+        instantanea.invalidar('cuenta', 'posiciones')
     
-    # Verificar si se ha alcanzado la pérdida diaria máxima
-    if verificar_perdida_diaria():
-        logging.warning("Se ha alcanzado la pérdida diaria máxima. Cerrando todas las posiciones y deteniendo operaciones.")
-        cerrar_todas_las_posiciones()
-        return
+    segundos = time.monotonic() - inicio
+    abiertas = list(positions) if positions else []
+    if positions is not None and not abiertas:
+        logging.info(f"Todas las posiciones han sido cerradas ({ronda} rondas, {segundos:.2f}s)")
+    else:
+        detalle = ", ".join(f"{p.symbol} #{p.ticket} {p.volume}" for p in abiertas) or "desconocidas"
+        ultimos = "; ".join(f"{symbol}: {fallos[-1]}" for symbol, fallos in errores.items() if fallos)
+        logging.error(f"Cierre total incompleto tras {segundos:.2f}s y {ronda} rondas. Siguen abiertas: {detalle}. Últimos errores: {ultimos}")
+        registrar_error_operacion(f"{get_now()}: Cierre total incompleto. Siguen abiertas: {detalle}. Últimos errores: {ultimos}\n")
+    return {"rondas": ronda, "segundos": segundos, "abiertas": abiertas, "errores": errores}
+
+def preparar_simbolo(symbol):
+    # Descarga, indicadores, señales y tamaño; no toca órdenes, por lo que puede ir en paralelo
+    marcos = None
+    if usa_multitimeframe(symbol_config[symbol]):
+        datos = obtener_datos_multitimeframe(symbol)
+        df, marcos = datos if datos is not None else (None, None)
+    elif incremental_mode:
+        df = obtener_datos_incremental(symbol)
+    else:
+        df = obtener_datos_ohlc(symbol)
+    if df is None:
+        logging.warning(f"No se pudieron obtener datos OHLC para {symbol}")
+        return None
+    df = process(df, symbol, indicadores_calculados=incremental_mode or marcos is not None, marcos=marcos)
+    if df is None:
+        logging.warning(f"No se pudo procesar el DataFrame para {symbol}")
+        return None
+    riesgo.observar(symbol, df)
+    return df, calcular_parametros_trading(symbol, df)
+
+def operar_simbolo(symbol, df, parametros):
+    slatr, signal, size = parametros
+    if None not in (slatr, signal, size):
+        # Los límites de cartera se aplican aquí, en el hilo principal y en orden, para que cada
+        # símbolo vea las posiciones que han abierto los anteriores del mismo ciclo
+        size = riesgo.limitar(symbol, signal, size, slatr)
+        open_orders(symbol, signal, size, slatr)
+        close_orders(df, symbol)
     
+    logging.info(f"Últimas 5 filas del DataFrame para {symbol}:")
+    logging.info(df.tail())
+
+def registrar_error_simbolo(symbol, e):
+    logging.error(f"Error en trading_job para {symbol}: {str(e)}")
+    logging.debug(f"Traceback completo:\n{traceback.format_exc()}")
+    ahora = get_now() 
+    registrar_error_operacion(f"{ahora}: Error en trading_job para {symbol}: {str(e)}\n")
+
+_pool_simbolos = None
+_preparaciones_en_curso = {}
+
+def obtener_pool_simbolos():
+    global _pool_simbolos
+    if _pool_simbolos is None:
+        _pool_simbolos = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="simbolo")
+    return _pool_simbolos
+
+def ciclo_concurrente():
+    # Prepara todos los símbolos en paralelo y envía las órdenes en el hilo principal, en el
+    # orden en que terminan. Un símbolo que supera symbol_deadline se abandona en este ciclo.
+    pool = obtener_pool_simbolos()
+    limite = time.monotonic() + symbol_deadline
+    futuros = {}
     for symbol in symbol_config.keys():
+        anterior = _preparaciones_en_curso.get(symbol)
+        if anterior is not None and not anterior.done():
+            logging.warning(f"{symbol} sigue ocupado desde el ciclo anterior, se omite en este ciclo")
+            continue
         logging.info(f"Procesando {symbol}")
+        futuro = pool.submit(preparar_simbolo, symbol)
+        _preparaciones_en_curso[symbol] = futuro
+        futuros[futuro] = symbol
+
+    pendientes = set(futuros)
+    try:
+        for futuro in as_completed(futuros, timeout=max(0.0, limite - time.monotonic())):
+            pendientes.discard(futuro)
+            symbol = futuros[futuro]
+            try:
+                resultado = futuro.result()
+                if resultado is not None:
+                    operar_simbolo(symbol, *resultado)
+            except Exception as e:
+                registrar_error_simbolo(symbol, e)
+    except FuturesTimeoutError:
+        for futuro in pendientes:
+            symbol = futuros[futuro]
+            logging.error(f"{symbol} superó el límite de {symbol_deadline}s; no se operará en este ciclo")
+            registrar_error_operacion(f"{get_now()}: {symbol} superó el límite de {symbol_deadline}s en trading_job\n")
+
+@cronometrado("trading_job")
+def trading_job(secuencial=False):
+    # secuencial: prepara los símbolos en este hilo aunque concurrent_mode esté activo. cProfile solo
+    # ve el hilo que lo activa, así que el ciclo perfilado no reparte el trabajo entre los hilos simbolo-*.
+    if perfil_solicitado.is_set():
+        perfil_solicitado.clear()
+        return perfilar(trading_job.__wrapped__, secuencial=True)
+    with ciclo_lock:
+        recarga.aplicar()
+        renovar_instantanea()
+        ahora = get_now() 
+        logging.info(f"Iniciando ciclo de trading a las {ahora}")
+    
+        # Verificar si se ha alcanzado la pérdida diaria máxima
+        if verificar_perdida_diaria():
+            logging.warning("Se ha alcanzado la pérdida diaria máxima. Cerrando todas las posiciones y deteniendo operaciones.")
+            cerrar_todas_las_posiciones()
+            return
+    
+        if concurrent_mode and not secuencial:
+            ciclo_concurrente()
+        else:
+            for symbol in symbol_config.keys():
+                logging.info(f"Procesando {symbol}")
+                try:
+                    resultado = preparar_simbolo(symbol)
+                    if resultado is not None:
+                        operar_simbolo(symbol, *resultado)
+                except Exception as e:
+                    registrar_error_simbolo(symbol, e)
+    
+        logging.info(cache_indicadores.resumen())
+        logging.info(metricas.resumen())
+        logging.info(instantanea.resumen())
+        ahora = get_now() 
+        logging.info(f"Ciclo de trading completado a las {ahora}")
+
+# ---------------------------------------------------------------------------
+# Modo streaming: velas construidas a partir de ticks y evaluadas al cerrar
+# ---------------------------------------------------------------------------
+
+def segundos_timeframe(tf):
+    # Constantes TIMEFRAME_* de MetaTrader5: los minutos van tal cual y las horas con el bit 0x4000
+    # (H1 = 0x4001, D1 = 0x4018). Semanas y meses no tienen duración fija.
+    if tf < 0x4000:
+        return tf * 60
+    if tf & 0xC000 == 0x4000:
+        return (tf & 0x3FFF) * 3600
+    raise ValueError(f"Timeframe no soportado en modo streaming: {tf}")
+
+def en_horario_operativo(ahora=None):
+    # Mismas ventanas que los cron de main(): domingo desde las 22h, lunes a jueves y viernes hasta las 21:59 (Londres)
+    ahora = (ahora or datetime.now(pytz.utc)).astimezone(pytz.timezone('Europe/London'))
+    dia = ahora.weekday()
+    return (dia == 6 and ahora.hour >= 22) or dia <= 3 or (dia == 4 and ahora.hour <= 21)
+
+class AgregadorTicks:
+    # Construye velas del timeframe con el bid de cada tick, igual que las velas de MT5. tick_volume es
+    # el número de ticks, spread el mínimo en puntos y real_volume la suma del volumen de los ticks.
+    def __init__(self, periodo, punto):
+        self.periodo = periodo
+        self.punto = punto
+        self.barra = None
+        self.ultimo_cierre = None
+
+    def agregar(self, time_msc, bid, ask, volumen):
+        # Devuelve la vela anterior si el tick abre una nueva; si no, None
+        if not bid > 0:
+            return None
+        inicio = int(time_msc // 1000) // self.periodo * self.periodo
+        if self.barra is not None:
+            minimo = self.barra[0]
+        elif self.ultimo_cierre is not None:
+            minimo = self.ultimo_cierre + self.periodo
+        else:
+            minimo = inicio
+        if inicio < minimo:
+            # Tick tardío de una vela ya cerrada
+            return None
+        cerrada = self.cerrar() if self.barra is not None and inicio > self.barra[0] else None
+        spread = int(round((ask - bid) / self.punto))
+        barra = self.barra
+        if barra is None:
+            self.barra = [inicio, bid, bid, bid, bid, 1, spread, int(volumen)]
+        else:
+            if bid > barra[2]:
+                barra[2] = bid
+            if bid < barra[3]:
+                barra[3] = bid
+            barra[4] = bid
+            barra[5] += 1
+            if spread < barra[6]:
+                barra[6] = spread
+            barra[7] += int(volumen)
+        return cerrada
+
+    def vencida(self, ahora):
+        return self.barra is not None and ahora >= self.barra[0] + self.periodo
+
+    def cerrar(self):
+        cerrada = tuple(self.barra)
+        self.ultimo_cierre = cerrada[0]
+        self.barra = None
+        return cerrada
+
+class FlujoTicks:
+    # Estado de un símbolo en modo streaming: cursor de ticks, vela en formación e indicadores
+    # incrementales de las velas cerradas. La vela en curso del histórico se reconstruye desde su
+    # apertura con copy_ticks_from para no contar dos veces sus ticks.
+    def __init__(self, symbol, config, periodo):
+        self.symbol = symbol
+        self.config = dict(config)
+        with terminal_lock:
+            info = mt5.symbol_info(symbol)
+        self.agregador = AgregadorTicks(periodo, getattr(info, 'point', 0.00001))
+        sembrar = _sembrar_multitimeframe if usa_multitimeframe(config) else _sembrar_estado
+        self.estado, en_curso = sembrar(symbol, config)
+        if self.estado is None:
+            raise ValueError(f"No se pudo obtener el histórico inicial de {symbol}")
+        self.ultimo_msc = en_curso[0] * 1000 - 1
+        self.desfase = 0.0
+
+    def sondear(self):
+        # Devuelve (velas cerradas por ticks nuevos, si hubo ticks nuevos)
+        with terminal_lock:
+            tick = mt5.symbol_info_tick(self.symbol)
+            if tick is None or tick.time_msc <= self.ultimo_msc:
+                return [], False
+            desde = datetime.fromtimestamp(self.ultimo_msc / 1000, tz=pytz.utc)
+            ticks = mt5.copy_ticks_from(self.symbol, desde, stream_max_ticks, mt5.COPY_TICKS_ALL)
+        if ticks is not None and len(ticks):
+            ticks = ticks[ticks['time_msc'] > self.ultimo_msc]
+        if ticks is None or len(ticks) == 0:
+            columnas = ([tick.time_msc], [tick.bid], [tick.ask], [tick.volume])
+        else:
+            columnas = (ticks['time_msc'].tolist(), ticks['bid'].tolist(), ticks['ask'].tolist(), ticks['volume'].tolist())
+        cerradas = []
+        for time_msc, bid, ask, volumen in zip(*columnas):
+            cerrada = self.agregador.agregar(time_msc, bid, ask, volumen)
+            if cerrada is not None:
+                cerradas.append(cerrada)
+        self.ultimo_msc = max(self.ultimo_msc, columnas[0][-1])
+        # Diferencia entre la hora del servidor y la local, para cerrar velas aunque no lleguen ticks
+        self.desfase = tick.time_msc / 1000 - time.time()
+        return cerradas, True
+
+def evaluar_vela_cerrada(flujo, barra, operar=True):
+    symbol = flujo.symbol
+    registrar_barras(symbol, [barra])
+    cerrada = flujo.estado.agregar_barra(barra)
+    marcos = None
+    if isinstance(flujo.estado, EstadoMultiTimeframe):
+        # Solo se evalúa cuando la barra base cierra una vela del timeframe de la estrategia
+        if not cerrada:
+            return None
+        marcos = flujo.estado.marcos()
+    df = process(flujo.estado.dataframe(), symbol, indicadores_calculados=True, marcos=marcos)
+    if df is None:
+        logging.warning(f"No se pudo procesar el DataFrame para {symbol}")
+        return None
+    riesgo.observar(symbol, df)
+    if operar:
+        operar_simbolo(symbol, df, calcular_parametros_trading(symbol, df))
+    return df
+
+def modo_streaming(duracion=None, simbolos=None, reloj_servidor=None, respetar_horario=True):
+    # Sondea los ticks de cada símbolo, construye las velas en memoria y evalúa process() en cuanto
+    # cierra cada una. La pausa entre sondeos se duplica mientras no llegan ticks, hasta
+    # stream_poll_max. Devuelve por símbolo (retardo desde el cierre, tiempo de evaluación) de cada vela.
+    periodo = segundos_timeframe(timeframe)
+    todos = simbolos is None
+    simbolos = list(simbolos or symbol_config)
+    flujos = {}
+    latencias = {symbol: [] for symbol in simbolos}
+    pausa = stream_poll_min
+    inicio = time.monotonic()
+    logging.info(f"Modo streaming iniciado para {simbolos} (velas de {periodo}s)")
+    while duracion is None or time.monotonic() - inicio < duracion:
+        # Cada pasada es un ciclo: la configuración no cambia mientras se sondea y se evalúa
+        with ciclo_lock:
+            if recarga.aplicar() and todos:
+                # Los flujos de símbolos modificados se reconstruyen solos al no coincidir su config
+                simbolos = list(symbol_config)
+                for symbol in [symbol for symbol in flujos if symbol not in symbol_config]:
+                    del flujos[symbol]
+                for symbol in simbolos:
+                    latencias.setdefault(symbol, [])
+            hubo_ticks = False
+            cerradas = []
+            for symbol in simbolos:
+                try:
+                    flujo = flujos.get(symbol)
+                    if flujo is None or flujo.config != symbol_config[symbol]:
+                        flujo = flujos[symbol] = FlujoTicks(symbol, symbol_config[symbol], periodo)
+                    velas, nuevos = flujo.sondear()
+                    hubo_ticks = hubo_ticks or nuevos
+                    ahora = reloj_servidor() if reloj_servidor is not None else time.time() + flujo.desfase
+                    if flujo.agregador.vencida(ahora):
+                        velas.append(flujo.agregador.cerrar())
+                    cerradas += [(flujo, vela, ahora) for vela in velas]
+                except Exception as e:
+                    registrar_error_simbolo(symbol, e)
+                    flujos.pop(symbol, None)
+
+            if cerradas:
+                renovar_instantanea()
+                operar = not respetar_horario or en_horario_operativo()
+                if operar and verificar_perdida_diaria():
+                    logging.warning("Se ha alcanzado la pérdida diaria máxima. Cerrando todas las posiciones y deteniendo operaciones.")
+                    cerrar_todas_las_posiciones()
+                    operar = False
+                perfilado = perfil_solicitado.is_set()
+                perfil_solicitado.clear()
+                for flujo, vela, ahora in cerradas:
+                    comienzo = time.perf_counter()
+                    try:
+                        if perfilado:
+                            perfilar(evaluar_vela_cerrada, flujo, vela, operar)
+                        else:
+                            evaluar_vela_cerrada(flujo, vela, operar)
+                    except Exception as e:
+                        registrar_error_simbolo(flujo.symbol, e)
+                        continue
+                    retardo = max(0.0, ahora - (vela[0] + periodo))
+                    evaluacion = time.perf_counter() - comienzo
+                    latencias[flujo.symbol].append((retardo, evaluacion))
+                    logging.info(f"Vela {pd.to_datetime(vela[0], unit='s')} de {flujo.symbol} evaluada "
+                                 f"{retardo * 1000:.0f} ms después del cierre en {evaluacion * 1000:.1f} ms")
+                logging.info(metricas.resumen())
+
+        pausa = stream_poll_min if hubo_ticks else min(pausa * 2, stream_poll_max)
+        time.sleep(pausa)
+    return latencias
+
+# Formato de los arrays que devuelven mt5.copy_rates_*. Es la lista de campos, que NumPy acepta como
+# dtype, para no importar NumPy al cargar el script
+RATES_DTYPE = [('time', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'),
+               ('tick_volume', '<u8'), ('spread', '<i4'), ('real_volume', '<u8')]
+
+def rates_desde_dataframe(df):
+    rates = np.zeros(len(df), dtype=RATES_DTYPE)
+    rates['time'] = (df.index - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+    for col in COLUMNAS_OHLC:
+        rates[col] = df[col].to_numpy()
+    return rates
+
+def cargar_historico(ruta):
+    # CSV, Parquet o fichero .bin del histórico local con las columnas de copy_rates_* (time en
+    # segundos epoch o como fecha). Devuelve un DataFrame con el mismo formato que obtener_datos_ohlc.
+    if str(ruta).endswith('.parquet'):
+        df = pd.read_parquet(ruta)
+    elif str(ruta).endswith('.bin'):
+        df = pd.DataFrame(np.fromfile(ruta, dtype=RATES_DTYPE))
+    else:
+        df = pd.read_csv(ruta)
+    if pd.api.types.is_numeric_dtype(df['time']):
+        df['time'] = pd.to_datetime(df['time'], unit='s')
+    else:
+        df['time'] = pd.to_datetime(df['time'])
+    for col in COLUMNAS_OHLC:
+        if col not in df:
+            df[col] = 0
+    df = df.set_index('time').sort_index()
+    return df[COLUMNAS_OHLC]
+
+def separar_ruta_simbolo(ruta):
+    # fichero[:SYMBOL] -> (fichero, SYMBOL o ''). Se corta por el último ':' y solo si lo que sigue
+    # no es una ruta, para no confundir la letra de unidad de Windows (C:\datos\EURUSD.csv, C:EURUSD.csv)
+    fichero, separador, symbol = str(ruta).rpartition(':')
+    if not separador or '/' in symbol or '\\' in symbol or len(fichero) == 1:
+        return str(ruta), ''
+    return fichero, symbol
+
+def cargar_barras_grabadas(ruta):
+    return rates_desde_dataframe(cargar_historico(ruta))
+
+# ---------------------------------------------------------------------------
+# Histórico local de velas (memory-mapped, solo-anexado)
+# ---------------------------------------------------------------------------
+
+class AlmacenVelas:
+    # Velas cerradas por símbolo y timeframe en ficheros binarios de registros RATES_DTYPE
+    # (market_data/EURUSD_5.bin), ordenados por tiempo y leídos con np.memmap sin copiar. Al terminal
+    # solo se le piden los tramos que faltan, por bloques; las velas en formación nunca se guardan.
+    # Un .json al lado guarda desde qué fecha está cubierto el histórico, para no volver a pedir lo
+    # que el bróker no tiene.
+    def __init__(self, directorio="market_data", bloque_velas=50000):
+        self.directorio = directorio
+        self.bloque_velas = bloque_velas
+        self.mapas = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def ruta(self, symbol, tf):
+        return os.path.join(self.directorio, f"{symbol}_{tf}.bin")
+
+    def _lock(self, clave):
+        with self.lock:
+            return self.locks.setdefault(clave, threading.RLock())
+
+    def _cubierto_desde(self, symbol, tf):
         try:
-            df = obtener_datos_ohlc(symbol)
-            if df is not None:
-                df = process(df, symbol)
-                if df is not None:
-                    slatr, signal, size = calcular_parametros_trading(symbol, df)
-                    if None not in (slatr, signal, size):
-                        open_orders(symbol, signal, size, slatr)
-                        close_orders(df, symbol)
-                    
-                    logging.info(f"Últimas 5 filas del DataFrame para {symbol}:")
-                    logging.info(df.tail())
-                else:
-                    logging.warning(f"No se pudo procesar el DataFrame para {symbol}")
-            else:
-                logging.warning(f"No se pudieron obtener datos OHLC para {symbol}")
+            with open(self.ruta(symbol, tf)[:-4] + ".json") as f:
+                return json.load(f)["desde"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def _guardar_cubierto_desde(self, symbol, tf, desde):
+        ruta = self.ruta(symbol, tf)[:-4] + ".json"
+        with open(ruta + ".tmp", "w") as f:
+            json.dump({"desde": desde}, f)
+        os.replace(ruta + ".tmp", ruta)
+
+    def _mapa(self, symbol, tf):
+        # Un registro incompleto al final (escritura interrumpida) se ignora
+        ruta = self.ruta(symbol, tf)
+        try:
+            tamano = os.path.getsize(ruta)
+        except FileNotFoundError:
+            return np.empty(0, dtype=RATES_DTYPE)
+        n = tamano // np.dtype(RATES_DTYPE).itemsize
+        mapa = self.mapas.get((symbol, tf))
+        if mapa is None or len(mapa) != n:
+            mapa = np.memmap(ruta, dtype=RATES_DTYPE, mode='r', shape=(n,)) if n else np.empty(0, dtype=RATES_DTYPE)
+            self.mapas[(symbol, tf)] = mapa
+        return mapa
+
+    def leer(self, symbol, tf, desde=None, hasta=None):
+        # Vista (sin copia) de las velas guardadas con desde <= time <= hasta, en segundos epoch o datetime
+        mapa = self._mapa(symbol, tf)
+        tiempos = mapa['time']
+        i = 0 if desde is None else np.searchsorted(tiempos, self._segundos(desde), side='left')
+        j = len(mapa) if hasta is None else np.searchsorted(tiempos, self._segundos(hasta), side='right')
+        return mapa[i:j]
+
+    @staticmethod
+    def _segundos(valor):
+        return int(valor.timestamp()) if isinstance(valor, datetime) else int(valor)
+
+    def _descargar(self, symbol, tf, desde, hasta):
+        # copy_rates_range por bloques de bloque_velas velas (el terminal limita las respuestas grandes)
+        paso = self.bloque_velas * segundos_timeframe(tf)
+        partes = []
+        for inicio in range(desde, hasta + 1, paso):
+            fin = min(hasta, inicio + paso - 1)
+            with terminal_lock:
+                raw = mt5.copy_rates_range(symbol, tf, datetime.fromtimestamp(inicio, tz=pytz.utc),
+                                           datetime.fromtimestamp(fin, tz=pytz.utc))
+                if raw is None:
+                    raise ValueError(f"copy_rates_range devolvió None para {symbol}: {mt5.last_error()}")
+            if len(raw):
+                partes.append(np.asarray(raw, dtype=RATES_DTYPE))
+        if not partes:
+            return np.empty(0, dtype=RATES_DTYPE)
+        rates = np.concatenate(partes)
+        rates = rates[np.argsort(rates['time'], kind='stable')]
+        return rates[np.concatenate(([True], np.diff(rates['time']) > 0))]
+
+    def _anexar(self, symbol, tf, rates):
+        os.makedirs(self.directorio, exist_ok=True)
+        with open(self.ruta(symbol, tf), "ab") as f:
+            f.write(rates.tobytes())
+
+    def _anteponer(self, symbol, tf, rates):
+        # Reescribe el fichero con historia más antigua delante; solo pasa al ampliar el rango hacia atrás.
+        # En Windows no se puede sustituir un fichero mapeado, así que las velas guardadas se copian a
+        # memoria y se suelta el mapa antes del os.replace (el llamador ya no guarda ninguna vista).
+        ruta = self.ruta(symbol, tf)
+        os.makedirs(self.directorio, exist_ok=True)
+        guardadas = np.array(self._mapa(symbol, tf))
+        self.mapas.pop((symbol, tf), None)
+        with open(ruta + ".tmp", "wb") as f:
+            f.write(rates.tobytes())
+            f.write(guardadas.tobytes())
+        try:
+            os.replace(ruta + ".tmp", ruta)
+        except PermissionError as e:
+            # Alguien fuera del almacén conserva una vista de una lectura anterior
+            os.remove(ruta + ".tmp")
+            raise ValueError(f"No se pudo ampliar el histórico local de {symbol}: {str(e)}")
+
+    def copy_rates_range(self, symbol, tf, desde, hasta):
+        # Misma respuesta que mt5.copy_rates_range. Las velas cerradas salen del fichero local; del terminal
+        # solo se piden el tramo anterior a lo cubierto y lo posterior a la última vela guardada. Las velas
+        # en formación se devuelven sin guardarlas.
+        periodo = segundos_timeframe(tf)
+        desde_s, hasta_s = self._segundos(desde), self._segundos(hasta)
+        with self._lock((symbol, tf)):
+            guardadas = self._mapa(symbol, tf)
+            cubierto = self._cubierto_desde(symbol, tf)
+            if len(guardadas) and cubierto is not None and desde_s < cubierto:
+                primera = int(guardadas['time'][0])
+                guardadas = None  # _anteponer sustituye el fichero: no puede quedar ninguna vista del mapa
+                antiguas = self._descargar(symbol, tf, desde_s, cubierto - 1)
+                antiguas = antiguas[antiguas['time'] < primera]
+                if len(antiguas):
+                    self._anteponer(symbol, tf, antiguas)
+                self._guardar_cubierto_desde(symbol, tf, desde_s)
+                guardadas = self._mapa(symbol, tf)
+
+            inicio = int(guardadas['time'][-1]) + 1 if len(guardadas) else desde_s
+            nuevas = self._descargar(symbol, tf, max(inicio, desde_s), hasta_s) if inicio <= hasta_s else guardadas[:0]
+            # hasta suele venir de get_now() + 3 h, una estimación de la hora del servidor que en invierno
+            # (GMT+2) va una hora por delante: la última vela que devuelve el terminal se trata siempre
+            # como en formación y solo se guardan las anteriores
+            n_cerradas = int(np.count_nonzero(nuevas['time'][:-1] + periodo <= hasta_s))
+            cerradas, en_formacion = nuevas[:n_cerradas], nuevas[n_cerradas:]
+            if len(cerradas) and len(guardadas) and desde_s > int(guardadas['time'][-1]) + periodo:
+                # Petición posterior con hueco: se rellena lo que falta para mantener el fichero continuo
+                cerradas = np.concatenate((self._descargar(symbol, tf, inicio, desde_s - 1), cerradas))
+            if len(cerradas):
+                self._anexar(symbol, tf, cerradas)
+                if cubierto is None:
+                    self._guardar_cubierto_desde(symbol, tf, desde_s if not len(guardadas) else int(guardadas['time'][0]))
+            guardadas = self.leer(symbol, tf, desde_s, hasta_s)
+        if len(en_formacion) == 0:
+            return guardadas
+        return np.concatenate((guardadas, en_formacion))
+
+@cronometrado("copy_rates_range", 0)
+def descargar_velas(symbol, tf, desde, hasta):
+    # mt5.copy_rates_range, pasando por el histórico local si market_data_cache está activo
+    if market_data_cache:
+        return almacen_velas.copy_rates_range(symbol, tf, desde, hasta)
+    with terminal_lock:
+        return mt5.copy_rates_range(symbol, tf, desde, hasta)
+
+def descargar_historico_cli(symbol, desde, hasta=None):
+    # python MT5.py --download-history EURUSD 2022-01-01 [2024-01-01]: rellena el histórico local
+    hasta = pd.Timestamp(hasta, tz='UTC') if hasta else get_now() + timedelta(hours=3)
+    rates = almacen_velas.copy_rates_range(symbol, timeframe, pd.Timestamp(desde, tz='UTC'), hasta)
+    logging.warning(f"Histórico local de {symbol}: {len(rates)} velas en {almacen_velas.ruta(symbol, timeframe)}")
+    return rates
+
+def validar_configuracion(cambios=None):
+    # Errores de configuración que de otro modo solo aparecerían en el primer ciclo; lista vacía si todo es válido.
+    # cambios: symbol_config y claves recargables que sustituyen a las cargadas (recarga en caliente).
+    valores = {'symbol_config': symbol_config, **{clave: globals()[clave] for clave in CLAVES_RECARGABLES}, **(cambios or {})}
+    errores = []
+    
+    def numero(valor):
+        return isinstance(valor, (int, float)) and not isinstance(valor, bool) and math.isfinite(valor)
+    
+    if not isinstance(valores['symbol_config'], dict) or not valores['symbol_config']:
+        errores.append("symbol_config debe ser un diccionario con al menos un símbolo")
+    for symbol, parametros in (valores['symbol_config'].items() if isinstance(valores['symbol_config'], dict) else []):
+        estrategia = parametros.get('strategy')
+        if estrategia not in ESTRATEGIAS:
+            errores.append(f"{symbol}: estrategia desconocida {estrategia!r} (disponibles: {', '.join(ESTRATEGIAS)})")
+            continue
+        faltan = [clave for clave in ESTRATEGIAS[estrategia].parametros if clave not in parametros]
+        if faltan:
+            errores.append(f"{symbol}: faltan {', '.join(faltan)}")
+        no_numericos = [clave for clave in ESTRATEGIAS[estrategia].parametros + ('bb_length', 'bb_std')
+                        if clave in parametros and not numero(parametros[clave])]
+        if no_numericos:
+            errores.append(f"{symbol}: {', '.join(no_numericos)} deben ser números")
+            continue
+        for clave in ('slatrcoef', 'TPSLRatio_coef', 'max_spread', 'bb_std'):
+            if clave in parametros and parametros[clave] <= 0:
+                errores.append(f"{symbol}: {clave} debe ser positivo")
+        if 'risk_perc' in parametros and not 0 < parametros['risk_perc'] < 1:
+            errores.append(f"{symbol}: risk_perc es una fracción del equity (entre 0 y 1)")
+        for clave in ('rsi_length', 'bb_length', 'backcandles'):
+            if clave in parametros and (parametros[clave] != int(parametros[clave]) or parametros[clave] < 1):
+                errores.append(f"{symbol}: {clave} debe ser un entero positivo")
+        if 'rsi_oversold' in parametros and 'rsi_overbought' in parametros and \
+                not 0 <= parametros['rsi_oversold'] < parametros['rsi_overbought'] <= 100:
+            errores.append(f"{symbol}: se necesita 0 <= rsi_oversold < rsi_overbought <= 100")
+        try:
+            periodo_base = segundos_timeframe(timeframe)
+            periodo = segundos_timeframe(timeframe_estrategia(parametros))
+            if periodo % periodo_base:
+                errores.append(f"{symbol}: timeframe {nombre_timeframe(timeframe_estrategia(parametros))} no es múltiplo "
+                               f"del timeframe base {nombre_timeframe(timeframe)}")
+            for filtro in filtros_htf(parametros):
+                periodo_filtro = segundos_timeframe(filtro['timeframe'])
+                if periodo_filtro < periodo or periodo_filtro % periodo_base:
+                    errores.append(f"{symbol}: el filtro {nombre_timeframe(filtro['timeframe'])} debe ser igual o superior "
+                                   f"al timeframe de la estrategia y múltiplo del base")
+                if filtro['indicator'] not in ('vwap', 'rsi'):
+                    errores.append(f"{symbol}: indicador de filtro desconocido {filtro['indicator']!r} (vwap o rsi)")
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            errores.append(f"{symbol}: timeframe o htf_filter no válido ({e})")
+    
+    if broker not in ("mt5", "simulador"):
+        errores.append(f"broker desconocido: {broker!r}")
+    elif broker == "mt5":
+        for indice, cuenta in enumerate(accounts or [creds]):
+            faltan = [clave for clave in ('login', 'server') if not cuenta.get(clave)]
+            if faltan:
+                errores.append(f"Cuenta {indice}: faltan {', '.join(faltan)}")
+    if valores['risk_sizing'] not in ("contrato", "pip"):
+        errores.append(f"risk_sizing desconocido: {valores['risk_sizing']!r}")
+    for nombre in ('max_currency_exposure', 'max_correlated_risk'):
+        valor = valores[nombre]
+        if valor is not None and (not numero(valor) or valor <= 0):
+            errores.append(f"{nombre} debe ser un número positivo o null")
+    if indicator_engine not in ("nativo", "pandas_ta"):
+        errores.append(f"indicator_engine desconocido: {indicator_engine!r}")
+    if audit_format not in ("journal", "text"):
+        errores.append(f"audit_format desconocido: {audit_format!r}")
+    if not isinstance(logging.getLevelName(log_level), int):
+        errores.append(f"log_level desconocido: {log_level!r}")
+    for nombre, valor, minimo in (('max_daily_loss', valores['max_daily_loss'], 0), ('retry_delay', valores['retry_delay'], 0),
+                                  ('flatten_deadline', valores['flatten_deadline'], 0), ('symbol_deadline', valores['symbol_deadline'], 0)):
+        if not numero(valor) or valor < minimo:
+            errores.append(f"{nombre} debe ser un número >= {minimo}")
+    for nombre, valor in (('shards', shards), ('max_workers', max_workers), ('flatten_workers', valores['flatten_workers']),
+                          ('depth_child_orders', valores['depth_child_orders']), ('incremental_buffer', incremental_buffer),
+                          ('correlation_window', correlation_window)):
+        if not isinstance(valor, int) or isinstance(valor, bool) or valor < 1:
+            errores.append(f"{nombre} debe ser un entero >= 1")
+    return errores
+
+def comprobar_configuracion():
+    # python MT5.py --check: valida configmt5.json y las estrategias sin conectar al terminal ni
+    # importar pandas/pandas_ta; código de salida 1 si hay errores
+    errores = validar_configuracion()
+    for error in errores:
+        logging.error(f"Configuración: {error}")
+    estrategias = sorted({parametros.get('strategy') for parametros in symbol_config.values()})
+    segundos = time.perf_counter() - inicio_script
+    if errores:
+        logging.critical(f"Configuración con {len(errores)} errores ({segundos:.2f} s)")
+    else:
+        logging.warning(f"Configuración válida: {len(symbol_config)} símbolos, estrategias {', '.join(estrategias)}, "
+                        f"timeframe {nombre_timeframe(timeframe)}, broker {broker} ({segundos:.2f} s desde el arranque)")
+    return not errores
+
+# ---------------------------------------------------------------------------
+# Recarga en caliente de configmt5.json
+# ---------------------------------------------------------------------------
+
+# Claves que se pueden cambiar sin reiniciar, además de symbol_config. El resto (timeframe, cuentas,
+# broker, modos, directorios...) se lee al arrancar y necesita reiniciar el script.
+CLAVES_RECARGABLES = ('max_daily_loss', 'symbol_deadline', 'retry_delay', 'audit_logging', 'risk_sizing',
+                      'max_currency_exposure', 'max_correlated_risk', 'depth_max_impact', 'depth_child_orders',
+                      'flatten_deadline', 'flatten_workers', 'flatten_close_by')
+
+class RecargaConfiguracion:
+    # Un hilo vigila configmt5.json (fecha de modificación y tamaño cada `intervalo` segundos), lo lee y lo
+    # valida fuera del ciclo y deja pendiente la configuración nueva. aplicar(), al empezar cada ciclo, la
+    # instala de una vez bajo ciclo_lock, así que ningún ciclo ve una mezcla de la vieja y la nueva.
+    def __init__(self, ruta="configmt5.json", intervalo=2.0):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self.firma = self._firma()
+        self.cargada = config
+        self.simbolos = None  # en un shard, los símbolos que tiene asignados
+        self.pendiente = None
+        self.lock = threading.Lock()
+        self.hilo = None
+
+    def _firma(self):
+        try:
+            estado = os.stat(self.ruta)
+            return estado.st_mtime_ns, estado.st_size
+        except OSError:
+            return None
+
+    def comprobar(self):
+        # True si el fichero ha cambiado y la configuración nueva es válida (queda pendiente de aplicar)
+        firma = self._firma()
+        if firma is None or firma == self.firma:
+            return False
+        self.firma = firma
+        try:
+            with open(self.ruta, "r") as f:
+                nueva = json.load(f)
+            simbolos = nueva['symbol_config']
+            if self.simbolos is not None:
+                fuera = sorted(set(simbolos) - self.simbolos)
+                if fuera:
+                    logging.warning(f"{', '.join(fuera)} no pertenecen a este shard; se repartirán al reiniciar el supervisor")
+                simbolos = {symbol: parametros for symbol, parametros in simbolos.items() if symbol in self.simbolos}
+            cambios = {'symbol_config': simbolos, **{clave: nueva[clave] for clave in CLAVES_RECARGABLES if clave in nueva}}
+            errores = validar_configuracion(cambios)
         except Exception as e:
-            logging.error(f"Error en trading_job para {symbol}: {str(e)}")
-            logging.debug(f"Traceback completo:\n{traceback.format_exc()}")
-            ahora = get_now() 
-            with open("errores_operaciones.txt", "a") as f:
-                f.write(f"{ahora}: Error en trading_job para {symbol}: {str(e)}\n")
+            logging.error(f"No se pudo leer {self.ruta}, se mantiene la configuración actual: {str(e)}")
+            detailed_logger.error(f"Error al recargar {self.ruta}: {str(e)}\nTraceback: {traceback.format_exc()}")
+            return False
+        if errores:
+            for error in errores:
+                logging.error(f"Configuración: {error}")
+            logging.error(f"{self.ruta} tiene {len(errores)} errores; se mantiene la configuración actual")
+            return False
+        reinicio = sorted(clave for clave in set(nueva) | set(self.cargada)
+                          if clave != 'symbol_config' and clave not in CLAVES_RECARGABLES
+                          and nueva.get(clave) != self.cargada.get(clave))
+        if reinicio:
+            logging.warning(f"Los cambios en {', '.join(reinicio)} necesitan reiniciar el script; no se aplican")
+        self.cargada = nueva
+        with self.lock:
+            self.pendiente = cambios
+        logging.info(f"{self.ruta} validado; se aplicará al empezar el próximo ciclo")
+        return True
+
+    def aplicar(self):
+        # Instala la configuración pendiente y descarta el estado de indicadores de los símbolos
+        # modificados o eliminados, que se vuelve a sembrar en su próximo ciclo; el resto conserva
+        # el suyo. Una clave recargable que desaparece del fichero mantiene su valor actual.
+        global symbol_config
+        with ciclo_lock:
+            # Un símbolo del ciclo anterior que sigue preparándose fuera de plazo leería la mezcla:
+            # la configuración queda pendiente hasta el siguiente ciclo
+            if any(not futuro.done() for futuro in _preparaciones_en_curso.values()):
+                return False
+            with self.lock:
+                cambios, self.pendiente = self.pendiente, None
+            if cambios is None:
+                return False
+            nuevos = cambios.pop('symbol_config')
+            anadidos = [symbol for symbol in nuevos if symbol not in symbol_config]
+            eliminados = [symbol for symbol in symbol_config if symbol not in nuevos]
+            modificados = [symbol for symbol in nuevos if symbol in symbol_config and nuevos[symbol] != symbol_config[symbol]]
+            for symbol in eliminados + modificados:
+                estados_incrementales.pop(symbol, None)
+                estados_multitimeframe.pop(symbol, None)
+            symbol_config = nuevos
+            cambios = {clave: valor for clave, valor in cambios.items() if globals()[clave] != valor}
+            globals().update(cambios)
+            logging.warning(f"Configuración recargada: {len(anadidos)} símbolos añadidos, {len(modificados)} modificados, "
+                            f"{len(eliminados)} eliminados"
+                            + (f" ({', '.join(anadidos + modificados + eliminados)})" if anadidos or modificados or eliminados else "")
+                            + (f"; {', '.join(f'{clave}={valor}' for clave, valor in cambios.items())}" if cambios else ""))
+            return True
+
+    def iniciar(self):
+        def vigilar():
+            while True:
+                time.sleep(self.intervalo)
+                self.comprobar()
+        if self.hilo is None:
+            self.hilo = threading.Thread(target=vigilar, name="recarga-configuracion", daemon=True)
+            self.hilo.start()
+
+ruta_configuracion = None  # la de inicializar(); None mientras el módulo no está inicializado
+
+def inicializar(ruta_config="configmt5.json", sufijo_logs=""):
+    # Lo que el script hacía al importarse: logging, configmt5.json y los objetos que dependen de la
+    # configuración. Importar MT5 no tiene efectos (los shards lo importan de nuevo al arrancar con
+    # spawn, y las herramientas y las pruebas también lo importan); cada punto de entrada llama a
+    # inicializar() una vez antes de usar nada más.
+    global ruta_configuracion, journal, metricas, instantanea, cache_indicadores, motor_indicadores
+    global riesgo, almacen_velas, recarga
+    preparar_logging(sufijo_logs)
+    ruta_configuracion = ruta_config
+    extraer_configuracion(cargar_configuracion(ruta_config))
+    configurar_logging(log_level, async_logging)
+    journal = Journal(journal_directory)
+    escritor.al_cerrar(journal.cerrar)
+    metricas = MetricasLatencia(metrics_window)
+    instantanea = InstantaneaMercado(snapshot_max_age)
+    cache_indicadores = CacheIndicadores(indicator_cache_size)
+    motor_indicadores = IndicadoresNativos() if indicator_engine == 'nativo' else ta
+    riesgo = RiesgoCartera(risk_state_file, correlation_window)
+    almacen_velas = AlmacenVelas(market_data_directory)
+    recarga = RecargaConfiguracion(ruta_config)
+
+def inicializar_worker(ruta_config):
+    # Workers de ProcessPoolExecutor: con fork heredan el módulo ya inicializado; con spawn (Windows)
+    # lo importan de nuevo, sin efectos, y se inicializan aquí
+    if ruta_configuracion is None:
+        inicializar(ruta_config or "configmt5.json")
+
+# ---------------------------------------------------------------------------
+# Modo supervisor: symbol_config repartido entre procesos, cada uno con su conexión
+# ---------------------------------------------------------------------------
+
+_shard = None  # (indice, cola, limite_global) dentro de un proceso de shard
+
+def asignar_shards(simbolos, n_shards):
+    # Hashing de rendezvous: cada símbolo va al shard con mayor hash(símbolo, shard). No depende del
+    # orden de symbol_config y al pasar de n a n+1 shards solo se mueve ~1/(n+1) de los símbolos.
+    asignacion = [[] for _ in range(n_shards)]
+    for symbol in simbolos:
+        pesos = [hashlib.sha1(f"{symbol}:{i}".encode()).digest() for i in range(n_shards)]
+        asignacion[pesos.index(max(pesos))].append(symbol)
+    return asignacion
+
+def cuenta_shard(indice):
+    cuentas = accounts or [creds]
+    return cuentas[indice % len(cuentas)]
+
+def clave_cuenta(cuenta):
+    # Varios shards pueden compartir cuenta: su equity solo se cuenta una vez
+    return f"{cuenta.get('login')}@{cuenta.get('server')}"
+
+def perdida_global(cuentas):
+    # Pérdida porcentual del conjunto de cuentas: {clave: (equity al inicio del día, equity)} con el último dato de cada una
+    inicio = sum(i for i, _ in cuentas.values())
+    equity = sum(e for _, e in cuentas.values())
+    return (inicio - equity) / inicio * 100 if inicio else 0.0
+
+def ejecutar_shard(indice, simbolos, cuenta, cola, limite_global, ciclos=None, ruta_config="configmt5.json"):
+    # Proceso de trabajo: el script se importa de nuevo (spawn), sin efectos, y el shard configura aquí
+    # logging, configuración y broker antes de quedarse con sus símbolos y su cuenta.
+    # Con ciclos (pruebas contra el simulador) ejecuta ese número de ciclos en vez del scheduler.
+    global symbol_config, creds, journal, riesgo, _shard
+    inicializar(ruta_config, sufijo_logs=f"_shard{indice}")
+    symbol_config = {symbol: symbol_config[symbol] for symbol in simbolos}
+    creds = cuenta
+    _shard = (indice, cola, limite_global)
+    recarga.simbolos = set(simbolos)
     
-    ahora = get_now() 
-    logging.info(f"Ciclo de trading completado a las {ahora}")
+    def marcar(registro):
+        registro.msg = f"[shard{indice}] {registro.msg}"
+        return True
+    for logger in (logging.getLogger(), detailed_logger):
+        logger.addFilter(marcar)
+    # Journal propio por shard: SQLite no admite bien varios procesos escribiendo a la vez
+    journal = Journal(os.path.join(journal_directory, f"shard{indice}"))
+    escritor.al_cerrar(journal.cerrar)
+    raiz, extension = os.path.splitext(risk_state_file)
+    riesgo = RiesgoCartera(f"{raiz}_shard{indice}{extension}", correlation_window)
+    
+    logging.info(f"Shard {indice} (pid {os.getpid()}): {', '.join(simbolos)} en {clave_cuenta(cuenta)}")
+    conectar_broker()
+    if ciclos is None:
+        main(streaming=streaming_mode)
+        return
+    import simulador
+    for _ in range(int(ciclos)):
+        trading_job()
+        if isinstance(mt5, simulador.SimuladorMercado):
+            mt5.avanzar()
+    escritor.vaciar(cerrar_archivos=True)
 
-def main():
-    scheduler = BlockingScheduler()
+def supervisor(n_shards=None, ciclos=None):
+    # Lanza un proceso por shard, relanza los que terminan con error (espera exponencial desde
+    # retry_delay hasta shard_restart_max_delay) y agrega el equity de todas las cuentas: si la
+    # pérdida conjunta llega a max_daily_loss, marca el límite global y cada shard cierra sus posiciones.
+    n_shards = int(n_shards or shards)
+    import multiprocessing
+    contexto = multiprocessing.get_context('spawn')  # Igual en Windows y Linux: cada shard arranca de cero
+    asignacion = asignar_shards(list(symbol_config), n_shards)
+    cola, limite_global = contexto.Queue(), contexto.Event()
+    procesos, arranques, reinicios, pendientes, cuentas = {}, {}, {}, {}, {}
+    dia = get_now().date()
     
-    # Configuración de la tarea: Desde las 22:00 del domingo (día 6) hasta las 21:30 del viernes (día 4)
-    scheduler.add_job(
-        trading_job,
-        'cron',
-        day_of_week='sun',
-        hour='22-23',
-        minute='1,6,11,16,21,26,31,36,41,46,51,56',
-        timezone='Europe/London'
-    )
-    scheduler.add_job(
-        trading_job,
-        'cron',
-        day_of_week='mon-thu',
-        hour='0-23',
-        minute='1,6,11,16,21,26,31,36,41,46,51,56',
-        timezone='Europe/London'
-    )
-    scheduler.add_job(
-        trading_job,
-        'cron',
-        day_of_week='fri',
-        hour='0-21',
-        minute='1,6,11,16,21,26,31,36,41,46,51,56',
-        timezone='Europe/London'
-    )
+    def lanzar(indice):
+        proceso = contexto.Process(target=ejecutar_shard, name=f"shard{indice}",
+                                   args=(indice, asignacion[indice], cuenta_shard(indice), cola, limite_global, ciclos,
+                                         ruta_configuracion))
+        proceso.start()
+        procesos[indice], arranques[indice] = proceso, time.monotonic()
+        logging.info(f"Shard {indice} lanzado (pid {proceso.pid}): {', '.join(asignacion[indice])}")
+    
+    for indice, simbolos in enumerate(asignacion):
+        if simbolos:
+            lanzar(indice)
+    try:
+        while procesos or pendientes:
+            try:
+                mensaje = cola.get(timeout=1)
+                while True:
+                    _, clave, inicio, equity = mensaje
+                    cuentas[clave] = (inicio, equity)
+                    mensaje = cola.get_nowait()
+            except queue.Empty:
+                pass
+            
+            if get_now().date() != dia:
+                dia = get_now().date()
+                cuentas.clear()
+                limite_global.clear()
+            perdida = perdida_global(cuentas)
+            if perdida >= max_daily_loss and not limite_global.is_set():
+                logging.warning(f"Pérdida diaria conjunta del {perdida:.2f}% en {len(cuentas)} cuentas: deteniendo todos los shards")
+                limite_global.set()
+            
+            for indice, proceso in list(procesos.items()):
+                if proceso.is_alive():
+                    continue
+                del procesos[indice]
+                if proceso.exitcode == 0:
+                    logging.info(f"Shard {indice} terminado")
+                    continue
+                # Un shard que aguantó más que la espera máxima vuelve a empezar la espera desde retry_delay
+                if time.monotonic() - arranques[indice] >= shard_restart_max_delay:
+                    reinicios[indice] = 0
+                reinicios[indice] = reinicios.get(indice, 0) + 1
+                espera = min(shard_restart_max_delay, retry_delay * 2 ** (reinicios[indice] - 1))
+                logging.error(f"Shard {indice} caído (código {proceso.exitcode}); se relanza en {espera}s")
+                pendientes[indice] = time.monotonic() + espera
+            for indice, momento in list(pendientes.items()):
+                if time.monotonic() >= momento:
+                    del pendientes[indice]
+                    lanzar(indice)
+    except KeyboardInterrupt:
+        logging.info("Deteniendo los shards...")
+    finally:
+        for proceso in procesos.values():
+            if proceso.is_alive():
+                proceso.terminate()
+            proceso.join(10)
+    return {'asignacion': asignacion, 'reinicios': reinicios, 'cuentas': cuentas,
+            'limite_global': limite_global.is_set()}
+
+def main(streaming=False):
+    # En modo streaming las velas se evalúan desde modo_streaming() al cerrar y el scheduler, en segundo
+    # plano, solo lleva el cierre del viernes y la comprobación de conexión
+    from apscheduler.schedulers.blocking import BlockingScheduler
+    from apscheduler.schedulers.background import BackgroundScheduler
+    scheduler = BackgroundScheduler() if streaming else BlockingScheduler()
+    
+    if not streaming:
+        # Configuración de la tarea: Desde las 22:00 del domingo (día 6) hasta las 21:30 del viernes (día 4)
+        scheduler.add_job(
+            trading_job,
+            'cron',
+            day_of_week='sun',
+            hour='22-23',
+            minute='1,6,11,16,21,26,31,36,41,46,51,56',
+            timezone='Europe/London'
+        )
+        scheduler.add_job(
+            trading_job,
+            'cron',
+            day_of_week='mon-thu',
+            hour='0-23',
+            minute='1,6,11,16,21,26,31,36,41,46,51,56',
+            timezone='Europe/London'
+        )
+        scheduler.add_job(
+            trading_job,
+            'cron',
+            day_of_week='fri',
+            hour='0-21',
+            minute='1,6,11,16,21,26,31,36,41,46,51,56',
+            timezone='Europe/London'
+        )
     
     # Agregar tarea para cerrar todas las posiciones a las 21:30 del viernes
     scheduler.add_job(
@@ -677,21 +3671,54 @@ def main():
         minutes=3
     )
     
+    if metrics_port:
+        iniciar_servidor_metricas(metrics_port)
+    if config_hot_reload:
+        recarga.iniciar()
+    
     logging.info("Iniciando el scheduler...")
     try:
         scheduler.start()
+        if streaming:
+            modo_streaming()
     except (KeyboardInterrupt, SystemExit):
         logging.info("Deteniendo el scheduler...")
     except Exception as e:
         logging.error(f"Error inesperado en el scheduler: {str(e)}")
         logging.debug(f"Traceback completo:\n{traceback.format_exc()}")
         ahora = get_now() 
-        with open("errores_operaciones.txt", "a") as f:
-            f.write(f"{ahora}: Error inesperado en el scheduler: {str(e)}\n")
+        registrar_error_operacion(f"{ahora}: Error inesperado en el scheduler: {str(e)}\n")
     finally:
-        mt5.shutdown()
+        # Los símbolos y cierres que siguen en curso terminan antes de desconectar (los que no han
+        # empezado se cancelan): ninguno llega a llamar al terminal ya cerrado
+        for pool in (_pool_simbolos, _pool_cierre):
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
+        with terminal_lock:
+            profundidad.liberar()
+            mt5.shutdown()
         logging.info("MetaTrader 5 desconectado.")
 
+# Ejecutado como script (y en los shards, que lo importan como __mp_main__), las herramientas que
+# hacen import MT5 deben ver este mismo módulo ya inicializado y no una segunda copia
+if __name__ in ("__main__", "__mp_main__"):
+    sys.modules.setdefault("MT5", sys.modules[__name__])
+
 if __name__ == "__main__":
-    main()
+    inicializar()
+    if len(sys.argv) > 1 and sys.argv[1] == "--download-history":
+        conectar_broker()
+        descargar_historico_cli(*sys.argv[2:5])
+    elif len(sys.argv) > 1 and sys.argv[1] == "--profile-cycle":
+        conectar_broker()
+        perfilar(trading_job, secuencial=True)
+    elif len(sys.argv) > 1 and sys.argv[1] == "--check":
+        sys.exit(0 if comprobar_configuracion() else 1)
+    elif len(sys.argv) > 1 and sys.argv[1] == "--supervisor":
+        supervisor(*sys.argv[2:4])
+    elif shards > 1:
+        supervisor()
+    else:
+        conectar_broker()
+        main(streaming=streaming_mode or "--stream" in sys.argv[1:])
     # cd C:\Users\guill\desktop\trading\proyectos de programacion\robot>
\ No newline at end of file
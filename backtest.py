@@ -0,0 +1,189 @@
+import heapq
+import logging
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import MT5
+
+# Backtest sobre velas grabadas con la misma lógica de señales, SL/TP y tamaño que en vivo. No
+# conecta con el terminal.
+#   python backtest.py EURUSD.csv [market_data/AUDNZD_5.bin:AUDNZD ...]
+
+# ---------------------------------------------------------------------------
+# Backtesting: reproduce velas históricas con la misma lógica de señales y gestión
+# ---------------------------------------------------------------------------
+
+def marcos_backtest(df, config):
+    # Velas de la estrategia y de sus filtros a partir del histórico del timeframe base
+    if not MT5.usa_multitimeframe(config):
+        return df, None
+    marcos = {filtro['timeframe']: MT5.remuestrear_dataframe(df, filtro['timeframe']) for filtro in MT5.filtros_htf(config)}
+    return MT5.remuestrear_dataframe(df, MT5.timeframe_estrategia(config)), marcos
+
+def _buscar_salida(i, direccion, sl, tp, arrays, bloque=256):
+    # Primera vela >= i en la que se toca SL, TP o la salida por RSI de close_orders. Las velas
+    # son precios bid; las ventas se cierran al ask (bid + spread). Si SL y TP caen en la misma
+    # vela se asume el SL. Devuelve (índice, precio, motivo).
+    open_, high, low, close, spread, salida_rsi_compra, salida_rsi_venta = arrays
+    n = len(close)
+    salida_rsi = salida_rsi_compra if direccion == 1 else salida_rsi_venta
+    for inicio in range(i, n, bloque):
+        fin = min(n, inicio + bloque)
+        if direccion == 1:
+            toca_sl = low[inicio:fin] <= sl
+            toca_tp = high[inicio:fin] >= tp
+        else:
+            toca_sl = high[inicio:fin] + spread[inicio:fin] >= sl
+            toca_tp = low[inicio:fin] + spread[inicio:fin] <= tp
+        eventos = toca_sl | toca_tp | salida_rsi[inicio:fin]
+        if not eventos.any():
+            continue
+        k = int(np.argmax(eventos))
+        j = inicio + k
+        apertura = open_[j] if direccion == 1 else open_[j] + spread[j]
+        if toca_sl[k]:
+            # En un hueco de apertura se ejecuta al precio de apertura
+            precio = sl if j == i else (min(sl, apertura) if direccion == 1 else max(sl, apertura))
+            return j, precio, 'sl'
+        if toca_tp[k]:
+            precio = tp if j == i else (max(tp, apertura) if direccion == 1 else min(tp, apertura))
+            return j, precio, 'tp'
+        return j, (close[j] if direccion == 1 else close[j] + spread[j]), 'rsi'
+    return n - 1, (close[-1] if direccion == 1 else close[-1] + spread[-1]), 'fin'
+
+def senales_backtest(symbol, df, config, punto=0.00001, slippage=None, rng=None, indicadores_calculados=False,
+                     marcos=None):
+    # Calcula señales una sola vez sobre todo el histórico con process() y genera las operaciones
+    # candidatas (sin tamaño). La señal de la vela i se ejecuta en la apertura de la vela i+1.
+    # Con estrategias multi-timeframe df y marcos salen de marcos_backtest().
+    df = MT5.process(df, symbol, indicadores_calculados=indicadores_calculados, config=config, marcos=marcos)
+    if df is None or len(df) < 2:
+        return []
+    rng = rng or np.random.default_rng(0)
+    open_ = df.open.to_numpy(dtype=np.float64)
+    high = df.high.to_numpy(dtype=np.float64)
+    low = df.low.to_numpy(dtype=np.float64)
+    close = df.close.to_numpy(dtype=np.float64)
+    spread = df.spread.to_numpy(dtype=np.float64) * punto
+    rsi = df.RSI.to_numpy(dtype=np.float64)
+    atr = df.ATR.to_numpy(dtype=np.float64)
+    tiempos = df.index
+    arrays = (open_, high, low, close, spread, rsi >= config['rsi_overbought'], rsi <= config['rsi_oversold'])
+
+    senales = df.TotalSignal.to_numpy()
+    operaciones = []
+    for i in np.flatnonzero((senales == 1) | (senales == 2)):
+        e = i + 1
+        if e >= len(df) or not spread[e] < config['max_spread']:
+            continue
+        signal = int(senales[i])
+        slatr = atr[i] * config['slatrcoef']
+        desliz = MT5.slippage_simulado(symbol, rng) if slippage is None else slippage
+        if signal == 2:
+            direccion = 1
+            entry_price = open_[e] + spread[e] + desliz
+        else:
+            direccion = -1
+            entry_price = open_[e] - desliz
+        sl, tp = MT5.calcular_sl_tp(signal, entry_price, slatr, spread[e], config)
+        j, salida, motivo = _buscar_salida(e, direccion, sl, tp, arrays)
+        operaciones.append({
+            'symbol': symbol,
+            'tipo': 'compra' if direccion == 1 else 'venta',
+            'entrada_tiempo': tiempos[e],
+            'entrada': entry_price,
+            'sl': sl,
+            'tp': tp,
+            'salida_tiempo': tiempos[j],
+            'salida': salida,
+            'motivo': motivo,
+            'slatr': slatr,
+            'pip_value': MT5.valor_pip(close[i]),
+            'resultado_unitario': (salida - entry_price) * direccion,
+        })
+    return operaciones
+
+def backtest(historicos, configs=None, balance_inicial=10000.0, punto=0.00001, slippage=None, factor_divisa=None, seed=0):
+    # historicos: {symbol: DataFrame de velas}. El tamaño se calcula con calcular_tamano sobre el
+    # balance realizado al abrir cada operación, compartido entre todos los símbolos. El resultado
+    # se expresa en la divisa cotizada multiplicada por factor_divisa[symbol] (1 por defecto).
+    configs = configs or MT5.symbol_config
+    rng = np.random.default_rng(seed)
+    candidatas = []
+    for symbol, df in historicos.items():
+        df, marcos = marcos_backtest(df, configs[symbol])
+        candidatas += senales_backtest(symbol, df, configs[symbol], punto, slippage, rng, marcos=marcos)
+    return informe_backtest(candidatas, configs, balance_inicial, factor_divisa)
+
+def informe_backtest(candidatas, configs, balance_inicial=10000.0, factor_divisa=None, registrar=True):
+    factor_divisa = factor_divisa or {}
+    candidatas = sorted(candidatas, key=lambda op: op['entrada_tiempo'])
+    balance = balance_inicial
+    abiertas = []  # heap de (salida_tiempo, orden, resultado)
+    cerradas = []
+    for orden, op in enumerate(candidatas):
+        while abiertas and abiertas[0][0] <= op['entrada_tiempo']:
+            _, _, resultado = heapq.heappop(abiertas)
+            balance += resultado
+        if MT5.risk_sizing == 'contrato':
+            # Mismo criterio que en vivo: 1 lote = 100000 unidades y el resultado se liquida con factor_divisa
+            size = MT5.tamano_por_riesgo(configs[op['symbol']], balance, op['slatr'],
+                                     100000.0 * factor_divisa.get(op['symbol'], 1.0))
+        else:
+            size = MT5.calcular_tamano(configs[op['symbol']], balance, op['slatr'], op['pip_value'])
+        if not size > 0:
+            continue
+        op['size'] = size
+        op['balance'] = balance
+        op['pnl'] = op['resultado_unitario'] * size * 100000.0 * factor_divisa.get(op['symbol'], 1.0)
+        heapq.heappush(abiertas, (op['salida_tiempo'], orden, op['pnl']))
+        cerradas.append(op)
+
+    operaciones = pd.DataFrame(cerradas)
+    if operaciones.empty:
+        if registrar:
+            logging.info("Backtest sin operaciones")
+        return {'operaciones': operaciones, 'equity': pd.Series(dtype=float), 'pnl': 0.0,
+                'max_drawdown': 0.0, 'max_drawdown_pct': 0.0, 'num_operaciones': 0,
+                'tasa_acierto': 0.0, 'profit_factor': 0.0}
+    operaciones = operaciones.sort_values('salida_tiempo', kind='stable').reset_index(drop=True)
+    equity = balance_inicial + operaciones.pnl.cumsum()
+    equity.index = operaciones.salida_tiempo
+    maximo = np.maximum.accumulate(np.concatenate(([balance_inicial], equity.to_numpy())))[1:]
+    drawdown = maximo - equity.to_numpy()
+    ganancias = operaciones.pnl[operaciones.pnl > 0].sum()
+    perdidas = -operaciones.pnl[operaciones.pnl < 0].sum()
+    informe = {
+        'operaciones': operaciones,
+        'equity': equity,
+        'pnl': float(operaciones.pnl.sum()),
+        'max_drawdown': float(drawdown.max()),
+        'max_drawdown_pct': float((drawdown / maximo).max() * 100),
+        'num_operaciones': len(operaciones),
+        'tasa_acierto': float((operaciones.pnl > 0).mean()),
+        'profit_factor': float(ganancias / perdidas) if perdidas > 0 else float('inf'),
+    }
+    if registrar:
+        logging.info(f"Backtest: {informe['num_operaciones']} operaciones, PnL {informe['pnl']:.2f}, "
+                     f"drawdown máximo {informe['max_drawdown']:.2f} ({informe['max_drawdown_pct']:.2f}%), "
+                     f"acierto {informe['tasa_acierto']:.1%}, profit factor {informe['profit_factor']:.2f}")
+    return informe
+
+def ejecutar_backtest_cli(rutas):
+    # Cada ruta es fichero[:SYMBOL]; sin SYMBOL se usa el nombre del fichero (EURUSD.csv -> EURUSD)
+    historicos = {}
+    for ruta in rutas:
+        ruta, symbol = MT5.separar_ruta_simbolo(ruta)
+        symbol = symbol or os.path.splitext(os.path.basename(ruta))[0]
+        historicos[symbol] = MT5.cargar_historico(ruta)
+    informe = backtest(historicos)
+    informe['operaciones'].to_csv("backtest_operaciones.csv", index=False)
+    logging.info("Operaciones del backtest guardadas en backtest_operaciones.csv")
+    return informe
+
+if __name__ == "__main__":
+    MT5.inicializar()
+    ejecutar_backtest_cli(sys.argv[1:])
@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import platform
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+
+import pytest
+
+import simulador
+
+# Benchmarks de rendimiento con pytest-benchmark: python -m pytest benchmarks [--historico fichero]
+# Cada caso guarda tiempo (mediana, mínimo) y pico de memoria en una línea JSON de --resultados y se
+# compara con la mejor de las últimas --ventana ejecuciones sin regresiones de la misma máquina,
+# motor de indicadores e histórico. Un caso cuyo tiempo mínimo (menos ruidoso que la mediana) o cuyo
+# pico de memoria supera 1 + --tolerancia veces la referencia falla. Las ejecuciones con regresiones
+# se guardan marcadas y no cuentan como referencia, para que repetir la ejecución no baste para pasar.
+
+TAMANOS = (150, 10_000)
+
+
+def pytest_addoption(parser):
+    grupo = parser.getgroup("mt5", "benchmarks de MT5.py")
+    grupo.addoption("--resultados", default="benchmarks.jsonl",
+                    help="fichero JSONL al que se añade cada ejecución y contra el que se compara")
+    grupo.addoption("--tolerancia", type=float, default=0.25, help="regresión máxima admitida (0.25 = 25%%)")
+    grupo.addoption("--ventana", type=int, default=5, help="ejecuciones anteriores que sirven de referencia")
+
+
+def ruta_invocacion(config, ruta):
+    # El fixture mt5 cambia de directorio: las rutas de la línea de comandos se resuelven desde donde se lanzó pytest
+    return os.path.join(str(config.invocation_params.dir), ruta)
+
+
+class RegistroBenchmarks:
+    def __init__(self, mt5, config):
+        self.fichero = ruta_invocacion(config, config.getoption("--resultados"))
+        self.tolerancia = config.getoption("--tolerancia")
+        historico = config.getoption("--historico")
+        try:
+            commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(mt5.__file__))).stdout.strip() or None
+        except OSError:
+            commit = None
+        self.actual = {'fecha': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': commit,
+                       'maquina': platform.node(), 'python': platform.python_version(),
+                       'numpy': mt5.np.__version__, 'pandas': mt5.pd.__version__,
+                       'indicator_engine': mt5.indicator_engine,
+                       'historico': ruta_invocacion(config, historico) if historico else None,
+                       'casos': {}, 'regresiones': []}
+        self.previos = []
+        if os.path.exists(self.fichero):
+            with open(self.fichero) as f:
+                for linea in f:
+                    if not linea.strip():
+                        continue
+                    previo = json.loads(linea)
+                    if not previo.get('regresiones') and all(
+                            previo.get(clave) == self.actual[clave] for clave in ('maquina', 'indicator_engine', 'historico')):
+                        self.previos.append(previo)
+        self.previos = self.previos[-config.getoption("--ventana"):]
+
+    def comprobar(self, nombre, caso):
+        self.actual['casos'][nombre] = caso
+        referencias = [previo['casos'][nombre] for previo in self.previos if nombre in previo.get('casos', {})]
+        if not referencias:
+            return
+        tiempo = caso['min_ms'] / max(min(r['min_ms'] for r in referencias), 1e-9)
+        memoria = caso['pico_kb'] / max(min(r['pico_kb'] for r in referencias), 1e-9)
+        if tiempo > 1 + self.tolerancia or memoria > 1 + self.tolerancia:
+            self.actual['regresiones'].append(nombre)
+            pytest.fail(f"Regresión de más del {self.tolerancia:.0%} en {nombre}: x{tiempo:.2f} tiempo, "
+                        f"x{memoria:.2f} memoria frente a la mejor de {len(referencias)} ejecuciones", pytrace=False)
+
+    def guardar(self):
+        if self.actual['casos']:
+            with open(self.fichero, "a") as f:
+                f.write(json.dumps(self.actual) + "\n")
+
+
+@pytest.fixture(scope="session")
+def registro(request, mt5):
+    registro = RegistroBenchmarks(mt5, request.config)
+    yield registro
+    registro.guardar()
+
+
+@pytest.fixture
+def medir(benchmark, request, registro):
+    # medir(funcion) con la calibración de pytest-benchmark; con rondas (o setup, que devuelve
+    # (args, kwargs) antes de cada ronda) se fija el número de ejecuciones, para casos que avanzan
+    # un simulador o necesitan un directorio limpio. El pico de memoria sale de una ejecución aparte
+    # con tracemalloc, que ralentiza lo que mide.
+    def medir(funcion, rondas=None, setup=None):
+        if rondas is None and setup is None:
+            resultado = benchmark(funcion)
+        else:
+            resultado = benchmark.pedantic(funcion, setup=setup, rounds=rondas or 5, warmup_rounds=0 if setup else 1)
+        if benchmark.disabled:
+            return resultado
+        args, kwargs = setup() if setup else ((), {})
+        tracemalloc.start()
+        try:
+            funcion(*args, **kwargs)
+            pico = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        estadisticas = benchmark.stats.stats
+        benchmark.extra_info['pico_kb'] = pico / 1024
+        registro.comprobar(request.node.nodeid, {'mediana_ms': estadisticas.median * 1000,
+                                                 'min_ms': estadisticas.min * 1000,
+                                                 'rondas': estadisticas.rounds, 'pico_kb': pico / 1024})
+        return resultado
+    return medir
+
+
+@pytest.fixture
+def entorno(mt5, monkeypatch, tmp_path):
+    # Sin caché de indicadores (se mide el cálculo, no el acierto), sin auditoría, sin esperas entre
+    # reintentos y con logs desde WARNING, en un directorio temporal para no mezclar sus ficheros
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(mt5, "cache_indicadores", mt5.CacheIndicadores(0))
+    monkeypatch.setattr(mt5, "audit_logging", False)
+    monkeypatch.setattr(mt5, "retry_delay", 0)
+    monkeypatch.setattr(mt5, "riesgo", mt5.RiesgoCartera(str(tmp_path / "estado_riesgo.json"), mt5.correlation_window))
+    nivel = logging.getLogger().level
+    logging.getLogger().setLevel(logging.WARNING)
+    try:
+        yield mt5
+    finally:
+        mt5.escritor.vaciar(cerrar_archivos=True)
+        logging.getLogger().setLevel(nivel)
+        for estados in (mt5.estados_incrementales, mt5.estados_multitimeframe):
+            for symbol in [symbol for symbol in estados if symbol.startswith("BENCH")]:
+                del estados[symbol]
+
+
+@pytest.fixture(params=[(fuente, n) for fuente in ("sinteticas", "grabadas") for n in TAMANOS],
+                ids=lambda param: f"{param[0]}-{param[1]}")
+def velas(request, mt5):
+    fuente, n = request.param
+    if fuente == "sinteticas":
+        return simulador.generar_datos_sinteticos(n)
+    datos = request.getfixturevalue("velas_grabadas")
+    if len(datos) < n:
+        pytest.skip(f"el histórico tiene {len(datos)} velas, menos de {n}")
+    return datos.iloc[-n:]
+
+
+@pytest.fixture(scope="session")
+def configs(mt5):
+    # Una configuración por estrategia: la de configmt5.json o, si no la usa ningún símbolo, la del
+    # primero con los parámetros por defecto de la estrategia
+    configs = {}
+    for strategy in ("rsi_bollinger", "vwap_bollinger"):
+        configs[strategy] = next((c for c in mt5.symbol_config.values() if c['strategy'] == strategy), None) or \
+            dict(next(iter(mt5.symbol_config.values())), strategy=strategy, bb_length=14, bb_std=2.0, backcandles=15)
+    return configs
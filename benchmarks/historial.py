@@ -0,0 +1,18 @@
+import json
+import sys
+
+import pandas as pd
+
+# python benchmarks/historial.py [benchmarks.jsonl] [mediana_ms|min_ms|pico_kb]: tabla caso x
+# ejecución de la métrica con todo lo guardado por python -m pytest benchmarks
+
+
+def historial_benchmarks(fichero="benchmarks.jsonl", metrica='mediana_ms'):
+    with open(fichero) as f:
+        registros = [json.loads(linea) for linea in f if linea.strip()]
+    return pd.DataFrame({f"{r['fecha']} {r['commit'] or ''}".strip() + (" (regresiones)" if r.get('regresiones') else ""):
+                         {caso: valores[metrica] for caso, valores in r['casos'].items()} for r in registros})
+
+
+if __name__ == "__main__":
+    print(historial_benchmarks(*sys.argv[1:3]).round(3).to_string())
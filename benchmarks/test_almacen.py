@@ -0,0 +1,47 @@
+from datetime import datetime
+
+import pytest
+
+import simulador
+
+# Arranque en frío (todo el histórico desde el terminal) frente a arranque en caliente (fichero local
+# ya presente, solo se piden las velas nuevas) de AlmacenVelas con 1M de velas contra un terminal grabado
+
+N_BARRAS = 1_000_000
+VELAS_NUEVAS = 10
+
+
+@pytest.fixture(scope="module")
+def grabado(mt5):
+    rates = mt5.rates_desde_dataframe(simulador.generar_datos_sinteticos(N_BARRAS))
+    return simulador.MT5Grabado({next(iter(mt5.symbol_config)): rates}), rates
+
+
+@pytest.mark.parametrize("arranque", ["frio", "caliente"])
+def test_copy_rates_range(mt5, medir, grabado, tmp_path, arranque):
+    falso, rates = grabado
+    symbol = next(iter(mt5.symbol_config))
+    desde = datetime.fromtimestamp(int(rates['time'][0]), tz=mt5.pytz.utc)
+    if arranque == "frio":
+        falso.tiempo_actual = int(rates['time'][-VELAS_NUEVAS])
+    else:
+        falso.tiempo_actual = int(rates['time'][-1]) + mt5.segundos_timeframe(mt5.timeframe)
+    hasta = datetime.fromtimestamp(falso.tiempo_actual, tz=mt5.pytz.utc)
+    directorios = iter(range(100))
+
+    def preparar():
+        # instancia nueva en cada ronda: simula un reinicio del script. En frío, además, sin fichero local
+        directorio = tmp_path / (str(next(directorios)) if arranque == "frio" else "comun")
+        almacen = mt5.AlmacenVelas(str(directorio))
+        if arranque == "caliente" and not directorio.exists():
+            almacen.copy_rates_range(symbol, mt5.timeframe, desde, hasta)
+            almacen = mt5.AlmacenVelas(str(directorio))
+        falso.llamadas = falso.velas_servidas = 0
+        return (almacen,), {}
+
+    with simulador.entorno_simulado(falso):
+        leidas = medir(lambda almacen: almacen.copy_rates_range(symbol, mt5.timeframe, desde, hasta),
+                       rondas=5, setup=preparar)
+    assert len(leidas) > 0
+    if arranque == "caliente":
+        assert falso.velas_servidas <= VELAS_NUEVAS
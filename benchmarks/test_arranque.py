@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Arranque de python MT5.py --check (proceso completo) y lo que costaría importar por adelantado
+# pandas, pandas_ta y apscheduler como hacía el script antes de diferirlos. Las importaciones de
+# primer nivel de -X importtime quedan en extra_info.
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def importaciones(stderr):
+    # "import time: self [us] | cumulative | imported package"; solo los de primer nivel, en segundos
+    resultado = {}
+    for linea in stderr.splitlines():
+        partes = linea.split('|')
+        if linea.startswith('import time:') and len(partes) == 3 and partes[2][1:2] != ' ' and partes[1].strip().isdigit():
+            resultado[partes[2].strip()] = int(partes[1]) / 1e6
+    return resultado
+
+
+def test_check(mt5, medir, benchmark):
+    proceso = medir(lambda: subprocess.run([sys.executable, "-X", "importtime", os.path.join(RAIZ, "MT5.py"), "--check"],
+                                           capture_output=True, text=True), rondas=5)
+    assert proceso.returncode == 0, proceso.stderr
+    principales = sorted(importaciones(proceso.stderr).items(), key=lambda item: -item[1])[:5]
+    benchmark.extra_info['importaciones'] = dict(principales)
+
+
+def test_importaciones_diferidas(medir):
+    pytest.importorskip("pandas_ta")
+    pytest.importorskip("apscheduler")
+    proceso = medir(lambda: subprocess.run([sys.executable, "-c", "import pandas, pandas_ta, apscheduler.schedulers.blocking, "
+                                            "apscheduler.schedulers.background"], capture_output=True, text=True), rondas=5)
+    assert proceso.returncode == 0, proceso.stderr
@@ -0,0 +1,36 @@
+import logging
+
+import pytest
+
+import simulador
+
+# Tiempo por ciclo de trading_job contra un terminal grabado con toda la auditoría (DEBUG, en
+# ficheros de texto o en el journal) y sin ella (WARNING, sin auditoría)
+
+CICLOS = 30
+N_BARRAS = 2000
+
+MODOS = {
+    "texto": (logging.DEBUG, True, "text"),
+    "journal": (logging.DEBUG, True, "journal"),
+    "desactivada": (logging.WARNING, False, "journal"),
+}
+
+
+@pytest.mark.parametrize("modo", MODOS)
+def test_trading_job(entorno, medir, monkeypatch, modo):
+    nivel, auditoria, formato = MODOS[modo]
+    rates = {symbol: entorno.rates_desde_dataframe(simulador.generar_datos_sinteticos(N_BARRAS, seed=i))
+             for i, symbol in enumerate(entorno.symbol_config)}
+    falso = simulador.MT5Grabado(rates)
+    tiempos = iter(rates[next(iter(rates))]['time'][N_BARRAS - CICLOS - 1:])
+    monkeypatch.setattr(entorno, "audit_logging", auditoria)
+    monkeypatch.setattr(entorno, "audit_format", formato)
+    logging.getLogger().setLevel(nivel)
+
+    def ciclo():
+        falso.tiempo_actual = int(next(tiempos))
+        entorno.trading_job()
+    with simulador.entorno_simulado(falso, falso.reloj):
+        # la ronda de calentamiento y la de memoria también consumen una vela
+        medir(ciclo, rondas=CICLOS - 1)
@@ -0,0 +1,19 @@
+import simulador
+
+# Prueba de carga: trading_job de principio a fin contra SimuladorMercado, una vela por ciclo, sin
+# auditoría, con logs desde WARNING y sin esperas entre reintentos; el simulador rechaza el 2% de las
+# órdenes con requote. Órdenes, retcodes, posiciones, balance y equity finales quedan en extra_info.
+
+CICLOS = 2000
+
+
+def test_trading_job(entorno, medir, benchmark):
+    mercado = simulador.crear_simulador(list(entorno.symbol_config), n_barras=CICLOS + 200,
+                                        fallos={entorno.PasarelaBroker.TRADE_RETCODE_REQUOTE: 0.02})
+
+    def ciclo():
+        entorno.trading_job()
+        mercado.avanzar()
+    with simulador.entorno_simulado(mercado, mercado.reloj):
+        medir(ciclo, rondas=CICLOS - 2)
+    benchmark.extra_info.update(mercado.resumen())
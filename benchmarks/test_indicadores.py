@@ -0,0 +1,41 @@
+import pytest
+
+import simulador
+
+# pandas_ta frente a los kernels nativos: cada indicador sobre 1M de velas (camino del backtest y la
+# optimización) y analyze_* sobre 150 velas sin caché (camino de cada ciclo en vivo). Los casos de
+# pandas_ta se omiten si no está instalado.
+
+N_BARRAS = 1_000_000
+INDICADORES = {
+    "rsi": lambda motor, df: motor.rsi(df.close, length=14),
+    "bbands": lambda motor, df: motor.bbands(df.close, length=20, std=2.0),
+    "atr": lambda motor, df: motor.atr(df.high, df.low, df.close, length=7),
+    "vwap": lambda motor, df: motor.vwap(df.high, df.low, df.close, df.tick_volume),
+}
+
+
+@pytest.fixture(params=["nativo", "pandas_ta"])
+def motor(request, mt5):
+    if request.param == "pandas_ta":
+        return pytest.importorskip("pandas_ta")
+    return mt5.IndicadoresNativos()
+
+
+@pytest.fixture(scope="module")
+def millon_velas(mt5):
+    return simulador.generar_datos_sinteticos(N_BARRAS)
+
+
+@pytest.mark.parametrize("indicador", INDICADORES)
+def test_indicador(medir, motor, millon_velas, indicador):
+    calcular = INDICADORES[indicador]
+    assert len(medir(lambda: calcular(motor, millon_velas))) == N_BARRAS
+
+
+@pytest.mark.parametrize("strategy", ["rsi_bollinger", "vwap_bollinger"])
+def test_analyze(entorno, medir, configs, motor, monkeypatch, strategy):
+    monkeypatch.setattr(entorno, "motor_indicadores", motor)
+    velas = simulador.generar_datos_sinteticos(150)
+    analizar = getattr(entorno, f"analyze_{strategy}")
+    assert not medir(lambda: analizar(velas, configs[strategy])).empty
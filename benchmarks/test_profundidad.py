@@ -0,0 +1,63 @@
+import pytest
+
+import simulador
+
+# Coste por tick de reconstruir el libro cuando cambia y de consultarlo (precio medio esperado,
+# división en órdenes hijas), frente a recorrer la lista del libro en Python cada vez
+
+NIVELES = 20
+
+
+@pytest.fixture(scope="module")
+def libros(mt5):
+    rng = mt5.np.random.default_rng(0)
+    venta, compra = mt5.PasarelaBroker.BOOK_TYPE_SELL, mt5.PasarelaBroker.BOOK_TYPE_BUY
+    libros = []
+    for _ in range(1000):
+        medio = 1.1 + rng.normal(0, 0.0005)
+        libros.append(tuple([simulador.NivelLibro(venta, medio + (k + 1) * 1e-5, 0, v) for k, v in enumerate(rng.uniform(1, 10, NIVELES))] +
+                            [simulador.NivelLibro(compra, medio - (k + 1) * 1e-5, 0, v) for k, v in enumerate(rng.uniform(1, 10, NIVELES))]))
+    return libros, rng.uniform(0.1, 50, 1000)
+
+
+def test_reconstruir(mt5, medir, libros):
+    libros, _ = libros
+    analisis = mt5.ProfundidadMercado()
+
+    def reconstruir():
+        for libro in libros:
+            analisis.lado("X", mt5.PasarelaBroker.BOOK_TYPE_SELL, libro)
+    medir(reconstruir)
+    assert analisis.reconstrucciones >= len(libros)
+
+
+def test_precio_esperado(mt5, medir, libros):
+    libros, volumenes = libros
+    analisis = mt5.ProfundidadMercado()
+    medir(lambda: [analisis.precio_esperado("X", mt5.PasarelaBroker.BOOK_TYPE_SELL, volumen, libros[-1])
+                   for volumen in volumenes])
+
+
+def test_dividir(mt5, medir, libros):
+    libros, volumenes = libros
+    analisis = mt5.ProfundidadMercado()
+    medir(lambda: [analisis.dividir("X", mt5.PasarelaBroker.BOOK_TYPE_SELL, volumen, 5, 0.01, libros[-1])
+                   for volumen in volumenes])
+
+
+def test_recorrido_python(mt5, medir, libros):
+    # Referencia: ordenar y recorrer el libro en cada consulta
+    libros, volumenes = libros
+    libro = libros[-1]
+
+    def recorrer():
+        for volumen in volumenes:
+            asks = sorted((item.price, item.volume_dbl) for item in libro if item.type == mt5.PasarelaBroker.BOOK_TYPE_SELL)
+            pendiente, importe = volumen, 0.0
+            for precio, disponible in asks:
+                parte = min(pendiente, disponible)
+                importe += parte * precio
+                pendiente -= parte
+                if pendiente <= 0:
+                    break
+    medir(recorrer)
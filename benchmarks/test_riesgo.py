@@ -0,0 +1,48 @@
+import pytest
+
+import simulador
+
+# Coste por ciclo de los límites de cartera contra el simulador: matriz de correlación completa (una
+# vez por ciclo) y limitar() para cada símbolo, con 500 símbolos y 200 posiciones abiertas
+
+N_SIMBOLOS = 500
+N_POSICIONES = 200
+
+
+@pytest.fixture(scope="module")
+def cartera(mt5, tmp_path_factory):
+    divisas = ['EUR', 'USD', 'GBP', 'JPY', 'AUD', 'NZD', 'CAD', 'CHF']
+    pares = [a + b for a in divisas for b in divisas if a != b]
+    simbolos = [f"{pares[i % len(pares)]}.{i}" for i in range(N_SIMBOLOS)]
+    mercado = simulador.crear_simulador(simbolos, n_barras=mt5.correlation_window + 2,
+                                        historico=mt5.correlation_window + 2, niveles=0, balance=1e9)
+    rng = mt5.np.random.default_rng(0)
+    with pytest.MonkeyPatch.context() as monkeypatch, simulador.entorno_simulado(mercado, mercado.reloj):
+        riesgo = mt5.RiesgoCartera(str(tmp_path_factory.mktemp("riesgo") / "estado_riesgo.json"), mt5.correlation_window)
+        monkeypatch.setattr(mt5, "riesgo", riesgo)
+        monkeypatch.setattr(mt5, "max_currency_exposure", 3.0)
+        monkeypatch.setattr(mt5, "max_correlated_risk", 0.05)
+        for symbol in simbolos:
+            df = mt5.pd.DataFrame(mercado.rates[symbol])
+            df['time'] = mt5.pd.to_datetime(df['time'], unit='s')
+            riesgo.observar(symbol, df.set_index('time'))
+        for symbol in rng.choice(simbolos, N_POSICIONES):
+            bid, ask = mercado._cotizacion(symbol)
+            compra = rng.random() < 0.5
+            mercado.order_send({"action": mercado.TRADE_ACTION_DEAL, "symbol": symbol, "volume": 0.1,
+                                "type": mercado.ORDER_TYPE_BUY if compra else mercado.ORDER_TYPE_SELL,
+                                "price": ask if compra else bid, "sl": bid - 0.002 if compra else ask + 0.002,
+                                "type_filling": mercado.ORDER_FILLING_IOC})
+        mt5.renovar_instantanea()
+        yield riesgo, simbolos
+
+
+def test_matriz_correlacion(medir, cartera):
+    riesgo, simbolos = cartera
+    assert medir(riesgo.matriz_correlacion) is not None
+
+
+def test_limitar(medir, cartera):
+    riesgo, simbolos = cartera
+    riesgo.matriz_correlacion()
+    medir(lambda: [riesgo.limitar(symbol, 2, 1.0, 0.001) for symbol in simbolos])
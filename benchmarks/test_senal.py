@@ -0,0 +1,54 @@
+import pytest
+
+import simulador
+
+# Camino completo de señal y orden con 150 y 10.000 velas sintéticas o grabadas (--historico), y un
+# ciclo de trading_job con 120 símbolos contra SimuladorMercado
+
+ESTRATEGIAS = ("rsi_bollinger", "vwap_bollinger")
+N_SIMBOLOS = 120
+
+
+@pytest.mark.parametrize("strategy", ESTRATEGIAS)
+def test_analyze(entorno, medir, configs, velas, strategy):
+    analizar = getattr(entorno, f"analyze_{strategy}")
+    assert medir(lambda: analizar(velas, configs[strategy])) is not None
+
+
+def test_vwap_signal(entorno, medir, configs, velas):
+    con_vwap = entorno.analyze_vwap_bollinger(velas, configs['vwap_bollinger'])
+    assert medir(lambda: entorno.vwap_signal(con_vwap, configs['vwap_bollinger'])) is not None
+
+
+def test_calculate_rsi_signal_windowed(entorno, medir, configs, velas):
+    con_rsi = entorno.analyze_rsi_bollinger(velas, configs['rsi_bollinger'])
+    assert medir(lambda: entorno.calculate_rsi_signal_windowed(con_rsi.RSI, configs['rsi_bollinger'])) is not None
+
+
+@pytest.mark.parametrize("strategy", ESTRATEGIAS)
+def test_process(entorno, medir, configs, velas, strategy):
+    assert medir(lambda: entorno.process(velas, "BENCH", config=configs[strategy])) is not None
+
+
+def test_calcular_parametros_trading(entorno, medir, configs, velas, monkeypatch):
+    procesado = entorno.process(velas, "BENCH", config=configs['rsi_bollinger'])
+    mercado = simulador.crear_simulador(["BENCH"], n_barras=300, niveles=0)
+    monkeypatch.setattr(entorno, "symbol_config", {"BENCH": configs['rsi_bollinger']})
+    with simulador.entorno_simulado(mercado, mercado.reloj):
+        entorno.renovar_instantanea()
+        medir(lambda: entorno.calcular_parametros_trading("BENCH", procesado))
+
+
+def test_trading_job(entorno, medir, monkeypatch):
+    # Un ciclo completo (descarga, indicadores, señales, tamaño, límites de cartera y órdenes) por
+    # vela nueva; los símbolos reparten las estrategias de configmt5.json
+    simbolos = [f"BENCH{i}" for i in range(N_SIMBOLOS)]
+    plantillas = list(entorno.symbol_config.values())
+    monkeypatch.setattr(entorno, "symbol_config", {symbol: plantillas[i % len(plantillas)] for i, symbol in enumerate(simbolos)})
+    mercado = simulador.crear_simulador(simbolos, n_barras=1100, historico=500, niveles=0, balance=1e9)
+
+    def ciclo():
+        entorno.trading_job()
+        mercado.avanzar()
+    with simulador.entorno_simulado(mercado, mercado.reloj):
+        medir(ciclo, rondas=5)
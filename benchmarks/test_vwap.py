@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import simulador
+
+# vwap_signal_engine (vectorizado) frente al bucle original, que se conserva aquí como referencia.
+# El bucle es O(n·backcandles) y con 1M de velas tarda minutos: solo se mide hasta 10.000.
+
+BACKCANDLES = 15
+
+
+def vwap_signal_bucle(df, backcandles):
+    VWAPsignal = [0] * len(df)
+    for row in range(backcandles, len(df)):
+        upt = 1
+        dnt = 1
+        for i in range(row-backcandles, row+1):
+            if max(df.open.iloc[i], df.close.iloc[i]) >= df.VWAP.iloc[i]:
+                dnt = 0
+            if min(df.open.iloc[i], df.close.iloc[i]) <= df.VWAP.iloc[i]:
+                upt = 0
+        if upt == 1 and dnt == 1:
+            VWAPsignal[row] = 3
+        elif upt == 1:
+            VWAPsignal[row] = 2
+        elif dnt == 1:
+            VWAPsignal[row] = 1
+    return VWAPsignal
+
+
+def con_vwap(mt5, n):
+    df = simulador.generar_datos_sinteticos(n)
+    df['VWAP'] = ((df.high + df.low + df.close) / 3).rolling(BACKCANDLES, min_periods=1).mean()
+    return df
+
+
+@pytest.mark.parametrize("n", [150, 10_000, 1_000_000])
+def test_vectorizado(mt5, medir, n):
+    df = con_vwap(mt5, n)
+    senal = medir(lambda: mt5.vwap_signal_engine(df.open.to_numpy(), df.close.to_numpy(), df.VWAP.to_numpy(), BACKCANDLES))
+    muestra = df.iloc[:2000]
+    assert np.array_equal(np.asarray(vwap_signal_bucle(muestra, BACKCANDLES), dtype=np.int64), senal[:len(muestra)])
+
+
+@pytest.mark.parametrize("n", [150, 10_000])
+def test_bucle_original(mt5, medir, n):
+    df = con_vwap(mt5, n)
+    medir(lambda: vwap_signal_bucle(df, BACKCANDLES), rondas=3)
@@ -0,0 +1,43 @@
+import os
+import shutil
+import sys
+import tempfile
+import importlib
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+
+
+def pytest_addoption(parser):
+    parser.addoption("--historico", default=None,
+                     help="CSV, Parquet o .bin con velas grabadas (formato de cargar_historico) para los casos 'grabadas'")
+
+
+@pytest.fixture(scope="session")
+def mt5():
+    # MT5.inicializar() lee configmt5.json del directorio actual y escribe logs/ y journal/ ahí: se
+    # inicializa desde un directorio temporal con una copia de la configuración del repositorio.
+    # El terminal no hace falta; el módulo MetaTrader5 solo se importa en la primera llamada. Lo
+    # comparten tests/ y benchmarks/.
+    directorio_original = os.getcwd()
+    directorio = tempfile.mkdtemp(prefix="mt5_tests_")
+    shutil.copy(os.path.join(RAIZ, "configmt5.json"), directorio)
+    os.chdir(directorio)
+    sys.path.insert(0, RAIZ)
+    try:
+        modulo = importlib.import_module("MT5")
+        modulo.inicializar()
+        yield modulo
+    finally:
+        os.chdir(directorio_original)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def velas_grabadas(request, mt5):
+    # La ruta se resuelve desde donde se lanzó pytest: el fixture mt5 cambia de directorio
+    ruta = request.config.getoption("--historico")
+    if ruta is None:
+        pytest.skip("sin --historico no hay velas grabadas")
+    return mt5.cargar_historico(os.path.join(str(request.config.invocation_params.dir), ruta))
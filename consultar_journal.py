@@ -0,0 +1,17 @@
+import sys
+
+import MT5
+
+# python consultar_journal.py senales EURUSD 2024-05-01 "2024-05-31 23:59"  ("*" para todos los símbolos)
+# Lee el journal de journal_directory (configmt5.json) sin conectar con el terminal
+
+
+def consultar_journal(tabla, symbol=None, desde=None, hasta=None):
+    return MT5.journal.consultar(tabla, None if symbol in (None, "*") else symbol, desde, hasta)
+
+
+if __name__ == "__main__":
+    MT5.inicializar()
+    df = consultar_journal(*sys.argv[1:5])
+    print(df.to_string(max_rows=60))
+    print(f"{len(df)} filas")
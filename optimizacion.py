@@ -0,0 +1,403 @@
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import as_completed
+
+import numpy as np
+import pandas as pd
+
+import MT5
+import backtest
+
+# Herramientas fuera de línea sobre el histórico: optimización de parámetros, walk-forward y Monte
+# Carlo. No conectan con el terminal; los pools de procesos inicializan MT5 en cada worker
+# (MT5.inicializar_worker).
+#   python optimizacion.py --optimize AUDNZD.csv [muestras]
+#   python optimizacion.py --walk-forward AUDNZD.csv [entrenamiento] [prueba] [muestras]
+
+# ---------------------------------------------------------------------------
+# Optimización de parámetros de symbol_config (grid o búsqueda aleatoria) en paralelo
+# ---------------------------------------------------------------------------
+
+ESPACIO_PARAMETROS = {
+    'slatrcoef': [1.5, 2.0, 2.5, 3.0, 3.5, 4.0],
+    'TPSLRatio_coef': [0.8, 1.0, 1.2, 1.5, 1.8, 2.0],
+    'rsi_length': [8, 10, 12, 14, 16],
+    'bb_length': [14, 15, 20],
+    'bb_std': [1.5, 2.0, 2.5],
+    'backcandles': [10, 15, 20],
+    'rsi_overbought': [80, 85, 90, 95],
+    'rsi_oversold': [5, 10, 15, 20],
+}
+
+def combinaciones_parametros(config_base, espacio, muestras=None, seed=0):
+    # Todas las combinaciones del grid o, si muestras es menor que el total, una muestra aleatoria
+    # sin repetición. backcandles solo aplica a las estrategias que lo declaran (vwap_bollinger).
+    espacio = {clave: valores for clave, valores in espacio.items()
+               if clave != 'backcandles' or clave in MT5.ESTRATEGIAS[config_base['strategy']].parametros}
+    claves = list(espacio)
+    dimensiones = [len(espacio[clave]) for clave in claves]
+    total = int(np.prod(dimensiones))
+    if muestras is None or muestras >= total:
+        indices = np.arange(total)
+    else:
+        indices = np.sort(np.random.default_rng(seed).choice(total, size=muestras, replace=False))
+    combinaciones = []
+    for posiciones in zip(*np.unravel_index(indices, dimensiones)):
+        config = dict(config_base)
+        config.update({clave: espacio[clave][p] for clave, p in zip(claves, posiciones)})
+        combinaciones.append(config)
+    return claves, combinaciones
+
+def calcular_cache_indicadores(df, combinaciones):
+    # Cada RSI y cada configuración de bandas distinta se calcula una sola vez para todo el barrido
+    base = df[df.high != df.low].copy()
+    columnas = {}
+    for length in sorted({config['rsi_length'] for config in combinaciones}):
+        columnas[f"RSI_{length}"] = MT5.motor_indicadores.rsi(base.close, length=length)
+    for bb_length, bb_std in sorted({MT5.parametros_bollinger(config) for config in combinaciones}):
+        bandas = MT5.motor_indicadores.bbands(base.close, length=bb_length, std=bb_std)
+        for col in bandas.columns:
+            columnas[col] = bandas[col]
+    columnas['ATR'] = MT5.motor_indicadores.atr(base.high, base.low, base.close, length=7)
+    if any(MT5.usa_indicador(config, 'vwap') for config in combinaciones):
+        columnas['VWAP'] = MT5.motor_indicadores.vwap(base.high, base.low, base.close, base.tick_volume)
+    return base, pd.DataFrame(columnas, index=base.index)
+
+def dataframe_desde_cache(base, cache, config):
+    # Mismo resultado que analyze_rsi_bollinger/analyze_vwap_bollinger tomando columnas de la caché
+    df = base.copy()
+    if MT5.usa_indicador(config, 'vwap'):
+        df['VWAP'] = cache['VWAP']
+    df['RSI'] = cache[f"RSI_{config['rsi_length']}"]
+    sufijo = MT5.columnas_bollinger(config)[0][3:]
+    for prefijo in ('BBL', 'BBM', 'BBU', 'BBB', 'BBP'):
+        df[prefijo + sufijo] = cache[prefijo + sufijo]
+    df['ATR'] = cache['ATR']
+    return df.dropna()
+
+# Métricas de informe_backtest que se guardan por combinación
+METRICAS_OPTIMIZACION = ('pnl', 'max_drawdown', 'max_drawdown_pct', 'num_operaciones', 'tasa_acierto', 'profit_factor')
+
+_datos_optimizacion = None
+
+def _inicializar_worker_optimizacion(symbol, base, cache, balance_inicial, marcos=None, ruta_config=None):
+    global _datos_optimizacion
+    MT5.inicializar_worker(ruta_config)
+    _datos_optimizacion = (symbol, base, cache, balance_inicial, marcos)
+    logging.getLogger().setLevel(logging.WARNING)
+
+def _evaluar_combinacion(config):
+    symbol, base, cache, balance_inicial, marcos = _datos_optimizacion
+    df = dataframe_desde_cache(base, cache, config)
+    candidatas = backtest.senales_backtest(symbol, df, config, indicadores_calculados=True, marcos=marcos)
+    informe = backtest.informe_backtest(candidatas, {symbol: config}, balance_inicial, registrar=False)
+    return {clave: informe[clave] for clave in METRICAS_OPTIMIZACION}
+
+def optimizar_parametros(symbol, df, config_base=None, espacio=None, muestras=500, procesos=None,
+                         seed=0, metrica='pnl', min_operaciones=10, balance_inicial=10000.0):
+    config_base = config_base or MT5.symbol_config[symbol]
+    claves, combinaciones = combinaciones_parametros(config_base, espacio or ESPACIO_PARAMETROS, muestras, seed)
+    inicio = time.perf_counter()
+    df, marcos = backtest.marcos_backtest(df, config_base)
+    base, cache = calcular_cache_indicadores(df, combinaciones)
+    logging.info(f"Caché de indicadores para {symbol}: {cache.shape[1]} columnas en {time.perf_counter() - inicio:.2f}s")
+
+    procesos = procesos or os.cpu_count() or 1
+    bloque = max(1, len(combinaciones) // (procesos * 4))
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=procesos, initializer=_inicializar_worker_optimizacion,
+                             initargs=(symbol, base, cache, balance_inicial, marcos, MT5.ruta_configuracion)) as pool:
+        resultados = list(pool.map(_evaluar_combinacion, combinaciones, chunksize=bloque))
+
+    tabla = pd.DataFrame([{**{clave: config[clave] for clave in claves}, **resultado}
+                          for config, resultado in zip(combinaciones, resultados)])
+    tabla['combinacion'] = range(len(tabla))
+    tabla = tabla[tabla.num_operaciones >= min_operaciones].sort_values(metrica, ascending=False).reset_index(drop=True)
+    if tabla.empty:
+        logging.warning(f"Ninguna combinación de {symbol} alcanza {min_operaciones} operaciones")
+        return tabla, None
+    mejor = combinaciones[int(tabla.combinacion.iloc[0])]
+    logging.info(f"Optimización de {symbol}: {len(combinaciones)} combinaciones en {procesos} procesos, "
+                 f"{time.perf_counter() - inicio:.1f}s. Mejor {metrica}: {tabla[metrica].iloc[0]:.2f}")
+    return tabla, {"symbol_config": {symbol: mejor}}
+
+def ejecutar_optimizacion_cli(ruta, muestras=500):
+    ruta, symbol = MT5.separar_ruta_simbolo(ruta)
+    symbol = symbol or os.path.splitext(os.path.basename(ruta))[0]
+    tabla, bloque = optimizar_parametros(symbol, MT5.cargar_historico(ruta), muestras=int(muestras))
+    tabla.to_csv(f"optimizacion_{symbol}.csv", index=False)
+    if bloque is not None:
+        with open(f"optimizacion_{symbol}.json", "w") as f:
+            json.dump(bloque, f, indent=4)
+        logging.info(f"Resultados en optimizacion_{symbol}.csv y configuración en optimizacion_{symbol}.json")
+    return tabla, bloque
+
+# ---------------------------------------------------------------------------
+# Walk-forward y Monte Carlo: robustez fuera de muestra en un pool de procesos
+# ---------------------------------------------------------------------------
+
+class HistoricoCompartido:
+    # Velas en formato RATES_DTYPE dentro de un bloque de multiprocessing.shared_memory. Los workers
+    # se conectan por nombre y solo copian la ventana que evalúan, no el histórico completo.
+    def __init__(self, rates=None, nombre=None, n=None):
+        from multiprocessing import shared_memory
+        self.propietario = rates is not None
+        if self.propietario:
+            self.memoria = shared_memory.SharedMemory(create=True, size=max(1, rates.nbytes))
+            self.rates = np.ndarray(len(rates), dtype=MT5.RATES_DTYPE, buffer=self.memoria.buf)
+            self.rates[:] = rates
+        else:
+            self.memoria = shared_memory.SharedMemory(name=nombre)
+            self.rates = np.ndarray(n, dtype=MT5.RATES_DTYPE, buffer=self.memoria.buf)
+
+    @property
+    def descriptor(self):
+        return self.memoria.name, len(self.rates)
+
+    def ventana(self, inicio, fin):
+        df = pd.DataFrame(self.rates[inicio:fin])
+        df['time'] = pd.to_datetime(df['time'], unit='s')
+        return df.set_index('time')
+
+    def cerrar(self):
+        self.rates = None
+        self.memoria.close()
+        if self.propietario:
+            self.memoria.unlink()
+
+_datos_walk_forward = None
+
+def _inicializar_worker_walk_forward(descriptor, symbol, config_base, combinaciones, balance_inicial, ruta_config=None):
+    global _datos_walk_forward
+    MT5.inicializar_worker(ruta_config)
+    _datos_walk_forward = {'historico': HistoricoCompartido(None, *descriptor), 'symbol': symbol, 'config_base': config_base,
+                           'combinaciones': combinaciones, 'balance_inicial': balance_inicial, 'ventana': None}
+    logging.getLogger().setLevel(logging.WARNING)
+
+def _evaluar_bloque_walk_forward(inicio, fin, indices):
+    # Cada worker calcula la caché de indicadores de la ventana de entrenamiento una vez y evalúa
+    # con ella los bloques de combinaciones que le llegan de esa ventana
+    datos = _datos_walk_forward
+    symbol = datos['symbol']
+    if datos['ventana'] != (inicio, fin):
+        df, marcos = backtest.marcos_backtest(datos['historico'].ventana(inicio, fin), datos['config_base'])
+        datos['base'], datos['cache'] = calcular_cache_indicadores(df, datos['combinaciones'])
+        datos['marcos'], datos['ventana'] = marcos, (inicio, fin)
+    resultados = []
+    for indice in indices:
+        config = datos['combinaciones'][indice]
+        df = dataframe_desde_cache(datos['base'], datos['cache'], config)
+        candidatas = backtest.senales_backtest(symbol, df, config, indicadores_calculados=True, marcos=datos['marcos'])
+        informe = backtest.informe_backtest(candidatas, {symbol: config}, datos['balance_inicial'], registrar=False)
+        resultados.append((indice, {clave: informe[clave] for clave in METRICAS_OPTIMIZACION}))
+    return resultados
+
+def guardar_json_atomico(ruta, datos):
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "w") as f:
+        json.dump(datos, f, default=str)
+    os.replace(temporal, ruta)
+
+def velas_calentamiento(config):
+    # Velas del timeframe base previas a cada ventana de prueba para que los indicadores (y los
+    # filtros de timeframe superior) lleguen calientes: dos buffers del mayor timeframe
+    periodos = [MT5.segundos_timeframe(MT5.timeframe_estrategia(config))] + \
+               [MT5.segundos_timeframe(filtro['timeframe']) for filtro in MT5.filtros_htf(config)]
+    return 2 * MT5.incremental_buffer * max(periodos) // MT5.segundos_timeframe(MT5.timeframe)
+
+def probar_ventana(symbol, df, inicio_prueba, config, balance_inicial=10000.0):
+    # Backtest de la ventana de prueba con calentamiento; solo cuentan las operaciones que entran en ella
+    df_config, marcos = backtest.marcos_backtest(df, config)
+    candidatas = backtest.senales_backtest(symbol, df_config, config, marcos=marcos)
+    candidatas = [op for op in candidatas if op['entrada_tiempo'] >= inicio_prueba]
+    return backtest.informe_backtest(candidatas, {symbol: config}, balance_inicial, registrar=False)
+
+def walk_forward(symbol, df, config_base=None, entrenamiento=20000, prueba=5000, espacio=None, muestras=200,
+                 procesos=None, seed=0, metrica='pnl', min_operaciones=10, balance_inicial=10000.0,
+                 checkpoint=None, guardar_cada=60.0):
+    # Ventanas móviles: optimiza sobre `entrenamiento` velas, prueba el mejor conjunto (y el de
+    # config_base) sobre las `prueba` velas siguientes y avanza `prueba` velas. El histórico va a
+    # memoria compartida y el progreso (ventanas terminadas y combinaciones ya evaluadas de la
+    # ventana en curso) se guarda en `checkpoint` para reanudar con la misma llamada.
+    config_base = config_base or MT5.symbol_config[symbol]
+    claves, combinaciones = combinaciones_parametros(config_base, espacio or ESPACIO_PARAMETROS, muestras, seed)
+    checkpoint = checkpoint or f"walkforward_{symbol}.json"
+    firma = {'symbol': symbol, 'velas': len(df), 'desde': str(df.index[0]), 'hasta': str(df.index[-1]),
+             'entrenamiento': entrenamiento, 'prueba': prueba, 'muestras': muestras, 'seed': seed,
+             'metrica': metrica, 'min_operaciones': min_operaciones, 'config_base': config_base,
+             'espacio': espacio or ESPACIO_PARAMETROS}
+    firma = json.loads(json.dumps(firma, default=str))
+    estado = {'firma': firma, 'ventanas': {}, 'parciales': {}}
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            guardado = json.load(f)
+        if guardado.get('firma') == firma:
+            estado = guardado
+            logging.info(f"Reanudando walk-forward de {symbol} desde {checkpoint}: {len(estado['ventanas'])} ventanas terminadas")
+        else:
+            logging.warning(f"{checkpoint} corresponde a otra ejecución (datos o parámetros distintos); se empieza de cero")
+
+    calentamiento = velas_calentamiento(config_base)
+    ventanas = [(inicio, inicio + entrenamiento, min(inicio + entrenamiento + prueba, len(df)))
+                for inicio in range(0, len(df) - entrenamiento - prueba + 1, prueba)]
+    if not ventanas:
+        raise ValueError(f"Histórico de {len(df)} velas insuficiente para entrenamiento {entrenamiento} + prueba {prueba}")
+    procesos = procesos or os.cpu_count() or 1
+    historico = HistoricoCompartido(MT5.rates_desde_dataframe(df))
+    inicio_total = time.perf_counter()
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=procesos, initializer=_inicializar_worker_walk_forward,
+                                 initargs=(historico.descriptor, symbol, config_base, combinaciones, balance_inicial,
+                                           MT5.ruta_configuracion)) as pool:
+            for numero, (inicio, fin_entrenamiento, fin_prueba) in enumerate(ventanas):
+                clave = str(numero)
+                if clave in estado['ventanas']:
+                    continue
+                comienzo = time.perf_counter()
+                evaluadas = {int(i): m for i, m in estado['parciales'].get(clave, {}).items()}
+                pendientes = [i for i in range(len(combinaciones)) if i not in evaluadas]
+                bloque = max(1, len(pendientes) // (procesos * 4))
+                futuros = [pool.submit(_evaluar_bloque_walk_forward, inicio, fin_entrenamiento, pendientes[k:k + bloque])
+                           for k in range(0, len(pendientes), bloque)]
+                guardado = time.monotonic()
+                for futuro in as_completed(futuros):
+                    evaluadas.update(futuro.result())
+                    if time.monotonic() - guardado >= guardar_cada:
+                        estado['parciales'][clave] = evaluadas
+                        guardar_json_atomico(checkpoint, estado)
+                        guardado = time.monotonic()
+
+                validas = [i for i in sorted(evaluadas) if evaluadas[i]['num_operaciones'] >= min_operaciones]
+                if validas:
+                    mejor = max(validas, key=lambda i: evaluadas[i][metrica])
+                    config_mejor = combinaciones[mejor]
+                else:
+                    logging.warning(f"Ventana {numero} de {symbol}: ninguna combinación alcanza {min_operaciones} operaciones, se prueba config_base")
+                    mejor, config_mejor = None, config_base
+                tramo = df.iloc[max(0, fin_entrenamiento - calentamiento):fin_prueba]
+                inicio_prueba = df.index[fin_entrenamiento]
+                informe = probar_ventana(symbol, tramo, inicio_prueba, config_mejor, balance_inicial)
+                informe_base = probar_ventana(symbol, tramo, inicio_prueba, config_base, balance_inicial)
+                operaciones = informe['operaciones']
+                estado['ventanas'][clave] = {
+                    'entrenamiento': [str(df.index[inicio]), str(df.index[fin_entrenamiento - 1])],
+                    'prueba': [str(inicio_prueba), str(df.index[fin_prueba - 1])],
+                    'combinacion': mejor,
+                    'parametros': {c: config_mejor[c] for c in claves if c in config_mejor},
+                    'entrenamiento_metricas': evaluadas[mejor] if mejor is not None else None,
+                    'prueba_metricas': {c: informe[c] for c in METRICAS_OPTIMIZACION},
+                    'base_metricas': {c: informe_base[c] for c in METRICAS_OPTIMIZACION},
+                    # (salida en segundos epoch, resultado / balance al abrir) para el Monte Carlo
+                    'operaciones': [] if operaciones.empty else list(zip(
+                        ((operaciones.salida_tiempo - pd.Timestamp(0)) // pd.Timedelta(seconds=1)).tolist(),
+                        (operaciones.pnl / operaciones.balance).tolist())),
+                }
+                estado['parciales'].pop(clave, None)
+                guardar_json_atomico(checkpoint, estado)
+                logging.info(f"Ventana {numero + 1}/{len(ventanas)} de {symbol} en {time.perf_counter() - comienzo:.1f}s: "
+                             f"{metrica} en prueba {informe[metrica]:.2f} (config_base {informe_base[metrica]:.2f})")
+    finally:
+        historico.cerrar()
+
+    tabla = pd.DataFrame([{'ventana': int(clave), 'entrenamiento_desde': v['entrenamiento'][0],
+                           'prueba_desde': v['prueba'][0], 'prueba_hasta': v['prueba'][1], **v['parametros'],
+                           **{f"prueba_{c}": v['prueba_metricas'][c] for c in METRICAS_OPTIMIZACION},
+                           **{f"base_{c}": v['base_metricas'][c] for c in METRICAS_OPTIMIZACION}}
+                          for clave, v in sorted(estado['ventanas'].items(), key=lambda e: int(e[0]))])
+    operaciones = np.array([op for clave in sorted(estado['ventanas'], key=int) for op in estado['ventanas'][clave]['operaciones']],
+                           dtype=np.float64).reshape(-1, 2)
+    logging.warning(f"Walk-forward de {symbol}: {len(tabla)} ventanas en {time.perf_counter() - inicio_total:.1f}s, "
+                    f"{metrica} fuera de muestra {tabla[f'prueba_{metrica}'].sum():.2f} con parámetros reoptimizados y "
+                    f"{tabla[f'base_{metrica}'].sum():.2f} con config_base; ventanas positivas "
+                    f"{(tabla[f'prueba_{metrica}'] > 0).mean():.0%} / {(tabla[f'base_{metrica}'] > 0).mean():.0%}")
+    return tabla, operaciones
+
+def dias_desde_operaciones(operaciones):
+    # operaciones: (salida epoch, resultado / balance al abrir). Por día hábil: rendimiento del día y
+    # peor caída desde el equity al inicio del día, compuesta operación a operación (0 sin operaciones)
+    if len(operaciones) == 0:
+        return np.zeros(0), np.zeros(0)
+    orden = np.argsort(operaciones[:, 0], kind='stable')
+    tiempos = pd.to_datetime(operaciones[orden, 0], unit='s')
+    rendimientos = operaciones[orden, 1]
+    dias = tiempos.normalize()
+    rendimiento_dia, caida_dia = {}, {}
+    for dia, valores in pd.Series(rendimientos, index=dias).groupby(level=0):
+        camino = np.cumprod(1.0 + valores.to_numpy())
+        rendimiento_dia[dia] = camino[-1] - 1.0
+        caida_dia[dia] = max(0.0, 1.0 - camino.min())
+    calendario = pd.bdate_range(dias.min(), dias.max())
+    return (pd.Series(rendimiento_dia).reindex(calendario, fill_value=0.0).to_numpy(),
+            pd.Series(caida_dia).reindex(calendario, fill_value=0.0).to_numpy())
+
+def _simular_montecarlo(rendimientos, caidas, dias, simulaciones, seed, limite):
+    # Remuestreo de días completos con reemplazo. Devuelve por simulación la caída máxima (fracción
+    # sobre el máximo previo, incluida la intradía), los días que alcanzan `limite` (% desde el
+    # inicio del día) y el rendimiento final.
+    rng = np.random.default_rng(seed)
+    muestra = rng.integers(0, len(rendimientos), size=(simulaciones, dias))
+    equity = np.cumprod(1.0 + rendimientos[muestra], axis=1)
+    inicio_dia = np.hstack((np.ones((simulaciones, 1)), equity[:, :-1]))
+    maximo = np.maximum.accumulate(inicio_dia, axis=1)
+    minimo_dia = np.minimum(inicio_dia * (1.0 - caidas[muestra]), equity)
+    caida_maxima = (1.0 - minimo_dia / maximo).max(axis=1)
+    dias_limite = (caidas[muestra] * 100 >= limite).sum(axis=1)
+    return caida_maxima, dias_limite, equity[:, -1] - 1.0
+
+def monte_carlo(operaciones, simulaciones=10000, dias=252, procesos=None, seed=0, limite=None):
+    # Distribución de la caída máxima y del número de días que tocan max_daily_loss en un horizonte
+    # de `dias`, remuestreando los días de las operaciones fuera de muestra. Las simulaciones se
+    # reparten en bloques entre los procesos, cada uno con su semilla derivada de `seed`.
+    limite = MT5.max_daily_loss if limite is None else limite
+    rendimientos, caidas = dias_desde_operaciones(np.asarray(operaciones, dtype=np.float64).reshape(-1, 2))
+    if len(rendimientos) == 0:
+        logging.warning("Monte Carlo sin operaciones")
+        return None
+    procesos = procesos or os.cpu_count() or 1
+    bloques = [len(b) for b in np.array_split(np.arange(simulaciones), procesos) if len(b)]
+    semillas = np.random.SeedSequence(seed).spawn(len(bloques))
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        partes = list(pool.map(_simular_montecarlo, *zip(*[(rendimientos, caidas, dias, n, s, limite)
+                                                          for n, s in zip(bloques, semillas)])))
+    caida_maxima, dias_limite, final = (np.concatenate(p) for p in zip(*partes))
+    resumen = {
+        'dias_historicos': len(rendimientos),
+        'caida_maxima_p50': float(np.percentile(caida_maxima, 50) * 100),
+        'caida_maxima_p95': float(np.percentile(caida_maxima, 95) * 100),
+        'caida_maxima_p99': float(np.percentile(caida_maxima, 99) * 100),
+        'prob_dia_limite': float((dias_limite > 0).mean()),
+        'dias_limite_medio': float(dias_limite.mean()),
+        'rendimiento_p5': float(np.percentile(final, 5) * 100),
+        'rendimiento_p50': float(np.percentile(final, 50) * 100),
+    }
+    logging.warning(f"Monte Carlo ({simulaciones} simulaciones de {dias} días sobre {len(rendimientos)} días históricos): "
+                    f"caída máxima p50/p95/p99 {resumen['caida_maxima_p50']:.2f}/{resumen['caida_maxima_p95']:.2f}/"
+                    f"{resumen['caida_maxima_p99']:.2f}%, probabilidad de tocar max_daily_loss ({limite}%) "
+                    f"{resumen['prob_dia_limite']:.1%} ({resumen['dias_limite_medio']:.2f} días de media), "
+                    f"rendimiento p5/p50 {resumen['rendimiento_p5']:.1f}/{resumen['rendimiento_p50']:.1f}%")
+    return resumen
+
+def ejecutar_walk_forward_cli(ruta, entrenamiento=20000, prueba=5000, muestras=200):
+    ruta, symbol = MT5.separar_ruta_simbolo(ruta)
+    symbol = symbol or os.path.splitext(os.path.basename(ruta))[0]
+    tabla, operaciones = walk_forward(symbol, MT5.cargar_historico(ruta), entrenamiento=int(entrenamiento),
+                                      prueba=int(prueba), muestras=int(muestras))
+    tabla.to_csv(f"walkforward_{symbol}.csv", index=False)
+    resumen = monte_carlo(operaciones)
+    if resumen is not None:
+        with open(f"montecarlo_{symbol}.json", "w") as f:
+            json.dump(resumen, f, indent=4)
+    logging.info(f"Resultados en walkforward_{symbol}.csv, montecarlo_{symbol}.json y el checkpoint walkforward_{symbol}.json")
+    return tabla, resumen
+
+if __name__ == "__main__":
+    MT5.inicializar()
+    if len(sys.argv) > 1 and sys.argv[1] == "--optimize":
+        ejecutar_optimizacion_cli(*sys.argv[2:4])
+    elif len(sys.argv) > 1 and sys.argv[1] == "--walk-forward":
+        ejecutar_walk_forward_cli(*sys.argv[2:6])
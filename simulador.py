@@ -0,0 +1,533 @@
+import logging
+import math
+import os
+import sys
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytz
+
+import MT5
+
+# Sustitutos del terminal para probar sin conexión: velas grabadas (MT5Grabado), un mercado en
+# memoria con posiciones, libro y ejecución parcial (SimuladorMercado, broker "simulador") y la
+# reproducción de ticks grabados (CSV o Parquet) contra el modo streaming con un reloj acelerado.
+#   python simulador.py EURUSD_ticks.csv[:EURUSD] [AUDNZD_ticks.csv ...] [velocidad]
+
+# ---------------------------------------------------------------------------
+# Mercado simulado
+# ---------------------------------------------------------------------------
+
+# Formato de los arrays que devuelven mt5.copy_ticks_* (lista de campos, como MT5.RATES_DTYPE)
+TICKS_DTYPE = [('time', '<i8'), ('bid', '<f8'), ('ask', '<f8'), ('last', '<f8'), ('volume', '<u8'),
+               ('time_msc', '<i8'), ('flags', '<u4'), ('volume_real', '<f8')]
+TickGrabado = namedtuple('TickGrabado', [campo for campo, _ in TICKS_DTYPE])
+
+def generar_datos_sinteticos(n_barras, seed=0):
+    # Serie OHLC aleatoria (paseo aleatorio) con el mismo formato que obtener_datos_ohlc
+    rng = np.random.default_rng(seed)
+    close = 1.1 + np.cumsum(rng.normal(0, 0.0002, n_barras))
+    open_ = np.concatenate(([close[0]], close[:-1]))
+    amplitud = np.abs(rng.normal(0, 0.0003, n_barras))
+    df = pd.DataFrame({
+        'open': open_,
+        'high': np.maximum(open_, close) + amplitud,
+        'low': np.minimum(open_, close) - amplitud,
+        'close': close,
+        'tick_volume': rng.integers(50, 500, n_barras),
+        'spread': rng.integers(0, 20, n_barras),
+        'real_volume': np.zeros(n_barras, dtype=np.int64),
+    }, index=pd.date_range("2020-01-01", periods=n_barras, freq="5min", name="time"))
+    return df
+
+CuentaGrabada = namedtuple('CuentaGrabada', ['balance', 'equity', 'margin_mode'],
+                           defaults=[MT5.PasarelaBroker.ACCOUNT_MARGIN_MODE_RETAIL_HEDGING])
+SimboloGrabado = namedtuple('SimboloGrabado', ['bid', 'ask', 'point', 'trade_tick_size', 'trade_tick_value',
+                                               'trade_contract_size', 'volume_min', 'volume_max', 'volume_step',
+                                               'currency_base', 'currency_profit'],
+                            defaults=[0.00001, None, None, None, None, None, None, None, None])
+ResultadoGrabado = namedtuple('ResultadoGrabado', ['retcode', 'comment', 'order', 'volume', 'price'])
+
+class MT5Grabado(MT5.PasarelaBroker):
+    # Sustituto mínimo del módulo MetaTrader5 que sirve velas grabadas hasta tiempo_actual. Acepta
+    # órdenes (siempre TRADE_RETCODE_DONE) pero no lleva posiciones ni libro de órdenes.
+    def __init__(self, rates_por_simbolo, balance=10000.0, punto=0.00001):
+        self.rates = rates_por_simbolo
+        self.tiempo_actual = max(int(r['time'][-1]) for r in rates_por_simbolo.values())
+        self.llamadas = 0
+        self.velas_servidas = 0
+        self.balance = balance
+        self.punto = punto
+        self.ordenes = []
+
+    def initialize(self, **kwargs):
+        return True
+
+    def shutdown(self):
+        pass
+
+    def last_error(self):
+        return (1, 'Success')
+
+    def terminal_info(self):
+        return True
+
+    def copy_ticks_from(self, symbol, desde, cantidad, flags):
+        # Sin ticks grabados: vacío, como el terminal cuando no hay ticks en el rango
+        return np.zeros(0, dtype=TICKS_DTYPE)
+
+    def copy_rates_range(self, symbol, timeframe, desde, hasta):
+        self.llamadas += 1
+        rates = self.rates[symbol]
+        hasta = min(int(hasta.timestamp()), self.tiempo_actual)
+        resultado = rates[(rates['time'] >= int(desde.timestamp())) & (rates['time'] <= hasta)]
+        self.velas_servidas += len(resultado)
+        return resultado
+
+    def _ultima_vela(self, symbol):
+        rates = self.rates[symbol]
+        return rates[max(0, np.searchsorted(rates['time'], self.tiempo_actual, side='right') - 1)]
+
+    def account_info(self):
+        return CuentaGrabada(self.balance, self.balance)
+
+    def symbol_info(self, symbol):
+        vela = self._ultima_vela(symbol)
+        return SimboloGrabado(float(vela['close']), float(vela['close']) + int(vela['spread']) * self.punto, self.punto)
+
+    def symbol_info_tick(self, symbol):
+        return self.symbol_info(symbol)
+
+    def market_book_add(self, symbol):
+        return True
+
+    def market_book_get(self, symbol):
+        return None
+
+    def market_book_release(self, symbol):
+        return True
+
+    def positions_get(self, symbol=None):
+        return ()
+
+    def order_send(self, request):
+        self.ordenes.append(request)
+        return ResultadoGrabado(self.TRADE_RETCODE_DONE, 'Request executed', len(self.ordenes),
+                                request['volume'], request['price'])
+
+    def reloj(self):
+        # obtener_datos_ohlc suma 3 horas a get_now(); se compensa para que "ahora" sea tiempo_actual
+        return datetime.fromtimestamp(self.tiempo_actual, tz=pytz.utc) - timedelta(hours=3)
+
+@contextmanager
+def entorno_simulado(mt5_falso, reloj=None):
+    # Sustituye temporalmente el módulo mt5 (y opcionalmente el reloj) usado por todo el script
+    mt5_original, get_now_original = MT5.mt5, MT5.get_now
+    MT5.mt5 = mt5_falso
+    if reloj is not None:
+        MT5.get_now = reloj
+    MT5.instantanea.invalidar()
+    MT5.profundidad.__init__()
+    try:
+        yield mt5_falso
+    finally:
+        MT5.mt5, MT5.get_now = mt5_original, get_now_original
+        MT5.instantanea.invalidar()
+        MT5.profundidad.__init__()
+
+PosicionSimulada = namedtuple('PosicionSimulada', ['ticket', 'symbol', 'type', 'volume', 'price_open', 'sl', 'tp',
+                                                   'magic', 'profit'])
+NivelLibro = namedtuple('NivelLibro', ['type', 'price', 'volume', 'volume_dbl'])
+
+class SimuladorMercado(MT5Grabado):
+    # Mercado en memoria sobre velas grabadas o sintéticas, para pruebas de carga y CI:
+    # - cotiza al cierre de la vela actual con su spread (o `spread` fijo, en puntos);
+    # - ofrece un libro de `niveles` precios por lado con `volumen_nivel` lotes cada uno (0 niveles: sin libro);
+    # - ejecuta órdenes de mercado recorriendo el libro: con ORDER_FILLING_IOC se ejecuta lo disponible
+    #   (TRADE_RETCODE_DONE_PARTIAL) y con FOK se rechaza si no hay bastante;
+    # - lleva posiciones, SL/TP, margen y balance, e inyecta retcodes con las probabilidades de `fallos`.
+    # La latencia de cada orden se acumula en latencia_acumulada (o se duerme, con dormir=True). Sin
+    # velocidad el reloj avanza con avanzar(); con velocidad sigue al reloj real multiplicado.
+    COMENTARIOS = {10004: 'Requote', 10006: 'Request rejected', 10009: 'Request executed',
+                   10010: 'Request executed partially', 10014: 'Invalid volume', 10016: 'Invalid stops',
+                   10018: 'Market is closed', 10019: 'No money', 10021: 'No prices'}
+
+    def __init__(self, rates_por_simbolo, balance=10000.0, punto=0.00001, spread=None, niveles=3,
+                 volumen_nivel=5.0, latencia=0.0, dormir=False, fallos=None, apalancamiento=100.0,
+                 tamano_contrato=100000.0, periodo=300, velocidad=None, seed=0):
+        self.velocidad = velocidad
+        super().__init__(rates_por_simbolo, balance, punto)
+        self.spread = spread
+        self.niveles = niveles
+        self.volumen_nivel = volumen_nivel
+        self.latencia = latencia
+        self.dormir = dormir
+        self.fallos = dict(fallos or {})
+        self.apalancamiento = apalancamiento
+        self.tamano_contrato = tamano_contrato
+        self.periodo = periodo
+        self.rng = np.random.default_rng(seed)
+        self.posiciones = {}
+        self.siguiente_ticket = 1
+        self.retcodes = {}
+        self.latencia_acumulada = 0.0
+        self.revisado_hasta = self.tiempo_actual
+
+    @property
+    def tiempo_actual(self):
+        if self.velocidad is None:
+            return self._tiempo
+        return int(self._tiempo + (time.monotonic() - self._arranque) * self.velocidad)
+
+    @tiempo_actual.setter
+    def tiempo_actual(self, valor):
+        self._tiempo = int(valor)
+        self._arranque = time.monotonic()
+
+    def avanzar(self, velas=1):
+        self.tiempo_actual = self.tiempo_actual + velas * self.periodo
+        self._revisar_stops()
+
+    def _cotizacion(self, symbol):
+        vela = self._ultima_vela(symbol)
+        bid = float(vela['close'])
+        spread = self.spread if self.spread is not None else int(vela['spread'])
+        return bid, bid + spread * self.punto
+
+    def symbol_info(self, symbol):
+        # El beneficio se liquida en la divisa cotizada, que hace de divisa de la cuenta
+        bid, ask = self._cotizacion(symbol)
+        return SimboloGrabado(bid, ask, self.punto, self.punto, self.punto * self.tamano_contrato, self.tamano_contrato,
+                              0.01, 100.0, 0.01, symbol[:3], symbol[3:6])
+
+    def symbol_info_tick(self, symbol):
+        bid, ask = self._cotizacion(symbol)
+        ahora = self.tiempo_actual
+        return TickGrabado(ahora, bid, ask, 0.0, 0, ahora * 1000, 0, 0.0)
+
+    def market_book_get(self, symbol):
+        if not self.niveles:
+            return None
+        bid, ask = self._cotizacion(symbol)
+        return tuple([NivelLibro(self.BOOK_TYPE_SELL, ask + k * self.punto, self.volumen_nivel, self.volumen_nivel)
+                      for k in range(self.niveles)] +
+                     [NivelLibro(self.BOOK_TYPE_BUY, bid - k * self.punto, self.volumen_nivel, self.volumen_nivel)
+                      for k in range(self.niveles)])
+
+    def _beneficio(self, posicion, bid, ask):
+        symbol, tipo, volumen, apertura = posicion[:4]
+        salida = bid if tipo == self.POSITION_TYPE_BUY else ask
+        direccion = 1 if tipo == self.POSITION_TYPE_BUY else -1
+        return (salida - apertura) * direccion * volumen * self.tamano_contrato
+
+    def positions_get(self, symbol=None):
+        self._revisar_stops()
+        resultado = []
+        for ticket, posicion in self.posiciones.items():
+            if symbol is None or posicion[0] == symbol:
+                bid, ask = self._cotizacion(posicion[0])
+                resultado.append(PosicionSimulada(ticket, *posicion, self._beneficio(posicion, bid, ask)))
+        return tuple(resultado)
+
+    def account_info(self):
+        self._revisar_stops()
+        flotante = sum(self._beneficio(p, *self._cotizacion(p[0])) for p in self.posiciones.values())
+        return CuentaGrabada(self.balance, self.balance + flotante)
+
+    def _margen_usado(self):
+        return sum(p[2] * self.tamano_contrato * p[3] / self.apalancamiento for p in self.posiciones.values())
+
+    def _cerrar(self, ticket, volumen, precio):
+        posicion = self.posiciones[ticket]
+        direccion = 1 if posicion[1] == self.POSITION_TYPE_BUY else -1
+        self.balance += (precio - posicion[3]) * direccion * volumen * self.tamano_contrato
+        posicion[2] = round(posicion[2] - volumen, 8)
+        if posicion[2] <= 0:
+            del self.posiciones[ticket]
+
+    def _revisar_stops(self):
+        # SL/TP contra las velas transcurridas desde la última revisión (SL primero si ambos se tocan)
+        ahora = self.tiempo_actual
+        if ahora <= self.revisado_hasta:
+            return
+        for ticket, posicion in list(self.posiciones.items()):
+            symbol, tipo, volumen, apertura, sl, tp = posicion[:6]
+            rates = self.rates[symbol]
+            velas = rates[np.searchsorted(rates['time'], self.revisado_hasta, side='right'):
+                          np.searchsorted(rates['time'], ahora, side='right')]
+            for vela in velas:
+                spread = (self.spread if self.spread is not None else int(vela['spread'])) * self.punto
+                if tipo == self.POSITION_TYPE_BUY:
+                    precio = sl if sl and vela['low'] <= sl else (tp if tp and vela['high'] >= tp else None)
+                else:
+                    precio = sl if sl and vela['high'] + spread >= sl else (tp if tp and vela['low'] + spread <= tp else None)
+                if precio is not None:
+                    self._cerrar(ticket, volumen, float(precio))
+                    break
+        self.revisado_hasta = ahora
+
+    def _resultado(self, retcode, orden=0, volumen=0.0, precio=0.0):
+        self.retcodes[retcode] = self.retcodes.get(retcode, 0) + 1
+        return ResultadoGrabado(retcode, self.COMENTARIOS.get(retcode, ''), orden, volumen, precio)
+
+    def order_send(self, request):
+        self._revisar_stops()
+        self.ordenes.append(request)
+        self.latencia_acumulada += self.latencia
+        if self.dormir and self.latencia:
+            time.sleep(self.latencia)
+        if self.fallos:
+            azar = self.rng.random()
+            for retcode, probabilidad in self.fallos.items():
+                if azar < probabilidad:
+                    return self._resultado(int(retcode))
+                azar -= probabilidad
+
+        if request.get('action') == self.TRADE_ACTION_CLOSE_BY:
+            return self._cerrar_por(request.get('position'), request.get('position_by'))
+        symbol = request['symbol']
+        volumen = float(request['volume'])
+        compra = request['type'] == self.ORDER_TYPE_BUY
+        cierre = request.get('position')
+        if not volumen > 0:
+            return self._resultado(self.TRADE_RETCODE_INVALID_VOLUME)
+        if cierre is not None:
+            if cierre not in self.posiciones:
+                return self._resultado(self.TRADE_RETCODE_REJECT)
+            volumen = min(volumen, self.posiciones[cierre][2])
+        bid, ask = self._cotizacion(symbol)
+        if cierre is None:
+            sl, tp = request.get('sl') or 0.0, request.get('tp') or 0.0
+            if compra and ((sl and sl >= bid) or (tp and tp <= ask)) or \
+                    not compra and ((sl and sl <= ask) or (tp and tp >= bid)):
+                return self._resultado(self.TRADE_RETCODE_INVALID_STOPS)
+
+        # Recorre el libro del lado contrario; sin libro la liquidez es ilimitada al mejor precio
+        mejor = ask if compra else bid
+        if self.niveles:
+            niveles = [(mejor + (k if compra else -k) * self.punto, self.volumen_nivel) for k in range(self.niveles)]
+        else:
+            niveles = [(mejor, math.inf)]
+        pendiente, importe = volumen, 0.0
+        for precio, disponible in niveles:
+            parte = min(pendiente, disponible)
+            importe += parte * precio
+            pendiente = round(pendiente - parte, 8)
+            if pendiente <= 0:
+                break
+        ejecutado = round(volumen - pendiente, 8)
+        retcode = self.TRADE_RETCODE_DONE
+        if pendiente > 0:
+            if request.get('type_filling') != self.ORDER_FILLING_IOC or ejecutado <= 0:
+                return self._resultado(self.TRADE_RETCODE_REJECT)
+            retcode = self.TRADE_RETCODE_DONE_PARTIAL
+        precio = importe / ejecutado
+
+        if cierre is not None:
+            self._cerrar(cierre, ejecutado, precio)
+            return self._resultado(retcode, cierre, ejecutado, precio)
+        margen = ejecutado * self.tamano_contrato * precio / self.apalancamiento
+        if margen > self.account_info().equity - self._margen_usado():
+            return self._resultado(self.TRADE_RETCODE_NO_MONEY)
+        ticket = self.siguiente_ticket
+        self.siguiente_ticket += 1
+        self.posiciones[ticket] = [symbol, self.POSITION_TYPE_BUY if compra else self.POSITION_TYPE_SELL,
+                                   ejecutado, precio, request.get('sl') or 0.0, request.get('tp') or 0.0,
+                                   request.get('magic', 0)]
+        return self._resultado(retcode, ticket, ejecutado, precio)
+
+    def _cerrar_por(self, ticket, ticket_opuesto):
+        # Compra contra venta del mismo símbolo: se cierra el volumen menor de ambas al precio de
+        # apertura de la segunda, sin cruzar el spread
+        posicion, opuesta = self.posiciones.get(ticket), self.posiciones.get(ticket_opuesto)
+        if posicion is None or opuesta is None or posicion[0] != opuesta[0] or posicion[1] == opuesta[1]:
+            return self._resultado(self.TRADE_RETCODE_REJECT)
+        volumen = min(posicion[2], opuesta[2])
+        precio = opuesta[3]
+        self._cerrar(ticket, volumen, precio)
+        self._cerrar(ticket_opuesto, volumen, precio)
+        return self._resultado(self.TRADE_RETCODE_DONE, ticket, volumen, precio)
+
+    def resumen(self):
+        cuenta = self.account_info()
+        return {'ordenes': len(self.ordenes), 'retcodes': dict(self.retcodes), 'posiciones': len(self.posiciones),
+                'balance': cuenta.balance, 'equity': cuenta.equity, 'latencia_acumulada': self.latencia_acumulada}
+
+def crear_simulador(simbolos, n_barras=2000, historico=200, **opciones):
+    # Simulador con velas sintéticas por símbolo: `historico` velas antes de ahora (hora del servidor,
+    # como en obtener_datos_ohlc) y el resto por delante. El reloj empieza en la última vela del histórico.
+    periodo = MT5.segundos_timeframe(MT5.timeframe)
+    ahora = int((MT5.get_now() + timedelta(hours=3)).timestamp()) // periodo * periodo
+    rates = {}
+    for i, symbol in enumerate(simbolos):
+        rates[symbol] = MT5.rates_desde_dataframe(generar_datos_sinteticos(n_barras, seed=i))
+        rates[symbol]['time'] = ahora + (np.arange(n_barras) - (historico - 1)) * periodo
+    simulador = SimuladorMercado(rates, periodo=periodo, **opciones)
+    simulador.tiempo_actual = ahora
+    simulador.revisado_hasta = ahora
+    return simulador
+
+# ---------------------------------------------------------------------------
+# Reproducción de ticks grabados
+# ---------------------------------------------------------------------------
+
+def cargar_ticks_grabados(ruta):
+    # CSV o Parquet con las columnas de copy_ticks_* (time_msc, o time en segundos epoch o como fecha)
+    if str(ruta).endswith('.parquet'):
+        df = pd.read_parquet(ruta)
+    else:
+        df = pd.read_csv(ruta)
+    if 'time_msc' not in df:
+        if pd.api.types.is_numeric_dtype(df['time']):
+            df['time_msc'] = (df['time'] * 1000).astype('int64')
+        else:
+            df['time_msc'] = (pd.to_datetime(df['time']) - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1)
+    ticks = np.zeros(len(df), dtype=TICKS_DTYPE)
+    for col in TickGrabado._fields:
+        if col in df and col != 'time':
+            ticks[col] = df[col].to_numpy()
+    ticks['time'] = ticks['time_msc'] // 1000
+    return ticks[np.argsort(ticks['time_msc'], kind='stable')]
+
+def barras_desde_ticks(ticks, periodo, punto=0.00001):
+    # Mismas velas que construye el modo streaming, en una sola pasada
+    agregador = MT5.AgregadorTicks(periodo, punto)
+    barras = []
+    for time_msc, bid, ask, volumen in zip(ticks['time_msc'].tolist(), ticks['bid'].tolist(),
+                                           ticks['ask'].tolist(), ticks['volume'].tolist()):
+        cerrada = agregador.agregar(time_msc, bid, ask, volumen)
+        if cerrada is not None:
+            barras.append(cerrada)
+    if agregador.barra is not None:
+        barras.append(agregador.cerrar())
+    return np.array(barras, dtype=MT5.RATES_DTYPE)
+
+def generar_ticks_sinteticos(rates, ticks_por_vela=20, periodo=300, punto=0.00001, seed=0):
+    # Ticks cuyo bid pasa por la apertura, el máximo, el mínimo y el cierre de cada vela, de modo que
+    # agregarlos reproduce las mismas velas (salvo tick_volume)
+    rng = np.random.default_rng(seed)
+    n, k = len(rates), max(4, ticks_por_vela)
+    filas = np.arange(n)
+    precios = rng.uniform(rates['low'][:, None], rates['high'][:, None], size=(n, k))
+    precios[:, 0] = rates['open']
+    precios[:, -1] = rates['close']
+    pos_maximo = rng.integers(1, k - 1, n)
+    pos_minimo = rng.integers(1, k - 1, n)
+    pos_minimo = np.where(pos_minimo == pos_maximo, pos_maximo % (k - 2) + 1, pos_minimo)
+    precios[filas, pos_maximo] = rates['high']
+    precios[filas, pos_minimo] = rates['low']
+    desplazamientos = np.floor(np.sort(rng.random((n, k)), axis=1) * (periodo * 1000 - k)).astype(np.int64) + np.arange(k)
+    desplazamientos[:, 0] = 0
+    ticks = np.zeros(n * k, dtype=TICKS_DTYPE)
+    ticks['time_msc'] = (rates['time'][:, None] * 1000 + desplazamientos).ravel()
+    ticks['time'] = ticks['time_msc'] // 1000
+    ticks['bid'] = precios.ravel()
+    ticks['ask'] = (precios + rates['spread'][:, None] * punto).ravel()
+    return ticks
+
+class MT5TicksGrabados(MT5Grabado):
+    # Reproduce ticks grabados con un reloj virtual que avanza `velocidad` veces más rápido que el
+    # real desde `inicio`. Las velas del histórico solo se sirven una vez cerradas.
+    def __init__(self, ticks_por_simbolo, rates_por_simbolo, inicio, velocidad=60.0, periodo=300, **kwargs):
+        super().__init__(rates_por_simbolo, **kwargs)
+        self.ticks = ticks_por_simbolo
+        self.inicio = inicio
+        self.velocidad = velocidad
+        self.periodo = periodo
+        self.arranque = time.monotonic()
+        self.tiempo_actual = inicio
+
+    def tiempo_servidor(self):
+        ahora = self.inicio + (time.monotonic() - self.arranque) * self.velocidad
+        self.tiempo_actual = int(ahora)
+        return ahora
+
+    def copy_rates_range(self, symbol, timeframe, desde, hasta):
+        self.llamadas += 1
+        rates = self.rates[symbol]
+        hasta = min(int(hasta.timestamp()), int(self.tiempo_servidor()) - self.periodo)
+        return rates[(rates['time'] >= int(desde.timestamp())) & (rates['time'] <= hasta)]
+
+    def _ultimo_tick(self, symbol):
+        ticks = self.ticks[symbol]
+        i = np.searchsorted(ticks['time_msc'], int(self.tiempo_servidor() * 1000), side='right') - 1
+        return ticks[i] if i >= 0 else None
+
+    def symbol_info_tick(self, symbol):
+        tick = self._ultimo_tick(symbol)
+        return TickGrabado(*tick.tolist()) if tick is not None else None
+
+    def symbol_info(self, symbol):
+        tick = self._ultimo_tick(symbol)
+        if tick is None:
+            return super().symbol_info(symbol)
+        return SimboloGrabado(float(tick['bid']), float(tick['ask']), self.punto)
+
+    def copy_ticks_from(self, symbol, desde, cantidad, flags):
+        ticks = self.ticks[symbol]
+        i = np.searchsorted(ticks['time_msc'], int(round(desde.timestamp() * 1000)), side='left')
+        j = np.searchsorted(ticks['time_msc'], int(self.tiempo_servidor() * 1000), side='right')
+        return ticks[i:min(j, i + cantidad)]
+
+    def reloj(self):
+        self.tiempo_servidor()
+        return super().reloj()
+
+def reproducir_ticks(ticks_por_simbolo, velocidad=600.0, velas_semilla=150, punto=0.00001):
+    # Reproduce ticks grabados a velocidad acelerada contra modo_streaming y comprueba que las velas
+    # cerradas en streaming coinciden con las agregadas de una sola pasada
+    periodo = MT5.segundos_timeframe(MT5.timeframe)
+    rates = {symbol: barras_desde_ticks(ticks, periodo, punto) for symbol, ticks in ticks_por_simbolo.items()}
+    if any(len(r) <= velas_semilla for r in rates.values()):
+        raise ValueError(f"Se necesitan más de {velas_semilla} velas de ticks por símbolo")
+    inicio = max(int(r['time'][velas_semilla]) for r in rates.values())
+    fin = max(int(t['time'][-1]) for t in ticks_por_simbolo.values()) + periodo
+    falso = MT5TicksGrabados(ticks_por_simbolo, rates, inicio, velocidad, periodo, punto=punto)
+    with entorno_simulado(falso, falso.reloj):
+        for symbol in ticks_por_simbolo:
+            MT5.estados_incrementales.pop(symbol, None)
+        latencias = MT5.modo_streaming((fin - inicio) / velocidad + 1, list(ticks_por_simbolo),
+                                   reloj_servidor=falso.tiempo_servidor, respetar_horario=False)
+
+    distintas = 0
+    for symbol, r in rates.items():
+        estado = MT5.estados_incrementales.get(symbol)
+        filas = {fila[0]: fila[:8] for fila in (estado.filas if estado is not None else ())}
+        for vela in r[r['time'] >= inicio]:
+            fila = filas.get(int(vela['time']))
+            if fila is not None and tuple(fila) != tuple(vela.tolist()):
+                distintas += 1
+        retardos = np.array([l[0] for l in latencias[symbol]]) / velocidad * 1000
+        evaluaciones = np.array([l[1] for l in latencias[symbol]]) * 1000
+        if len(retardos):
+            logging.warning(f"Streaming {symbol}: {len(retardos)} velas, retardo desde el cierre p50 "
+                            f"{np.median(retardos):.1f} ms / máx {retardos.max():.1f} ms (tiempo real), "
+                            f"evaluación p50 {np.median(evaluaciones):.1f} ms")
+    logging.warning(f"Reproducción de ticks: {len(falso.ordenes)} órdenes, {distintas} velas distintas de las agregadas")
+    return latencias, distintas
+
+def ejecutar_replay_ticks_cli(argumentos):
+    # Cada ruta es fichero[:SYMBOL]; sin SYMBOL se usa el nombre del fichero hasta el primer _
+    argumentos = list(argumentos)
+    velocidad = 600.0
+    if argumentos and argumentos[-1].replace('.', '', 1).isdigit():
+        velocidad = float(argumentos.pop())
+    ticks = {}
+    for ruta in argumentos:
+        ruta, symbol = MT5.separar_ruta_simbolo(ruta)
+        symbol = symbol or os.path.splitext(os.path.basename(ruta))[0].split('_')[0]
+        ticks[symbol] = cargar_ticks_grabados(ruta)
+    if not ticks:
+        periodo = MT5.segundos_timeframe(MT5.timeframe)
+        for i, symbol in enumerate(MT5.symbol_config):
+            rates = MT5.rates_desde_dataframe(generar_datos_sinteticos(200, seed=i))
+            ticks[symbol] = generar_ticks_sinteticos(rates, periodo=periodo, seed=i)
+    return reproducir_ticks(ticks, velocidad)
+
+if __name__ == "__main__":
+    MT5.inicializar()
+    ejecutar_replay_ticks_cli(sys.argv[1:])
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import simulador
+
+# Modo incremental frente al cálculo completo: se reproducen velas sintéticas (o las grabadas de
+# --historico) ciclo a ciclo con un terminal grabado, y en cada ciclo los indicadores y la señal de
+# obtener_datos_incremental deben coincidir con analyze_* y process() sobre todo el histórico servido
+# desde la semilla. RSI y ATR coinciden bit a bit; la desviación móvil de pandas acumula ~1e-9 de
+# error relativo, de ahí la tolerancia (afecta sobre todo a BBP).
+
+SIMBOLOS = ["EURUSD", "AUDNZD", "USDCAD"]
+SEMILLA = 150
+PASOS = 120
+
+
+@pytest.fixture(params=["sinteticas", "grabadas"])
+def rates(request, mt5):
+    if request.param == "sinteticas":
+        return mt5.rates_desde_dataframe(simulador.generar_datos_sinteticos(SEMILLA + PASOS))
+    return mt5.rates_desde_dataframe(request.getfixturevalue("velas_grabadas"))
+
+
+def dataframe(mt5, rates):
+    df = mt5.pd.DataFrame(rates)
+    df['time'] = mt5.pd.to_datetime(df['time'], unit='s')
+    return df.set_index('time')
+
+
+@pytest.mark.parametrize("symbol", SIMBOLOS)
+def test_modo_incremental_coincide_con_calculo_completo(mt5, rates, symbol):
+    config = mt5.symbol_config[symbol]
+    analizar = mt5.ESTRATEGIAS[config['strategy']].analizar
+    falso = simulador.MT5Grabado({symbol: rates})
+    primer_tiempo = int(rates['time'][SEMILLA]) - SEMILLA * mt5.segundos_timeframe(mt5.timeframe)
+    senales = 0
+    with simulador.entorno_simulado(falso, falso.reloj):
+        mt5.estados_incrementales.pop(symbol, None)
+        try:
+            for i in range(SEMILLA, min(len(rates), SEMILLA + PASOS)):
+                falso.tiempo_actual = int(rates['time'][i])
+                incremental = mt5.obtener_datos_incremental(symbol)
+                df = dataframe(mt5, rates[(rates['time'] >= primer_tiempo) & (rates['time'] <= falso.tiempo_actual)])
+                completo = analizar(df, config)
+                assert incremental is not None and not incremental.empty, f"sin datos incrementales en la vela {i}"
+                comunes = incremental.index.intersection(completo.index)
+                np.testing.assert_allclose(incremental.loc[comunes].to_numpy(dtype=np.float64),
+                                           completo.loc[comunes, incremental.columns].to_numpy(dtype=np.float64),
+                                           rtol=1e-7, atol=1e-8, err_msg=f"indicadores distintos en la vela {i}")
+                senal_incremental = mt5.process(incremental, symbol, indicadores_calculados=True)
+                senal_completa = mt5.process(df, symbol)
+                if senal_incremental is not None and senal_completa is not None:
+                    senales += 1
+                    assert senal_incremental['TotalSignal'].iloc[-1] == senal_completa['TotalSignal'].iloc[-1], \
+                        f"señal distinta en la vela {i}"
+        finally:
+            mt5.estados_incrementales.pop(symbol, None)
+    assert senales > 0
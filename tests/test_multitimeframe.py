@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+import backtest
+import simulador
+
+# Varios marcos temporales: se reproducen velas base sintéticas de M5 (o las grabadas de --historico)
+# ciclo a ciclo con obtener_datos_multitimeframe, y en cada ciclo las velas agregadas en vivo, los
+# indicadores y la señal final deben coincidir con los del backtest (marcos_backtest + analyze_*
+# sobre el mismo histórico). La estrategia va en M15 con un filtro H1 de VWAP o de RSI.
+
+SIMBOLOS = ["EURUSD", "AUDNZD", "USDCAD"]
+PASOS = 120
+
+
+def dataframe(mt5, rates):
+    df = mt5.pd.DataFrame(rates)
+    df['time'] = mt5.pd.to_datetime(df['time'], unit='s')
+    return df.set_index('time')
+
+
+@pytest.fixture(params=["sinteticas", "grabadas"])
+def fuente(request):
+    return request.param
+
+
+@pytest.mark.parametrize("filtro", ["vwap", "rsi"])
+@pytest.mark.parametrize("symbol", SIMBOLOS)
+def test_agregacion_en_vivo_coincide_con_backtest(mt5, monkeypatch, request, fuente, symbol, filtro):
+    config = dict(mt5.symbol_config[symbol], timeframe='M15', htf_filter={'timeframe': 'H1', 'indicator': filtro})
+    monkeypatch.setitem(mt5.symbol_config, symbol, config)
+    analizar = mt5.ESTRATEGIAS[config['strategy']].analizar
+    mayor = mt5.segundos_timeframe(mt5.parsear_timeframe("H1"))
+    semilla = (mt5.incremental_buffer + 1) * mayor // mt5.segundos_timeframe(mt5.timeframe) + 1
+    if fuente == "sinteticas":
+        rates = mt5.rates_desde_dataframe(simulador.generar_datos_sinteticos(semilla + PASOS))
+    else:
+        rates = mt5.rates_desde_dataframe(request.getfixturevalue("velas_grabadas"))
+    falso = simulador.MT5Grabado({symbol: rates})
+    primer_tiempo = int(rates['time'][semilla]) - (mt5.incremental_buffer + 1) * mayor
+    ciclos = 0
+    with simulador.entorno_simulado(falso, falso.reloj):
+        mt5.estados_multitimeframe.pop(symbol, None)
+        try:
+            for i in range(semilla, min(len(rates), semilla + PASOS)):
+                falso.tiempo_actual = int(rates['time'][i])
+                datos = mt5.obtener_datos_multitimeframe(symbol)
+                assert datos is not None, f"sin datos multi-timeframe en la vela {i}"
+                vivo, marcos = datos
+                historico = dataframe(mt5, rates[(rates['time'] >= primer_tiempo) & (rates['time'] <= falso.tiempo_actual)])
+                completo, marcos_completos = backtest.marcos_backtest(historico, config)
+                for tf, marco in list(marcos.items()) + [(None, vivo)]:
+                    referencia = marcos_completos[tf] if tf is not None else completo
+                    comunes = marco.index.intersection(referencia.index)
+                    assert len(comunes) == len(marco), f"velas de {tf or 'M15'} que el backtest no tiene en la vela {i}"
+                    np.testing.assert_array_equal(marco.loc[comunes, mt5.COLUMNAS_OHLC].to_numpy(dtype=np.float64),
+                                                  referencia.loc[comunes, mt5.COLUMNAS_OHLC].to_numpy(dtype=np.float64),
+                                                  err_msg=f"velas de {tf or 'M15'} distintas en la vela {i}")
+                analizado = analizar(completo, config)
+                comunes = vivo.index.intersection(analizado.index)
+                np.testing.assert_allclose(vivo.loc[comunes].to_numpy(dtype=np.float64),
+                                           analizado.loc[comunes, vivo.columns].to_numpy(dtype=np.float64),
+                                           rtol=1e-7, atol=1e-8, err_msg=f"indicadores distintos en la vela {i}")
+                senal_viva = mt5.process(vivo, symbol, indicadores_calculados=True, config=config, marcos=marcos)
+                senal_completa = mt5.process(completo, symbol, config=config, marcos=marcos_completos)
+                if senal_viva is not None and senal_completa is not None:
+                    ciclos += 1
+                    assert senal_viva['TotalSignal'].iloc[-1] == senal_completa['TotalSignal'].iloc[-1], \
+                        f"señal distinta en la vela {i}"
+        finally:
+            mt5.estados_multitimeframe.pop(symbol, None)
+    assert ciclos > 0
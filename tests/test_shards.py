@@ -0,0 +1,116 @@
+import multiprocessing
+import queue
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import simulador
+
+# Límite global de pérdida diaria con shards: el supervisor suma el equity de las cuentas (cada
+# cuenta una vez aunque la compartan varios shards) y marca el límite; un shard sin pérdida propia
+# que ve el límite marcado cierra sus posiciones y no vuelve a abrir.
+
+MAX_DAILY_LOSS = 4
+CUENTAS = [{"login": 1, "server": "Demo"}, {"login": 2, "server": "Demo"}]
+# Equity (inicio del día, actual) por cuenta: la 1 pierde un 10% y la 2 nada; juntas, un 5%
+EQUITIES = {"1@Demo": (10000.0, 9000.0), "2@Demo": (10000.0, 10000.0)}
+
+
+class ProcesoEnHilo:
+    # Sustituto de multiprocessing.Process: el shard corre en un hilo de este proceso
+    def __init__(self, target, name, args):
+        self.hilo = threading.Thread(target=self._ejecutar, args=(target, args), name=name)
+        self.pid = name
+        self.exitcode = None
+
+    def _ejecutar(self, target, args):
+        try:
+            target(*args)
+            self.exitcode = 0
+        except Exception:
+            self.exitcode = 1
+            raise
+
+    def start(self):
+        self.hilo.start()
+
+    def is_alive(self):
+        return self.hilo.is_alive()
+
+    def terminate(self):
+        pass
+
+    def join(self, timeout=None):
+        self.hilo.join(timeout)
+
+
+@pytest.fixture
+def supervisor(mt5, monkeypatch):
+    # supervisor() con los shards en hilos y 30 símbolos para que los tres shards tengan alguno
+    def supervisor(shard, max_daily_loss):
+        contexto = SimpleNamespace(Queue=queue.Queue, Event=threading.Event, Process=ProcesoEnHilo)
+        monkeypatch.setattr(multiprocessing, "get_context", lambda metodo=None: contexto)
+        monkeypatch.setattr(mt5, "ejecutar_shard", shard)
+        monkeypatch.setattr(mt5, "symbol_config", {f"SIM{i}": {} for i in range(30)})
+        monkeypatch.setattr(mt5, "accounts", CUENTAS)
+        monkeypatch.setattr(mt5, "max_daily_loss", max_daily_loss)
+        return mt5.supervisor(n_shards=3)
+    return supervisor
+
+
+def test_supervisor_marca_el_limite_global(mt5, supervisor):
+    # Cada shard informa una vez de su cuenta y espera al límite como haría verificar_perdida_diaria
+    vistos = {}
+
+    def shard(indice, simbolos, cuenta, cola, limite_global, ciclos, ruta_config):
+        clave = mt5.clave_cuenta(cuenta)
+        cola.put((indice, clave, *EQUITIES[clave]))
+        vistos[indice] = (clave, limite_global.wait(10))
+
+    resultado = supervisor(shard, MAX_DAILY_LOSS)
+    assert resultado['limite_global']
+    assert resultado['cuentas'] == EQUITIES
+    assert mt5.perdida_global(resultado['cuentas']) == pytest.approx(5.0)
+    # El shard de la cuenta sin pérdidas también ve el límite
+    assert vistos == {0: ("1@Demo", True), 1: ("2@Demo", True), 2: ("1@Demo", True)}
+
+
+def test_supervisor_cuenta_una_vez_cada_cuenta(mt5, supervisor):
+    # Con la cuenta 1 contada dos veces la pérdida sería del 6,7%: con un límite del 6% no se marca
+    def shard(indice, simbolos, cuenta, cola, limite_global, ciclos, ruta_config):
+        clave = mt5.clave_cuenta(cuenta)
+        cola.put((indice, clave, *EQUITIES[clave]))
+        # Sigue vivo hasta que el supervisor ha leído la cola
+        limite_global.wait(2)
+
+    resultado = supervisor(shard, 6)
+    assert resultado['cuentas'] == EQUITIES
+    assert not resultado['limite_global']
+
+
+def test_shard_sin_perdida_cierra_con_el_limite_global(mt5, monkeypatch, tmp_path):
+    cola, limite_global = queue.Queue(), threading.Event()
+    monkeypatch.setattr(mt5, "_shard", (1, cola, limite_global))
+    monkeypatch.setattr(mt5, "max_daily_loss", MAX_DAILY_LOSS)
+    monkeypatch.setattr(mt5, "retry_delay", 0)
+    monkeypatch.setattr(mt5, "riesgo", mt5.RiesgoCartera(str(tmp_path / "estado_riesgo.json"), mt5.correlation_window))
+    mercado = simulador.crear_simulador(list(mt5.symbol_config), n_barras=400, spread=5, balance=1e6)
+    with simulador.entorno_simulado(mercado, mercado.reloj):
+        for symbol in mt5.symbol_config:
+            _, ask = mercado._cotizacion(symbol)
+            assert mercado.order_send({"action": mercado.TRADE_ACTION_DEAL, "symbol": symbol, "volume": 1.0,
+                                       "type": mercado.ORDER_TYPE_BUY, "price": ask,
+                                       "type_filling": mercado.ORDER_FILLING_IOC}).retcode == mercado.TRADE_RETCODE_DONE
+        mt5.renovar_instantanea()
+        assert not mt5.verificar_perdida_diaria()
+        indice, clave, inicio, equity = cola.get_nowait()
+        assert indice == 1 and clave == mt5.clave_cuenta(mt5.creds) and inicio == pytest.approx(equity)
+
+        limite_global.set()
+        enviadas = len(mercado.ordenes)
+        mt5.trading_job()
+        assert mercado.positions_get() == ()
+        # Solo cierres: ninguna orden nueva sin posición
+        assert all("position" in request for request in mercado.ordenes[enviadas:])
+        assert not cola.empty()
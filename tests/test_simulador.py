@@ -0,0 +1,99 @@
+import pytest
+
+import simulador
+
+# SimuladorMercado frente a lo que espera el código en vivo de un PasarelaBroker: las órdenes se
+# envían con ejecutar_orden, open_orders, close_orders y cerrar_todas_las_posiciones, y las
+# ejecuciones, los retcodes, las posiciones y el balance deben ser los del libro simulado (3 niveles
+# de 5 lotes por lado, spread fijo de 5 puntos).
+
+SIMBOLOS = ["EURUSD", "AUDNZD"]
+SYMBOL = "EURUSD"
+BALANCE = 1e6
+
+
+@pytest.fixture
+def mercado(mt5, monkeypatch, tmp_path):
+    monkeypatch.setattr(mt5, "retry_delay", 0)
+    monkeypatch.setattr(mt5, "riesgo", mt5.RiesgoCartera(str(tmp_path / "estado_riesgo.json"), mt5.correlation_window))
+    mercado = simulador.crear_simulador(SIMBOLOS, n_barras=400, spread=5, balance=BALANCE)
+    with simulador.entorno_simulado(mercado, mercado.reloj):
+        mt5.renovar_instantanea()
+        yield mercado
+
+
+def solicitud(mercado, tipo, volumen, type_filling, sl=0.0):
+    bid, ask = mercado._cotizacion(SYMBOL)
+    return {"action": mercado.TRADE_ACTION_DEAL, "symbol": SYMBOL, "volume": volumen, "type": tipo,
+            "price": ask if tipo == mercado.ORDER_TYPE_BUY else bid, "sl": sl, "tp": 0.0, "magic": 234000,
+            "type_time": mercado.ORDER_TIME_GTC, "type_filling": type_filling}
+
+
+def test_simulador_es_una_pasarela(mt5, mercado):
+    assert isinstance(mercado, mt5.PasarelaBroker)
+    for nombre, valor in vars(mt5.PasarelaBroker).items():
+        if nombre.startswith("TRADE_RETCODE_") and valor in mercado.COMENTARIOS:
+            assert getattr(mercado, nombre) == valor
+
+
+def test_ioc_ejecuta_lo_que_hay_en_el_libro(mt5, mercado):
+    _, ask = mercado._cotizacion(SYMBOL)
+    mt5.ejecutar_orden(solicitud(mercado, mercado.ORDER_TYPE_BUY, 20.0, mercado.ORDER_FILLING_IOC), "compra", SYMBOL)
+    # Parcial sin reintentos: el resto de una IOC se cancela
+    assert mercado.retcodes == {mercado.TRADE_RETCODE_DONE_PARTIAL: 1}
+    (posicion,) = mercado.positions_get(SYMBOL)
+    assert posicion.type == mercado.POSITION_TYPE_BUY and posicion.volume == 15.0
+    assert posicion.price_open == pytest.approx(sum(ask + k * mercado.punto for k in range(3)) / 3)
+
+
+def test_fok_sin_liquidez_se_rechaza(mt5, mercado):
+    mt5.ejecutar_orden(solicitud(mercado, mercado.ORDER_TYPE_SELL, 20.0, mercado.ORDER_FILLING_FOK), "venta", SYMBOL)
+    assert mercado.retcodes == {mercado.TRADE_RETCODE_REJECT: 3}
+    assert mercado.positions_get() == ()
+    assert mercado.account_info().balance == BALANCE
+
+
+def test_apertura_y_cierre_por_rsi(mt5, mercado):
+    mt5.open_orders(SYMBOL, 2, 2.0, 0.001)
+    posiciones = mercado.positions_get(SYMBOL)
+    assert sum(p.volume for p in posiciones) == pytest.approx(2.0)
+    assert all(p.type == mercado.POSITION_TYPE_BUY and p.sl < p.price_open < p.tp for p in posiciones)
+    # Cerrar al bid del primer nivel realiza exactamente el flotante
+    equity = mercado.account_info().equity
+    mt5.close_orders(mt5.pd.DataFrame({'RSI': [100.0]}), SYMBOL)
+    assert mercado.positions_get() == ()
+    assert mercado.account_info().balance == pytest.approx(equity)
+    assert set(mercado.retcodes) == {mercado.TRADE_RETCODE_DONE}
+
+
+def test_stop_loss_cierra_al_precio_del_stop(mt5, mercado):
+    bid, _ = mercado._cotizacion(SYMBOL)
+    rates = mercado.rates[SYMBOL]
+    futuras = rates[rates['time'] > mercado.tiempo_actual]
+    sl = max(float(futuras['low'][:100].min()), bid - 0.002)
+    assert sl < bid
+    mt5.ejecutar_orden(solicitud(mercado, mercado.ORDER_TYPE_BUY, 1.0, mercado.ORDER_FILLING_IOC, sl=sl), "compra", SYMBOL)
+    (posicion,) = mercado.positions_get(SYMBOL)
+    tocada = int(futuras['time'][futuras['low'] <= sl][0])
+    while mercado.tiempo_actual < tocada:
+        assert len(mercado.positions_get(SYMBOL)) == 1
+        mercado.avanzar()
+    assert mercado.positions_get(SYMBOL) == ()
+    assert mercado.balance == pytest.approx(BALANCE + (sl - posicion.price_open) * mercado.tamano_contrato)
+
+
+def test_cierre_total(mt5, mercado, monkeypatch):
+    monkeypatch.setattr(mt5, "flatten_close_by", True)
+    for symbol in SIMBOLOS:
+        bid, ask = mercado._cotizacion(symbol)
+        for tipo, volumen in ((mercado.ORDER_TYPE_BUY, 1.0), (mercado.ORDER_TYPE_SELL, 2.0)):
+            request = dict(solicitud(mercado, tipo, volumen, mercado.ORDER_FILLING_IOC), symbol=symbol,
+                           price=ask if tipo == mercado.ORDER_TYPE_BUY else bid)
+            assert mercado.order_send(request).retcode == mercado.TRADE_RETCODE_DONE
+    resultado = mt5.cerrar_todas_las_posiciones(plazo=5)
+    assert resultado["abiertas"] == [] and mercado.positions_get() == ()
+    assert not any(resultado["errores"].values())
+    # Cuenta de cobertura: cada compra se cierra contra una venta y el resto a mercado
+    acciones = [request["action"] for request in mercado.ordenes[2 * len(SIMBOLOS):]]
+    assert acciones.count(mercado.TRADE_ACTION_CLOSE_BY) == len(SIMBOLOS)
+    assert acciones.count(mercado.TRADE_ACTION_DEAL) == len(SIMBOLOS)
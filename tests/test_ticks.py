@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import simulador
+
+# Reproducción de ticks frente al camino por velas: ticks sintéticos que pasan por el OHLC de cada
+# vela se sirven con un reloj que el test avanza vela a vela, y cada vela que cierra el modo
+# streaming (FlujoTicks + evaluar_vela_cerrada) debe ser la agregada de una pasada con
+# barras_desde_ticks y dar los mismos indicadores y la misma señal que process() sobre todas esas
+# velas hasta ella (con la tolerancia de test_incremental.py).
+
+SIMBOLOS = ["EURUSD", "AUDNZD", "USDCAD"]
+SEMILLA = 150
+PASOS = 120
+
+
+class TicksConReloj(simulador.MT5TicksGrabados):
+    # El reloj lo fija el test en vez de avanzar con time.monotonic()
+    def tiempo_servidor(self):
+        self.tiempo_actual = int(self.ahora)
+        return self.ahora
+
+
+def dataframe(mt5, rates):
+    df = mt5.pd.DataFrame(rates)
+    df['time'] = mt5.pd.to_datetime(df['time'], unit='s')
+    return df.set_index('time')
+
+
+def test_ticks_sinteticos_reproducen_las_velas(mt5):
+    periodo = mt5.segundos_timeframe(mt5.timeframe)
+    rates = mt5.rates_desde_dataframe(simulador.generar_datos_sinteticos(SEMILLA))
+    barras = simulador.barras_desde_ticks(simulador.generar_ticks_sinteticos(rates, periodo=periodo), periodo)
+    for campo in ('time', 'open', 'high', 'low', 'close', 'spread'):
+        np.testing.assert_array_equal(barras[campo], rates[campo], err_msg=campo)
+
+
+@pytest.mark.parametrize("symbol", SIMBOLOS)
+def test_replay_de_ticks_coincide_con_velas(mt5, monkeypatch, tmp_path, symbol):
+    periodo = mt5.segundos_timeframe(mt5.timeframe)
+    rates = mt5.rates_desde_dataframe(simulador.generar_datos_sinteticos(SEMILLA + PASOS, seed=SIMBOLOS.index(symbol)))
+    ticks = simulador.generar_ticks_sinteticos(rates, periodo=periodo)
+    barras = simulador.barras_desde_ticks(ticks, periodo)
+    falso = TicksConReloj({symbol: ticks}, {symbol: barras}, int(barras['time'][SEMILLA]), periodo=periodo)
+    falso.ahora = float(barras['time'][SEMILLA])
+    primer_tiempo = int(barras['time'][SEMILLA]) - SEMILLA * periodo
+    monkeypatch.setattr(mt5, "riesgo", mt5.RiesgoCartera(str(tmp_path / "estado_riesgo.json"), mt5.correlation_window))
+    cerradas = senales = 0
+    with simulador.entorno_simulado(falso, falso.reloj):
+        mt5.estados_incrementales.pop(symbol, None)
+        try:
+            flujo = mt5.FlujoTicks(symbol, mt5.symbol_config[symbol], periodo)
+            for i in range(SEMILLA, len(barras)):
+                # Justo después del primer tick de la vela i: cierra la i - 1
+                falso.ahora = barras['time'][i] + 0.001
+                velas, _ = flujo.sondear()
+                if flujo.agregador.vencida(falso.ahora):
+                    velas.append(flujo.agregador.cerrar())
+                assert [vela[0] for vela in velas] == [int(barras['time'][i - 1])], f"velas cerradas en la vela {i}"
+                assert tuple(velas[0]) == tuple(barras[i - 1].tolist()), f"vela {i - 1} distinta de la agregada"
+                cerradas += 1
+                streaming = mt5.evaluar_vela_cerrada(flujo, velas[0], operar=False)
+                completo = mt5.process(dataframe(mt5, barras[(barras['time'] >= primer_tiempo) &
+                                                          (barras['time'] < barras['time'][i])]), symbol)
+                if streaming is not None and completo is not None:
+                    senales += 1
+                    assert streaming.index[-1] == completo.index[-1]
+                    columnas = [c for c in streaming.columns if c in completo.columns]
+                    np.testing.assert_allclose(streaming[columnas].iloc[-1].to_numpy(dtype=np.float64),
+                                               completo[columnas].iloc[-1].to_numpy(dtype=np.float64),
+                                               rtol=1e-7, atol=1e-8, err_msg=f"indicadores distintos en la vela {i - 1}")
+                    assert streaming['TotalSignal'].iloc[-1] == completo['TotalSignal'].iloc[-1], \
+                        f"señal distinta en la vela {i - 1}"
+        finally:
+            mt5.estados_incrementales.pop(symbol, None)
+    assert cerradas == PASOS and senales > 0